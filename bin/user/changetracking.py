@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Generators for the healthc skin which write a page or plot only when the values
+feeding it changed.
+
+Most console health values (versions, battery cycle count, bootloader, AirLink
+firmware ...) stay the same for weeks, the healthc report is still generated
+every archive interval. Before a run, the values of the latest archive record
+are hashed:
+
+  - pages (CheetahGenerator): all values of the record and the day of the
+    report time, the pages show the date and the day before
+  - plots (ImageGenerator): the values of the plot lines and the end of the
+    plot: the archive interval of the report time for time series, the
+    aggregation interval for aggregated plots
+
+A page or plot whose hash is the same as in the last run and which is younger
+than max_age is not generated again. Time series plots (aggregate_type = none)
+move with every record and are drawn in every run, aggregated plots only when
+a value or the aggregation interval changed. Uptimes grow with every record, they are
+left out of the hash (ignore_types) and are brought up to date by max_age.
+
+Settings in skin.conf:
+
+[ChangeTracking]
+    max_age = 3600                          # seconds, then generated in any case
+    state_file = healthc_changes.json       # relative to SQLITE_ROOT
+    #ignore_types = appUptimeC, osUptimeC, linkUptimeC, connectionUptimeC, uptimeA, linkUptimeA
+
+[Generators]
+    generator_list = user.changetracking.ChangeTrackingCheetahGenerator, user.changetracking.ChangeTrackingImageGenerator, ...
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import weewx.cheetahgenerator
+import weewx.imagegenerator
+import weeutil.weeutil
+
+import user.davisconsoleutil
+import user.plotcache
+
+try:
+    from weeutil.config import accumulateLeaves
+except ImportError:
+    from weeutil.weeutil import accumulateLeaves
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "ChangeTracking: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+DEFAULT_IGNORE = ['appUptimeC', 'osUptimeC', 'linkUptimeC', 'connectionUptimeC', 'uptimeA', 'linkUptimeA']
+
+# Keys of a record which are not values
+SKIP_KEYS = ('dateTime', 'interval')
+
+
+class ChangeTracker(object):
+    """Hashes of the inputs of the pages and plots of a report and when they were generated"""
+
+    def __init__(self, generator):
+        options = generator.skin_dict.get('ChangeTracking', {})
+        self.max_age = int(options.get('max_age', 3600))
+        ignore = weeutil.weeutil.option_as_list(options.get('ignore_types'))
+        self.ignore_types = set(ignore if ignore is not None else DEFAULT_IGNORE)
+        self.path = user.davisconsoleutil.state_path(
+            generator.config_dict,
+            options.get('state_file', "%s_changes.json" % generator.skin_dict.get('REPORT_NAME', 'report')))
+        self.generator = generator
+        self.records = {}
+
+    def latest(self, binding):
+        """The record of the report time in binding, {} if there is none"""
+        if binding not in self.records:
+            try:
+                dbm = self.generator.db_binder.get_manager(binding)
+                ts = self.generator.gen_ts or dbm.lastGoodStamp()
+                self.records[binding] = (dbm.getRecord(ts) if ts else None) or {}
+            except Exception as error:
+                logerr("No record of %s: %s" % (binding, error))
+                self.records[binding] = {}
+        return self.records[binding]
+
+    def fingerprint(self, binding, obs_types=None, extra=None):
+        """Hash of the values of obs_types (default all) in the latest record, None if there is no record"""
+        record = self.latest(binding)
+        if not record:
+            # Nothing to compare, generate
+            return None
+        if obs_types is None:
+            obs_types = [k for k in record if k not in SKIP_KEYS]
+        elif any(k not in record for k in obs_types):
+            # Derived type (windvec, ...), its inputs are not known
+            return None
+        values = dict((k, record.get(k)) for k in obs_types if k not in self.ignore_types)
+        values[''] = extra
+        return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def load(self, section):
+        return user.davisconsoleutil.read_json(self.path, {}).get(section, {})
+
+    def unchanged(self, state, name, fingerprint, now):
+        entry = state.get(name)
+        return fingerprint is not None and entry is not None and entry[0] == fingerprint \
+            and now - entry[1] < self.max_age
+
+    def save(self, section, state):
+        data = user.davisconsoleutil.read_json(self.path, {})
+        data[section] = state
+        user.davisconsoleutil.write_json(self.path, data)
+
+
+class ChangeTrackingCheetahGenerator(weewx.cheetahgenerator.CheetahGenerator):
+    """CheetahGenerator which does not run while the values of the latest record are the same"""
+
+    def run(self):
+        tracker = ChangeTracker(self)
+        state = tracker.load('pages')
+        now = time.time()
+        binding = self.skin_dict.get('data_binding', 'wx_binding')
+        # Pages show the day ($current.dateTime, $yesterday, has_data of $day/$week/$month)
+        ts = tracker.latest(binding).get('dateTime')
+        fingerprint = tracker.fingerprint(binding, extra=weeutil.weeutil.startOfDay(ts) if ts else None)
+        if tracker.unchanged(state, binding, fingerprint, now):
+            logdbg("Pages of report %s skipped, no values changed" % self.skin_dict.get('REPORT_NAME'))
+            return
+        super(ChangeTrackingCheetahGenerator, self).run()
+        state[binding] = [fingerprint, now]
+        tracker.save('pages', state)
+
+
+class ChangeTrackingImageGenerator(user.plotcache.CachedImageGenerator):
+    """Plot series cache plus: a plot is not drawn while the values of its lines are the same"""
+
+    def run(self):
+        self.tracker = ChangeTracker(self)
+        self.plot_state = self.tracker.load('plots')
+        self.plot_inputs = self._plot_inputs()
+        self.skipped = 0
+        self.tracking_thread = threading.current_thread().ident
+
+        # The ImageGenerator asks _skip_this_plot() (weewx 4: skipThisPlot()) for every plot
+        names = [name for name in ('_skip_this_plot', 'skipThisPlot') if hasattr(weewx.imagegenerator, name)]
+        originals = dict((name, getattr(weewx.imagegenerator, name)) for name in names)
+        for name in names:
+            setattr(weewx.imagegenerator, name, self._skip_function(originals[name]))
+        try:
+            super(ChangeTrackingImageGenerator, self).run()
+        finally:
+            for name in names:
+                setattr(weewx.imagegenerator, name, originals[name])
+        self.tracker.save('plots', self.plot_state)
+        logdbg("%d plots skipped, no values changed" % self.skipped)
+
+    def _plot_inputs(self):
+        """{image file: (binding, observation types of the lines, aggregation interval)}"""
+        inputs = {}
+        image_dict = self.skin_dict.get('ImageGenerator', {})
+        for timespan in image_dict.sections:
+            for plot_name in image_dict[timespan].sections:
+                plot_dict = image_dict[timespan][plot_name]
+                plot_options = accumulateLeaves(plot_dict)
+                img_file = os.path.join(self.config_dict['WEEWX_ROOT'], plot_options['HTML_ROOT'],
+                                        '%s.png' % plot_name)
+                obs_types = [accumulateLeaves(plot_dict[line]).get('data_type', line) for line in plot_dict.sections]
+                aggregate_interval = weeutil.weeutil.nominal_spans(plot_options.get('aggregate_interval')) \
+                    if plot_options.get('aggregate_type', 'none').lower() not in ('', 'none') else None
+                inputs[img_file] = (plot_options.get('data_binding', 'wx_binding'), obs_types, aggregate_interval)
+        return inputs
+
+    def _skip_function(self, original):
+        def skip_this_plot(*args):
+            if original(*args):
+                return True
+            img_file = args[-1]
+            if threading.current_thread().ident != self.tracking_thread or img_file not in self.plot_inputs:
+                return False
+            binding, obs_types, aggregate_interval = self.plot_inputs[img_file]
+            # The time window is an input as well: a time series plot ends at args[0] (report time),
+            # an aggregated plot gets a new bar or point with the next aggregation interval
+            if aggregate_interval:
+                end = int(args[0] // aggregate_interval)
+            else:
+                interval = self.tracker.latest(binding).get('interval') or 1
+                end = int(args[0] // (interval * 60))
+            fingerprint = self.tracker.fingerprint(binding, obs_types, end)
+            now = time.time()
+            if os.path.exists(img_file) and self.tracker.unchanged(self.plot_state, img_file, fingerprint, now):
+                self.skipped += 1
+                return True
+            self.plot_state[img_file] = [fingerprint, now]
+            return False
+        return skip_this_plot
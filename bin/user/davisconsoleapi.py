@@ -79,6 +79,9 @@ Settings in weewx.conf:
     txid_wind = None        # supported ?
     airlink = 0 		# Airlink Sensor available?
     packet_log = 0
+    write_buffer = 0        # 1 = service writes archive records through a write-ahead buffer
+    #sqlite_profile = wal   # SQLite tuning profile, see davisconsoletuning.py
+    rollups = 0             # 1 = service keeps hourly/daily rollups and plots of its binding read them, see davisconsolerollup.py
 
 #packet_log = -1 -> only current rain
 #packet_log = 0 -> none logging
@@ -92,6 +95,14 @@ Settings in weewx.conf:
 #packet_log = 8 -> current health packets
 #packet_log = 9 -> all current packets
 
+# instead of packet_log 2..9: debug dumps per category, sampled or rate limited, to an own rotating file
+#   dump = iss, health        # console, iss, leaf_soil, extra, wind_rain, iss2, health, raw or all
+#   dump_file = /var/log/weewx/davisconsole_dump.log   # default: weewx log
+#   dump_max_bytes = 1048576
+#   dump_backup_count = 3
+#   dump_sample = 1           # dump every n-th record
+#   dump_interval = 0         # minimum seconds between two dumps of a record
+
 
 [Accumulator]
    [[consoleRadioVersionC]]
@@ -504,6 +515,72 @@ weewx.units.obs_group_dict["tFreeMemA"] = "group_data"
 
 MM2INCH = 1 / 25.4
 
+
+class PacketDump(object):
+    """Debug dumps of the API sensor records, per category.
+
+    Nothing is formatted unless the category is selected and the record passes
+    the sampling (every n-th) and the rate limit (seconds between two dumps).
+    With dump_file the dumps go to an own rotating file instead of the weewx log.
+    """
+
+    # packet_log level -> category, used if no 'dump' option is set
+    LEVELS = {2: "console", 3: "iss", 4: "leaf_soil", 5: "extra", 6: "wind_rain",
+              7: "iss2", 8: "health", 9: "raw"}
+    CATEGORIES = frozenset(LEVELS.values())
+
+    def __init__(self, options, packet_log):
+        categories = weeutil.weeutil.option_as_list(options.get("dump", None))
+        if categories is None:
+            level = min(packet_log, 9)
+            categories = [self.LEVELS[level]] if level in self.LEVELS else []
+        if "all" in categories:
+            categories = self.CATEGORIES
+        self.categories = frozenset(c for c in categories if c in self.CATEGORIES)
+        self.sample = max(1, weeutil.weeutil.to_int(options.get("dump_sample", 1)))
+        self.interval = weeutil.weeutil.to_int(options.get("dump_interval", 0))
+        self.counts = dict()
+        self.last = dict()
+
+        self.logger = None
+        dump_file = options.get("dump_file", None)
+        if dump_file and self.categories:
+            import logging
+            import logging.handlers
+            self.logger = logging.getLogger("%s.dump" % __name__)
+            if not self.logger.handlers:
+                # driver and service in one weewx share the file
+                handler = logging.handlers.RotatingFileHandler(
+                    dump_file,
+                    maxBytes=weeutil.weeutil.to_int(options.get("dump_max_bytes", 1048576)),
+                    backupCount=weeutil.weeutil.to_int(options.get("dump_backup_count", 3)))
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self.logger.setLevel(logging.INFO)
+                self.logger.propagate = False
+                self.logger.addHandler(handler)
+        if self.categories:
+            loginf("packet dump %s to %s" % (", ".join(sorted(self.categories)), dump_file or "weewx log"))
+
+    def dump(self, category, name, data):
+        """Dump data under name if category is selected, sampled and not rate limited"""
+        if category not in self.categories:
+            return
+        count = self.counts.get(name, 0) + 1
+        self.counts[name] = count
+        if (count - 1) % self.sample:
+            return
+        if self.interval:
+            now = time.time()
+            if now - self.last.get(name, 0) < self.interval:
+                return
+            self.last[name] = now
+        text = json.dumps(data, separators=(",", ":"), default=str)
+        if self.logger is not None:
+            self.logger.info("%s %s: %s" % (category, name, text))
+        else:
+            loginf("%s: %s" % (name, text))
+
+
 def loader(config_dict, engine):
     return DavisConsoleAPIDriver(**config_dict[DRIVER_NAME])
 
@@ -1132,8 +1209,7 @@ def decode_current_json(data, self):
 
 
     if iss_data:
-      if self.packet_log == 3:
-           loginf("iss_data: %s" % iss_data)
+      self.packet_dump.dump("iss", "iss_data", iss_data)
       values = iss_data["data"][0]
       #loginf("iss values: %s" % values)
       #loginf("iss temp: %s" % values["temp"])
@@ -1254,8 +1330,7 @@ def decode_current_json(data, self):
         c_packet["afc"] = values["freq_index"]
 
     if c_bar_data:
-        if self.packet_log == 2:
-           loginf("c_bar_data: %s" % c_bar_data)
+        self.packet_dump.dump("console", "c_bar_data", c_bar_data)
         values = c_bar_data["data"][0]
         #c_packet["altimeter"] = values["bar_sea_level"]
         #if c_bar_data.get("bar_absolute"):
@@ -1265,8 +1340,7 @@ def decode_current_json(data, self):
         #loginf("barometer: %s" % c_packet["barometer"])
 
     if c_temp_hum_data:
-        if self.packet_log == 2:
-           loginf("c_temp_hum_data: %s" % c_temp_hum_data)
+        self.packet_dump.dump("console", "c_temp_hum_data", c_temp_hum_data)
         values = c_temp_hum_data["data"][0]
         #loginf("temp_in: %s" % values["temp_in"])
 
@@ -1276,8 +1350,7 @@ def decode_current_json(data, self):
         #loginf("inTemp: %s" % c_packet["inTemp"])
 
     if leaf_data:
-        if self.packet_log == 4:
-           loginf("leaf_data: %s" % leaf_data)
+        self.packet_dump.dump("leaf_soil", "leaf_data", leaf_data)
 
         values = leaf_data["data"][0]
 
@@ -1297,8 +1370,7 @@ def decode_current_json(data, self):
         c_packet["afc7"] = values["freq_index"]
 
     if soil_data:
-        if self.packet_log == 4:
-           loginf("soil_data: %s" % soil_data)
+        self.packet_dump.dump("leaf_soil", "soil_data", soil_data)
 
         values = soil_data["data"][0]
 
@@ -1322,8 +1394,7 @@ def decode_current_json(data, self):
         c_packet["afc8"] = values["freq_index"]
 
     if leaf_soil_data:
-        if self.packet_log == 4:
-           loginf("leaf_soil_data: %s" % leaf_soil_data)
+        self.packet_dump.dump("leaf_soil", "leaf_soil_data", leaf_soil_data)
 
         values = leaf_soil_data["data"][0]
 
@@ -1349,8 +1420,7 @@ def decode_current_json(data, self):
         c_packet["afc6"] = values["freq_index"]
 
     if extra_data1:
-        if self.packet_log == 5:
-           loginf("extra_data1: %s" % extra_data1)
+        self.packet_dump.dump("extra", "extra_data1", extra_data1)
         values = extra_data1["data"][0]
 
         c_packet["extraTemp1"] = values["temp"]
@@ -1384,8 +1454,7 @@ def decode_current_json(data, self):
         c_packet["afc2"] = values["freq_index"]
 
     if extra_data2:
-        if self.packet_log == 5:
-           loginf("extra_data2: %s" % extra_data2)
+        self.packet_dump.dump("extra", "extra_data2", extra_data2)
         values = extra_data2["data"][0]
 
         c_packet["extraTemp2"] = values["temp"]
@@ -1418,8 +1487,7 @@ def decode_current_json(data, self):
         c_packet["afc3"] = values["freq_index"]
 
     if extra_data3:
-        if self.packet_log == 5:
-           loginf("extra_data3: %s" % extra_data3)
+        self.packet_dump.dump("extra", "extra_data3", extra_data3)
         values = extra_data3["data"][0]
 
         if values.get("temp"):
@@ -1458,8 +1526,7 @@ def decode_current_json(data, self):
         c_packet["afc4"] = values["freq_index"]
 
     if extra_data4:
-        if self.packet_log == 5:
-           loginf("extra_data4: %s" % extra_data4)
+        self.packet_dump.dump("extra", "extra_data4", extra_data4)
         values = extra_data4["data"][0]
 
         if values.get("temp"):
@@ -1498,8 +1565,7 @@ def decode_current_json(data, self):
         c_packet["afc5"] = values["freq_index"]
 
     if wind_data:
-      if self.packet_log == 6:
-           loginf("wind_data: %s" % wind_data)
+      self.packet_dump.dump("wind_rain", "wind_data", wind_data)
       try:
         values = wind_data["data"][0]
       
@@ -1556,8 +1622,7 @@ def decode_current_json(data, self):
      
 
     if rain_data:
-      if self.packet_log == 6:
-           loginf("rain_data: %s" % rain_data)
+      self.packet_dump.dump("wind_rain", "rain_data", rain_data)
       try:
         values = rain_data["data"][0]
 
@@ -1658,8 +1723,7 @@ def decode_current_json(data, self):
         logerr("Problem with Rain data.")
 
     if iss2_data:
-      if self.packet_log == 7:
-         loginf("iss2_data: %s" % iss2_data)
+      self.packet_dump.dump("iss2", "iss2_data", iss2_data)
       values = iss2_data["data"][0]
       if values["temp"]:
         c_packet["windSpeed_2"] = values["wind_speed_last"]
@@ -1782,8 +1846,7 @@ def decode_current_json(data, self):
            c_packet["windrun_2"] = c_packet["windSpeed_2"] * 2.5 / 60.0 #(miles)
 
     if airlink_data:
-        if self.packet_log == 5:
-           loginf("airlink_data: %s" % airlink_data)
+        self.packet_dump.dump("extra", "airlink_data", airlink_data)
         values = airlink_data["data"][0]
 
         #c_packet['last_report_time'] = values['last_report_time']
@@ -1828,8 +1891,7 @@ def decode_current_json(data, self):
            loginf("Found current Health data")
            self.health_found = True
 
-        if self.packet_log == 8:
-           loginf("health_data: %s" % health_data)
+        self.packet_dump.dump("health", "health_data", health_data)
         values = health_data["data"][0]
 
         c_packet["consoleBatteryC"] = values["battery_voltage"]
@@ -1867,8 +1929,7 @@ def decode_current_json(data, self):
            loginf("Found current Airlink Health data")
            self.airlinkhealth_found = True
 
-        if self.packet_log == 8:
-           loginf("airlinkhealth_data: %s" % airlinkhealth_data)
+        self.packet_dump.dump("health", "airlinkhealth_data", airlinkhealth_data)
         values = airlinkhealth_data["data"][0]
 
         c_packet["rssiA"] = values["wifi_rssi"]
@@ -1902,7 +1963,7 @@ class DavisConsoleApi(StdService):
     """Collect Davis sensor information."""
 
     def __init__(self, engine, config_dict):
-        super(DavisConsoleAPI, self).__init__(engine, config_dict)
+        super(DavisConsoleApi, self).__init__(engine, config_dict)
         loginf("Version is %s" % DRIVER_VERSION)
 
         options = config_dict.get("DavisConsoleAPI", {})
@@ -1917,6 +1978,7 @@ class DavisConsoleApi(StdService):
         self.api_secret = options.get("api_secret", None)
         self.station_id = options.get("station_id", None)
         self.packet_log = weeutil.weeutil.to_int(options.get("packet_log", 0))
+        self.packet_dump = PacketDump(options, self.packet_log)
  
         self.max_count = 0
         self.found = False
@@ -1952,12 +2014,12 @@ class DavisConsoleApi(StdService):
         self.txid_extra2 = weeutil.weeutil.to_int(options.get("txid_extra2", None))
         self.txid_extra3 = weeutil.weeutil.to_int(options.get("txid_extra3", None))
         self.txid_extra4 = weeutil.weeutil.to_int(options.get("txid_extra4", None))
-        self.txid_leaf_soil = weeutil.weeutil.to_int(stn_dict.get("txid_leaf_soil", None))
+        self.txid_leaf_soil = weeutil.weeutil.to_int(options.get("txid_leaf_soil", None))
         self.txid_leaf = weeutil.weeutil.to_int(options.get("txid_leaf", None))
         self.txid_soil = weeutil.weeutil.to_int(options.get("txid_soil", None))
         self.txid_wind = weeutil.weeutil.to_int(options.get("txid_wind", None))
         self.txid_rain = weeutil.weeutil.to_int(options.get("txid_rain", None))
-        self.airlink = weeutil.weeutil.to_int(stn_dict.get("airlink", 0))
+        self.airlink = weeutil.weeutil.to_int(options.get("airlink", 0))
 
         # get the database parameters we need to function
         binding = options.get("data_binding", "wx_binding")
@@ -1965,6 +2027,14 @@ class DavisConsoleApi(StdService):
             data_binding=binding, initialize=True
         )
 
+        # optional SQLite tuning (WAL etc.), see davisconsoletuning.py
+        if options.get("sqlite_profile") is not None:
+            import user.davisconsoletuning
+            settings = user.davisconsoletuning.get_settings(options, profile_key="sqlite_profile")
+            journal_mode = user.davisconsoletuning.apply_sqlite_tuning(self.dbm.connection, settings)
+            if journal_mode is not None:
+                loginf("SQLite tuning %s, journal_mode %s" % (options.get("sqlite_profile"), journal_mode))
+
         # be sure schema in database matches the schema we have
         dbcol = self.dbm.connection.columnsOf(self.dbm.table_name)
         dbm_dict = weewx.manager.get_manager_dict(
@@ -1976,6 +2046,35 @@ class DavisConsoleApi(StdService):
         #        "davisconsoleapi schema mismatch: %s != %s" % (dbcol, memcol)
         #    )
 
+        # hourly/daily rollups of the records of this service, see davisconsolerollup.py
+        self.rollups = None
+        self.buffer_rollups = None
+        self.rollup_xtype = None
+        if weeutil.weeutil.to_bool(options.get("rollups", False)):
+            import user.davisconsolerollup
+            import weewx.xtypes
+            self.rollups = user.davisconsolerollup.RollupStore(self.dbm)
+            try:
+                self.rollups.catch_up()
+            except Exception as error:
+                logerr("Rollup catch up failed: %s" % error)
+            # aggregated series of the reports on this binding from the rollups
+            self.rollup_xtype = user.davisconsolerollup.RollupSeries(self.rollups)
+            weewx.xtypes.xtypes.insert(0, self.rollup_xtype)
+
+        # write-ahead buffer, so a locked or unreachable database doesn't block or lose records
+        self.buffer = None
+        if weeutil.weeutil.to_bool(options.get("write_buffer", False)):
+            import user.davisconsolebuffer
+            self.buffer = user.davisconsolebuffer.ArchiveBuffer(
+                config_dict, binding,
+                options.get("buffer_file", "davisconsole_buffer.jsonl"),
+                batch_size=weeutil.weeutil.to_int(options.get("buffer_batch", 50)),
+                retry_wait=weeutil.weeutil.to_int(options.get("buffer_retry", 30)),
+                max_attempts=weeutil.weeutil.to_int(options.get("buffer_attempts", 5)),
+                on_flushed=self.fold_buffered if self.rollups is not None else None)
+            loginf("write buffer is %s" % self.buffer.path)
+
         self.last_ts = None
         self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
 
@@ -2014,8 +2113,7 @@ class DavisConsoleApi(StdService):
           uerror = True
           logerr("Error: %s" % 'API rate limit exceeded')
         if uerror == False: 
-          if self.packet_log == 9:
-            loginf("all_c_data: %s" % data)
+          self.packet_dump.dump("raw", "all_c_data", data)
           c_packet = decode_current_json(data, self)
         else:
           c_error = True  
@@ -2031,6 +2129,10 @@ class DavisConsoleApi(StdService):
 
     def shutDown(self):
         """close database"""
+        if self.buffer is not None:
+            self.buffer.shutDown()
+        if self.rollup_xtype is not None:
+            weewx.xtypes.xtypes.remove(self.rollup_xtype)
         try:
             self.dbm.close()
         except Exception as error:
@@ -2046,12 +2148,29 @@ class DavisConsoleApi(StdService):
             return
 
         if self.last_ts is not None:
-            self.save_data(self.get_packet(now, self.last_ts))
+            record = self.get_packet(now, self.last_ts)
+            self.save_data(record)
+            # buffered records are folded in by the flusher, once they are in the database
+            if self.rollups is not None and self.buffer is None:
+                try:
+                    self.rollups.add_record(record)
+                except Exception as error:
+                    logerr("Rollup update failed: %s" % error)
         self.last_ts = now
 
     def save_data(self, record):
         """save data to database"""
-        self.dbm.addRecord(record)
+        if self.buffer is not None:
+            self.buffer.append(record)
+        else:
+            self.dbm.addRecord(record)
+
+    def fold_buffered(self, dbm):
+        """Fold the records the write buffer stored into the rollups, runs in the flusher thread"""
+        if self.buffer_rollups is None or self.buffer_rollups.dbm is not dbm:
+            import user.davisconsolerollup
+            self.buffer_rollups = user.davisconsolerollup.RollupStore(dbm)
+        self.buffer_rollups.catch_up()
 
     def get_packet(self, now_ts, last_ts):
         """Retrieves and assembles the final packet"""
@@ -2099,6 +2218,7 @@ class DavisConsoleAPIDriver(weewx.drivers.AbstractDevice):
         self.api_secret = stn_dict.get("api_secret", None)
         self.station_id = stn_dict.get("station_id", None)
         self.packet_log = weeutil.weeutil.to_int(stn_dict.get("packet_log", 0))
+        self.packet_dump = PacketDump(stn_dict, self.packet_log)
 
         self.max_count = 0
         self.found = False
@@ -2202,8 +2322,7 @@ class DavisConsoleAPIDriver(weewx.drivers.AbstractDevice):
         #  uerror = True
 
         if uerror == False: 
-          if self.packet_log >= 9:
-            loginf("all_c_data: %s" % data)
+          self.packet_dump.dump("raw", "all_c_data", data)
           c_packet = decode_current_json(data, self)
         else:
           c_error = True  
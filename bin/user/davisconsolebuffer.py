@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Write-ahead buffer for the archive records of the DavisConsoleAPI service.
+
+The record is appended to a small journal file (one JSON line per record,
+fsync'ed) and a background thread drains the journal into the data binding
+in batches. If the database is locked (SQLite during report generation) or
+not reachable (MySQL), the records stay in the journal and are written later.
+A record is removed from the journal only after it is found in the database.
+A record the database refuses while it takes the others (addRecord raises on it
+or skips it) is tried buffer_attempts times, then moved to <buffer_file>.rejected
+and logged, so it doesn't hold back the records behind it.
+Work which needs the records in the database (the rollups of davisconsolerollup.py)
+is done by the flusher as well, once the journal is empty (on_flushed).
+
+Settings in weewx.conf:
+
+[DavisConsoleAPI]
+    write_buffer = 1                        # 0 = write directly to the database (default)
+    buffer_file = davisconsole_buffer.jsonl # relative to SQLITE_ROOT
+    buffer_batch = 50                       # records per database transaction
+    buffer_retry = 30                       # seconds to wait after a database error
+    buffer_attempts = 5                     # tries of a refused record before it is rejected
+"""
+
+import json
+import os
+import threading
+
+import weedb
+import weewx.manager
+
+import user.davisconsoleutil
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "DavisConsoleBuffer: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+class ArchiveBuffer(object):
+    """Journal file plus background flusher for archive records"""
+
+    def __init__(self, config_dict, binding, path, batch_size=50, retry_wait=30, max_attempts=5,
+                 on_flushed=None):
+        self.config_dict = config_dict
+        self.binding = binding
+        self.path = user.davisconsoleutil.state_path(config_dict, path)
+        self.batch_size = max(1, batch_size)
+        self.retry_wait = max(1, retry_wait)
+        # Failed attempts per record the database refuses while it takes others, by dateTime
+        self.max_attempts = max(1, max_attempts)
+        self.attempts = {}
+        # on_flushed(dbm) is called by the flusher thread when all records are in the database
+        self.on_flushed = on_flushed
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = True
+        self.dbm = None
+
+        pending = len(self._read_pending())
+        if pending:
+            loginf("%d buffered archive records found in %s" % (pending, self.path))
+            self.wakeup.set()
+
+        self.thread = threading.Thread(target=self._run, name='DavisConsoleBuffer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, record):
+        """Append a record to the journal, returns without touching the database"""
+        if record.get('dateTime') is None:
+            logerr("Record without dateTime not buffered: %s" % record)
+            return
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        self.wakeup.set()
+
+    def shutDown(self):
+        """Stop the flusher, a last flush is tried before the thread ends"""
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(10.0)
+        if self.thread.is_alive():
+            logerr("Buffer flusher did not stop, records stay in %s" % self.path)
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.retry_wait)
+            self.wakeup.clear()
+            if not self.flush() and self.running:
+                # Database not usable, wait before the next try
+                self.wakeup.wait(self.retry_wait)
+        # Records appended while the last flush ran
+        self.flush()
+        self._close()
+
+    def flush(self):
+        """Write all journal records to the database, returns False on a database error"""
+        pending = self._read_pending()
+        written = False
+        skipped = []
+        refused = set()
+        while pending:
+            batch = pending[:self.batch_size]
+            pending = pending[len(batch):]
+            try:
+                if self.dbm is None:
+                    self.dbm = weewx.manager.open_manager_with_config(self.config_dict, self.binding)
+                done, failed = self._write(batch)
+            except Exception as error:
+                logerr("Buffered records not written, retry in %s sec: %s" % (self.retry_wait, error))
+                self._close()
+                return False
+            self._remove(done)
+            written = written or bool(done)
+            # addRecord logs and skips records it could not write, e.g. "database is locked"
+            skipped.extend(r for r in batch if r['dateTime'] not in done)
+            refused.update(failed)
+        if skipped and not written:
+            # A skipped record counts as failed only if the database takes others or addRecord raised on it
+            skipped = [r for r in skipped if r['dateTime'] in refused]
+            if not skipped:
+                logerr("Buffered records not written, retry in %s sec" % self.retry_wait)
+                return False
+        if skipped and self._reject(skipped) < len(skipped):
+            # The database takes the other records, these ones are tried again later
+            return True
+        if written and self.on_flushed is not None:
+            try:
+                self.on_flushed(self.dbm)
+            except Exception as error:
+                logerr("After flush: %s" % error)
+        return True
+
+    def _write(self, batch):
+        """Write a batch, one record at a time if the batch fails
+
+        Returns the timestamps stored and the timestamps of records addRecord raised on."""
+        failed = set()
+        try:
+            self.dbm.addRecord(batch)
+        except Exception as error:
+            # One bad record rolls back the whole batch, find it
+            logdbg("Batch not written, one record at a time: %s" % error)
+            for record in batch:
+                try:
+                    self.dbm.addRecord(record)
+                except weedb.OperationalError:
+                    # Locked or gone, not a problem of the record
+                    raise
+                except Exception as error:
+                    logerr("Buffered record %s not written: %s" % (record['dateTime'], error))
+                    failed.add(record['dateTime'])
+        done = self._stored(batch)
+        for ts in done:
+            self.attempts.pop(ts, None)
+        return done, failed - done
+
+    def _reject(self, skipped):
+        """Count a failed attempt per record, move records after max_attempts to the .rejected file"""
+        rejected = []
+        for record in skipped:
+            ts = record['dateTime']
+            self.attempts[ts] = self.attempts.get(ts, 0) + 1
+            if self.attempts[ts] >= self.max_attempts:
+                rejected.append(record)
+        if not rejected:
+            logerr("%d buffered records not written, next try in %s sec" % (len(skipped), self.retry_wait))
+            return 0
+        with self.lock:
+            with open(self.path + '.rejected', 'a') as f:
+                for record in rejected:
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        done = set(record['dateTime'] for record in rejected)
+        self._remove(done)
+        for ts in done:
+            del self.attempts[ts]
+        logerr("%d buffered records not written after %d attempts, moved to %s.rejected: %s"
+               % (len(done), self.max_attempts, self.path, sorted(done)))
+        return len(rejected)
+
+    def _stored(self, batch):
+        """Return the set of timestamps of batch which are in the database"""
+        timestamps = [r['dateTime'] for r in batch]
+        sql = "SELECT dateTime FROM %s WHERE dateTime >= ? AND dateTime <= ?" % self.dbm.table_name
+        found = set(row[0] for row in self.dbm.genSql(sql, (min(timestamps), max(timestamps))))
+        return found.intersection(timestamps)
+
+    def _read_pending(self):
+        with self.lock:
+            try:
+                with open(self.path, 'r') as f:
+                    lines = f.readlines()
+            except (IOError, OSError):
+                return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn last line after a power failure, the record is lost anyway
+                logerr("Skipping unreadable buffer line: %s" % line.strip())
+        return records
+
+    def _remove(self, done):
+        """Rewrite the journal without the records already in the database"""
+        if not done:
+            return
+        with self.lock:
+            try:
+                with open(self.path, 'r') as f:
+                    lines = f.readlines()
+            except (IOError, OSError):
+                return
+            keep = []
+            for line in lines:
+                try:
+                    if json.loads(line).get('dateTime') in done:
+                        continue
+                except ValueError:
+                    continue
+                keep.append(line)
+            user.davisconsoleutil.atomic_write(self.path, ''.join(keep).encode('utf-8'))
+        logdbg("%d records removed from the buffer" % len(done))
+
+    def _close(self):
+        if self.dbm is not None:
+            try:
+                self.dbm.close()
+            except Exception as error:
+                logerr("Database exception: %s" % error)
+            self.dbm = None
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Columnar export of the davisconsoleapi archive (wview_davisconsoleapi schema)
+to Parquet or Arrow files for offline analysis.
+
+The archive is read in chunks of rows ordered by dateTime and written as one
+file per month and chunk:
+
+    <output>/year=2024/month=05/part-1714521600-1714607700.parquet
+
+This is the usual "hive" layout, pyarrow.dataset, pandas, duckdb or polars read
+the whole directory as one table. Text columns (consoleSwVersionC,
+consoleOsVersionC, consoleRadioVersionC) are dictionary encoded, INTEGER
+columns are int64 and REAL columns float64. Months are UTC months.
+
+The last exported dateTime is kept in <output>/export_manifest.json. The next
+run exports only newer rows (incremental append), --full starts again.
+
+Needs pyarrow:  pip3 install pyarrow
+
+Usage:
+    PYTHONPATH=/usr/share/weewx python3 davisconsoleexport.py --config=/etc/weewx/weewx.conf --output=/home/pi/export
+    options: --binding=wx_binding --format=parquet|arrow --chunk=50000 --full
+"""
+
+from __future__ import print_function
+
+import os
+import time
+
+import weewx
+import weewx.manager
+
+import user.davisconsoleutil
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "DavisConsoleExport: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MANIFEST = 'export_manifest.json'
+
+
+def arrow_schema(dbm):
+    """Return column names and the pyarrow schema of the archive table"""
+    names = []
+    fields = []
+    for column in dbm.connection.genSchemaOf(dbm.table_name):
+        name, sql_type = column[1], column[2].upper()
+        if sql_type.startswith('INT'):
+            arrow_type = pyarrow.int64()
+        elif sql_type in ('REAL', 'FLOAT', 'DOUBLE') or sql_type.startswith('DEC'):
+            arrow_type = pyarrow.float64()
+        else:
+            arrow_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        names.append(name)
+        fields.append(pyarrow.field(name, arrow_type))
+    return names, pyarrow.schema(fields)
+
+
+def build_table(rows, schema):
+    """Turn a list of row tuples into a pyarrow table, column by column"""
+    arrays = []
+    for values, field in zip(zip(*rows), schema):
+        if pyarrow.types.is_dictionary(field.type):
+            arrays.append(pyarrow.array(values, type=pyarrow.string()).dictionary_encode())
+        else:
+            arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+class ArchiveExporter(object):
+    """Streams the archive in dateTime order into monthly columnar files"""
+
+    def __init__(self, dbm, output, file_format='parquet', chunk_size=50000):
+        self.dbm = dbm
+        self.output = output
+        self.file_format = file_format
+        self.chunk_size = chunk_size
+        self.names, self.schema = arrow_schema(dbm)
+        self.manifest_path = os.path.join(output, MANIFEST)
+
+    def export(self, full=False):
+        """Export all rows newer than the manifest, returns the number of rows"""
+        manifest = user.davisconsoleutil.read_json(self.manifest_path, {}) if not full else {}
+        if manifest.get('columns', self.names) != self.names:
+            # A column was added to the database, older files keep their schema
+            loginf("Archive columns changed since last export")
+        last_ts = manifest.get('last_ts', 0)
+
+        sql = "SELECT %s FROM %s WHERE dateTime > ? ORDER BY dateTime LIMIT %d" % (
+            ", ".join(self.names), self.dbm.table_name, self.chunk_size)
+        total = 0
+        files = manifest.get('files', 0)
+        while True:
+            rows = list(self.dbm.genSql(sql, (last_ts,)))
+            if not rows:
+                break
+            for month, month_rows in self._by_month(rows):
+                self._write(month, month_rows)
+                files += 1
+            last_ts = rows[-1][0]
+            total += len(rows)
+            # Update the manifest after every chunk, an interrupted export continues here
+            user.davisconsoleutil.write_json(self.manifest_path, {
+                'last_ts': last_ts, 'columns': self.names, 'files': files,
+                'format': self.file_format, 'updated': int(time.time())})
+            logdbg("Exported %d rows up to %s" % (total, last_ts))
+        return total
+
+    @staticmethod
+    def _by_month(rows):
+        """Split rows (ordered by dateTime) into runs of the same UTC month"""
+        current = None
+        start = 0
+        for i, row in enumerate(rows):
+            month = time.gmtime(row[0])[:2]
+            if month != current:
+                if current is not None:
+                    yield current, rows[start:i]
+                current = month
+                start = i
+        if current is not None:
+            yield current, rows[start:]
+
+    def _write(self, month, rows):
+        directory = os.path.join(self.output, "year=%04d" % month[0], "month=%02d" % month[1])
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        suffix = 'parquet' if self.file_format == 'parquet' else 'arrow'
+        path = os.path.join(directory, "part-%d-%d.%s" % (rows[0][0], rows[-1][0], suffix))
+        table = build_table(rows, self.schema)
+        if self.file_format == 'parquet':
+            pyarrow.parquet.write_table(table, path, use_dictionary=True, compression='zstd')
+        else:
+            pyarrow.feather.write_feather(table, path, compression='zstd')
+
+
+if __name__ == "__main__":
+    import optparse
+
+    import weecfg
+    import weeutil.logger
+
+    usage = """Usage: %prog --config=CONFIG_FILE --output=DIR [--binding=BINDING] [--format=parquet|arrow]
+                 [--chunk=ROWS] [--full]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--config', dest='config_path', metavar='CONFIG_FILE',
+                      help='Use configuration file CONFIG_FILE')
+    parser.add_option('--binding', dest='binding', default='wx_binding',
+                      help='Data binding to export (default wx_binding)')
+    parser.add_option('--output', dest='output', help='Output directory')
+    parser.add_option('--format', dest='file_format', default='parquet', choices=['parquet', 'arrow'],
+                      help='parquet (default) or arrow (Feather v2)')
+    parser.add_option('--chunk', dest='chunk', type='int', default=50000,
+                      help='Rows read from the database at once (default 50000)')
+    parser.add_option('--full', dest='full', action='store_true',
+                      help='Ignore the manifest and export the whole archive (use a new output directory)')
+    (options, args) = parser.parse_args()
+
+    if pyarrow is None:
+        print("pyarrow is required: pip3 install pyarrow")
+        exit(1)
+    if not options.output:
+        parser.error("--output is required")
+
+    config_path, config_dict = weecfg.read_config(options.config_path, args)
+    weeutil.logger.setup('davisconsoleexport', config_dict)
+
+    with weewx.manager.open_manager_with_config(config_dict, options.binding) as dbm:
+        t1 = time.time()
+        exporter = ArchiveExporter(dbm, options.output, options.file_format, options.chunk)
+        n = exporter.export(full=options.full)
+        print("Exported %d rows in %.1f seconds to %s" % (n, time.time() - t1, options.output))
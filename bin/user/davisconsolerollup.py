@@ -0,0 +1,435 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Hourly and daily rollups (min, max, sum, count per observation), updated with
+every archive record.
+
+The service registers the xtype RollupSeries. Aggregated series (plots with
+aggregate_type min, max, sum, avg or count and an aggregate_interval of whole
+hours) are read from the rollups with one query instead of one archive query
+per interval, a week plot reads 168 rows instead of 168 queries over 2016
+archive rows. Series the rollups do not cover (before the first rolled up
+record, intervals not on hour boundaries, wind directions) are left to the
+other xtypes. The history tables (user.historygenerator3) read the daily
+summaries of weewx and do not use the rollups.
+
+The rollups are three tables in the database of the data binding:
+
+    rollup_hour  (dateTime, obs_type, min, max, sum, count)
+    rollup_day   (dateTime, obs_type, min, max, sum, count)
+    rollup_meta  (name, value)
+
+dateTime is the start of the hour / the start of the (archive) day, avg is
+sum / count (not weighted by the archive interval). The values are in the unit
+system of the database. rollup_meta holds first_ts (all records after it are
+rolled up) and the dateTime of the last record folded into each table, a record
+which is not newer is not folded in again. Records archived while the service
+did not run are folded in at startup.
+
+Settings in weewx.conf (driver user.davisconsoleapi or any other driver):
+
+[Engine]
+    [[Services]]
+        archive_services = weewx.engine.StdArchive, user.davisconsolerollup.DavisConsoleRollup
+
+[DavisConsoleRollup]
+    data_binding = wx_binding
+    table_prefix = rollup
+    #obs_types = outTemp, rain, radiation, windSpeed   # default: all numeric observations
+
+The data service DavisConsoleApi updates the rollups of its own records and
+registers RollupSeries for the plots of its binding with 'rollups = 1' in
+[DavisConsoleAPI].
+
+Build the rollups from the existing archive (once, or after an import):
+    PYTHONPATH=/usr/share/weewx python3 davisconsolerollup.py --config=/etc/weewx/weewx.conf --rebuild
+"""
+
+from __future__ import print_function
+
+import time
+
+import weedb
+import weewx
+import weewx.units
+import weewx.xtypes
+from weewx.engine import StdService
+from weewx.units import ValueTuple
+import weeutil.weeutil
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "DavisConsoleRollup: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+SKIP_KEYS = ('dateTime', 'usUnits', 'interval')
+
+# Averages of directions need vectors, they are left to weewx
+DIRECTIONS = ('windDir', 'windGustDir')
+
+AGGREGATES = ('min', 'max', 'sum', 'avg', 'count')
+
+
+def start_of_hour(ts):
+    """Start of the hour an archive record (time stamp = end of interval) belongs to"""
+    return int((ts - 1) // 3600 * 3600)
+
+
+def start_of_day(ts):
+    """Start of the archive day, a record at midnight belongs to the day before"""
+    return int(weeutil.weeutil.startOfArchiveDay(ts))
+
+
+class RollupStore(object):
+    """The hourly and daily rollup tables in the database of a manager"""
+
+    periods = (('hour', start_of_hour), ('day', start_of_day))
+
+    def __init__(self, dbm, table_prefix='rollup', obs_types=None):
+        self.dbm = dbm
+        self.table_prefix = table_prefix
+        self.obs_types = set(obs_types) if obs_types else None
+        self._create_tables()
+
+    def table(self, period):
+        return "%s_%s" % (self.table_prefix, period)
+
+    def _create_tables(self):
+        existing = self.dbm.connection.tables()
+        for period, _ in self.periods:
+            if self.table(period) not in existing:
+                self.dbm.connection.execute(
+                    "CREATE TABLE %s (dateTime INTEGER NOT NULL, obs_type VARCHAR(64) NOT NULL, "
+                    "min REAL, max REAL, sum REAL, count INTEGER, PRIMARY KEY (dateTime, obs_type))"
+                    % self.table(period))
+                loginf("Created table %s" % self.table(period))
+        if self.table('meta') not in existing:
+            self.dbm.connection.execute("CREATE TABLE %s (name VARCHAR(64) NOT NULL PRIMARY KEY, value INTEGER)"
+                                        % self.table('meta'))
+
+    def get_meta(self, name, dbm=None):
+        row = (dbm or self.dbm).getSql("SELECT value FROM %s WHERE name = ?" % self.table('meta'), (name,))
+        return row[0] if row else None
+
+    def _set_meta(self, cursor, name, value):
+        cursor.execute("REPLACE INTO %s (name, value) VALUES (?, ?)" % self.table('meta'), (name, value))
+
+    def _values(self, record):
+        """Return {obs_type: value} of the numeric values in record, in database units"""
+        if record.get('usUnits') is not None and record['usUnits'] != self.dbm.std_unit_system:
+            record = weewx.units.to_std_system(record, self.dbm.std_unit_system)
+        values = {}
+        for obs_type, value in record.items():
+            if obs_type in SKIP_KEYS or value is None or isinstance(value, (bool, str)):
+                continue
+            if self.obs_types is not None and obs_type not in self.obs_types:
+                continue
+            if isinstance(value, (int, float)):
+                values[obs_type] = value
+        return values
+
+    def add_record(self, record):
+        """Fold one archive record into the hour and day rollups, once"""
+        self.add_records([record])
+
+    def add_records(self, records):
+        """Fold archive records (in time order) into the rollups, records already folded in are skipped"""
+        last = dict((period, self.get_meta("%s.last_ts" % self.table(period))) for period, _ in self.periods)
+        first_ts = self.get_meta('first_ts')
+        buckets = dict((period, {}) for period, _ in self.periods)
+        for record in records:
+            ts = record['dateTime']
+            if first_ts is None:
+                # New rollups: complete after the archive record before this one
+                row = self.dbm.getSql("SELECT MAX(dateTime) FROM %s WHERE dateTime < ?" % self.dbm.table_name, (ts,))
+                first_ts = row[0] if row and row[0] is not None else ts - 1
+            values = self._values(record)
+            for period, start_fn in self.periods:
+                if last[period] is not None and ts <= last[period]:
+                    continue
+                last[period] = ts
+                if values:
+                    buckets[period].setdefault(start_fn(ts), []).append(values)
+        meta = dict(("%s.last_ts" % self.table(period), ts) for period, ts in last.items() if ts is not None)
+        if first_ts is not None:
+            meta['first_ts'] = first_ts
+        self._merge(buckets, meta)
+
+    def catch_up(self):
+        """Fold in the archive records after the last folded one, return their number"""
+        last_ts = self.get_meta("%s.last_ts" % self.table('hour'))
+        stop_ts = self.dbm.lastGoodStamp()
+        if last_ts is None or stop_ts is None or stop_ts <= last_ts:
+            return 0
+        records = list(self.dbm.genBatchRecords(last_ts, stop_ts))
+        self.add_records(records)
+        return len(records)
+
+    def _merge(self, buckets, meta=None):
+        """buckets = {period: {start_ts: [values, ...]}}, merged in one transaction with the meta values"""
+        with weedb.Transaction(self.dbm.connection) as cursor:
+            for name, value in (meta or {}).items():
+                self._set_meta(cursor, name, value)
+            for period, starts in buckets.items():
+                table = self.table(period)
+                for start_ts, value_list in starts.items():
+                    stats = {}
+                    cursor.execute("SELECT obs_type, min, max, sum, count FROM %s WHERE dateTime = ?" % table,
+                                   (start_ts,))
+                    for row in cursor.fetchall():
+                        stats[row[0]] = list(row[1:])
+                    for values in value_list:
+                        for obs_type, value in values.items():
+                            s = stats.get(obs_type)
+                            if s is None or s[3] is None:
+                                stats[obs_type] = [value, value, value, 1]
+                            else:
+                                s[0] = min(s[0], value)
+                                s[1] = max(s[1], value)
+                                s[2] += value
+                                s[3] += 1
+                    for obs_type, s in stats.items():
+                        cursor.execute("REPLACE INTO %s (dateTime, obs_type, min, max, sum, count) "
+                                       "VALUES (?, ?, ?, ?, ?, ?)" % table, [start_ts, obs_type] + s)
+
+    def get_series(self, obs_type, start_ts, stop_ts, period='day', dbm=None):
+        """Return [(dateTime, min, max, avg, sum, count), ...] for start_ts <= dateTime < stop_ts"""
+        sql = "SELECT dateTime, min, max, sum, count FROM %s WHERE obs_type = ? AND dateTime >= ? " \
+              "AND dateTime < ? ORDER BY dateTime" % self.table(period)
+        return [(row[0], row[1], row[2], row[3] / row[4] if row[4] else None, row[3], row[4])
+                for row in (dbm or self.dbm).genSql(sql, (obs_type, start_ts, stop_ts))]
+
+    def rebuild(self, start_ts=None, stop_ts=None):
+        """Recalculate the rollups from the archive, one day at a time"""
+        first = self.dbm.firstGoodStamp()
+        last = self.dbm.lastGoodStamp()
+        if first is None:
+            return 0
+        # Whole archive days, a row is rebuilt from all of its records
+        start_ts = start_of_day(max(first, start_ts or first) + 1)
+        stop_ts = min(last, weeutil.weeutil.archiveDaySpan(stop_ts)[1] if stop_ts else last)
+        for period, _ in self.periods:
+            self.dbm.connection.execute("DELETE FROM %s WHERE dateTime >= ? AND dateTime < ?"
+                                        % self.table(period), (start_ts, stop_ts))
+        # Rolled up from start_ts on if the rebuilt days reach the rolled up ones
+        first_ts = self.get_meta('first_ts')
+        meta = {'first_ts': start_ts if first_ts is None or first_ts <= stop_ts else first_ts}
+        for period, _ in self.periods:
+            last_ts = self.get_meta("%s.last_ts" % self.table(period))
+            meta["%s.last_ts" % self.table(period)] = stop_ts if last_ts is None else max(last_ts, stop_ts)
+        nrecs = 0
+        buckets = None
+        day = None
+        for record in self.dbm.genBatchRecords(start_ts, stop_ts):
+            record_day = start_of_day(record['dateTime'])
+            if record_day != day:
+                if buckets:
+                    self._merge(buckets)
+                buckets = dict((period, {}) for period, _ in self.periods)
+                day = record_day
+            values = self._values(record)
+            for period, start_fn in self.periods:
+                buckets[period].setdefault(start_fn(record['dateTime']), []).append(values)
+            nrecs += 1
+        # The meta values with the last day, an interrupted rebuild is not taken as complete
+        self._merge(buckets or {}, meta)
+        return nrecs
+
+
+class RollupSeries(weewx.xtypes.XType):
+    """Aggregated series of whole hours (or days) from the rollups of a RollupStore"""
+
+    def __init__(self, store):
+        self.store = store
+        self.database_name = store.dbm.database_name
+        self.table_name = store.dbm.table_name
+
+    def get_series(self, obs_type, timespan, db_manager, aggregate_type=None, aggregate_interval=None,
+                   **option_dict):
+        if aggregate_type not in AGGREGATES or not aggregate_interval:
+            raise weewx.UnknownAggregation(aggregate_type)
+        if obs_type in DIRECTIONS or obs_type not in db_manager.sqlkeys \
+                or (self.store.obs_types is not None and obs_type not in self.store.obs_types) \
+                or db_manager.database_name != self.database_name or db_manager.table_name != self.table_name:
+            raise weewx.UnknownType(obs_type)
+
+        # The intervals of the archive table xtype, same skipping at the ends
+        intervals = []
+        for span in weeutil.weeutil.intervalgen(timespan.start, timespan.stop, aggregate_interval):
+            if db_manager.first_timestamp is None or span.stop <= db_manager.first_timestamp:
+                continue
+            if db_manager.last_timestamp is None or span.start >= db_manager.last_timestamp:
+                break
+            intervals.append(span)
+        if not intervals:
+            raise weewx.UnknownAggregation(aggregate_type)
+
+        first_ts = self.store.get_meta('first_ts', db_manager)
+        last_ts = self.store.get_meta("%s.last_ts" % self.store.table('hour'), db_manager)
+        if first_ts is None or (intervals[0].start < first_ts and db_manager.first_timestamp <= first_ts) \
+                or last_ts is None or last_ts < min(intervals[-1].stop, db_manager.last_timestamp):
+            # Not rolled up (yet)
+            raise weewx.UnknownAggregation(aggregate_type)
+
+        # A row covers (start, start + 3600] or the archive day, the intervals must start and end on the
+        # rows; the end of the last one may be later than the last record
+        def aligned(start_fn):
+            return all(start_fn(span.start + 1) == span.start
+                       and (span.stop >= db_manager.last_timestamp or start_fn(span.stop + 1) == span.stop)
+                       for span in intervals)
+        if aligned(start_of_day):
+            period = 'day'
+        elif aligned(start_of_hour):
+            period = 'hour'
+        else:
+            raise weewx.UnknownAggregation(aggregate_type)
+
+        rows = self.store.get_series(obs_type, intervals[0].start, intervals[-1].stop, period, db_manager)
+        start_vec, stop_vec, data_vec = [], [], []
+        i = 0
+        for span in intervals:
+            stats = None
+            while i < len(rows) and rows[i][0] < span.stop:
+                row = rows[i]
+                i += 1
+                if row[5]:
+                    if stats is None:
+                        stats = [row[1], row[2], row[4], row[5]]
+                    else:
+                        stats = [min(stats[0], row[1]), max(stats[1], row[2]), stats[2] + row[4], stats[3] + row[5]]
+            start_vec.append(span.start)
+            stop_vec.append(span.stop)
+            if stats is None:
+                data_vec.append(0 if aggregate_type == 'count' else None)
+            else:
+                data_vec.append({'min': stats[0], 'max': stats[1], 'sum': stats[2], 'count': stats[3],
+                                 'avg': stats[2] / stats[3]}[aggregate_type])
+
+        unit, unit_group = weewx.units.getStandardUnitType(db_manager.std_unit_system, obs_type, aggregate_type)
+        return (ValueTuple(start_vec, 'unix_epoch', 'group_time'),
+                ValueTuple(stop_vec, 'unix_epoch', 'group_time'),
+                ValueTuple(data_vec, unit, unit_group))
+
+
+class DavisConsoleRollup(StdService):
+    """Update the rollups with every new archive record"""
+
+    def __init__(self, engine, config_dict):
+        super(DavisConsoleRollup, self).__init__(engine, config_dict)
+
+        options = config_dict.get("DavisConsoleRollup", {})
+        binding = options.get("data_binding", "wx_binding")
+        obs_types = weeutil.weeutil.option_as_list(options.get("obs_types"))
+        dbm = self.engine.db_binder.get_manager(data_binding=binding, initialize=True)
+        self.store = RollupStore(dbm, options.get("table_prefix", "rollup"), obs_types)
+        loginf("Rollups for %s in %s/%s" % (binding, self.store.table('hour'), self.store.table('day')))
+        try:
+            n = self.store.catch_up()
+            if n:
+                loginf("%d archive records folded into the rollups" % n)
+        except weedb.DatabaseError as error:
+            logerr("Rollup catch up failed: %s" % error)
+
+        # Aggregated series of the reports from the rollups
+        self.xtype = RollupSeries(self.store)
+        weewx.xtypes.xtypes.insert(0, self.xtype)
+
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
+
+    def new_archive_record(self, event):
+        try:
+            self.store.add_record(event.record)
+        except weedb.DatabaseError as error:
+            logerr("Rollup update failed: %s" % error)
+
+    def shutDown(self):
+        weewx.xtypes.xtypes.remove(self.xtype)
+
+
+if __name__ == "__main__":
+    import optparse
+
+    import weecfg
+    import weewx.manager
+
+    usage = """Usage: %prog --config=CONFIG_FILE --rebuild [--binding=BINDING] [--start=YYYY-mm-dd]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--config', dest='config_path', metavar='CONFIG_FILE',
+                      help='Use configuration file CONFIG_FILE')
+    parser.add_option('--binding', dest='binding', default=None,
+                      help='Data binding (default from [DavisConsoleRollup] or wx_binding)')
+    parser.add_option('--rebuild', dest='rebuild', action='store_true',
+                      help='Rebuild the rollups from the archive')
+    parser.add_option('--start', dest='start', default=None,
+                      help='Rebuild only from this date (YYYY-mm-dd)')
+    (options, args) = parser.parse_args()
+
+    if not options.rebuild:
+        parser.print_help()
+        exit(0)
+
+    config_path, config_dict = weecfg.read_config(options.config_path, args)
+    weeutil.logger.setup('davisconsolerollup', config_dict)
+    rollup_dict = config_dict.get("DavisConsoleRollup", {})
+    binding = options.binding or rollup_dict.get("data_binding", "wx_binding")
+    start_ts = None
+    if options.start:
+        start_ts = int(time.mktime(time.strptime(options.start, "%Y-%m-%d")))
+
+    with weewx.manager.open_manager_with_config(config_dict, binding) as dbm:
+        store = RollupStore(dbm, rollup_dict.get("table_prefix", "rollup"),
+                            weeutil.weeutil.option_as_list(rollup_dict.get("obs_types")))
+        t1 = time.time()
+        n = store.rebuild(start_ts)
+        print("Rolled up %d archive records in %.1f seconds" % (n, time.time() - t1))
@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+SQLite tuning profiles for the davisconsole.sdb binding.
+
+Report generation reads and the archive inserts use the same SQLite file. With
+the default rollback journal a report run blocks the insert (and the other way
+round), which is slow on SD-card hosts. The profiles switch the database to WAL
+mode, so readers and the writer no longer block each other.
+
+journal_mode = WAL is stored in the database file, so it is also used by the
+report connections. The other settings are per connection. For the report
+connections the busy timeout is set with 'timeout' in [Databases].
+
+Profiles:
+    default   no change
+    wal       WAL, synchronous NORMAL, 64 MB mmap, 8 MB cache, 5 s busy timeout
+    sdcard    as wal, but bigger checkpoints and no mmap (fewer small writes)
+    safe      WAL, synchronous FULL, 10 s busy timeout
+
+Settings in weewx.conf:
+
+[Engine]
+    [[Services]]
+        data_services = ..., user.davisconsoletuning.DavisConsoleTuning
+
+[DavisConsoleTuning]
+    data_binding = wx_binding
+    profile = wal
+    # single settings overrule the profile
+    #journal_mode = WAL
+    #synchronous = NORMAL
+    #mmap_size = 67108864
+    #cache_size = -8000       # negative = kilobytes
+    #busy_timeout = 5000      # milliseconds
+    #wal_autocheckpoint = 1000
+
+[Databases]
+    [[davisconsoleapi_sqlite]]
+        database_type = SQLite
+        database_name = davisconsole.sdb
+        timeout = 5              # busy timeout in seconds for all other connections
+
+The data service DavisConsoleApi uses the same settings with
+'sqlite_profile = wal' in [DavisConsoleAPI].
+
+Benchmark (insert plus report query throughput for each profile):
+    python3 davisconsoletuning.py --benchmark [--records=2000] [--days=60]
+"""
+
+from __future__ import print_function
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import weewx
+    import weeutil.weeutil
+    from weewx.engine import StdService
+except ImportError:
+    # The benchmark runs without weewx
+    StdService = object
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "DavisConsoleTuning: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+# Order matters: busy_timeout first, switching journal_mode may wait for other connections
+PRAGMA_ORDER = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'wal_autocheckpoint')
+
+PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 67108864,
+        'cache_size': -8000,
+        'busy_timeout': 5000,
+    },
+    'sdcard': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 0,
+        'cache_size': -8000,
+        'busy_timeout': 10000,
+        'wal_autocheckpoint': 4000,
+    },
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 10000,
+    },
+}
+
+
+def get_settings(options, profile_key='profile'):
+    """Return the pragma settings for the options of a weewx.conf section"""
+    profile = options.get(profile_key, 'default')
+    if profile not in PROFILES:
+        logerr("Unknown SQLite profile '%s', using default" % profile)
+        profile = 'default'
+    settings = dict(PROFILES[profile])
+    for key in PRAGMA_ORDER:
+        if key in options:
+            settings[key] = options[key]
+    return settings
+
+
+def pragma_statements(settings):
+    """Return the PRAGMA statements for settings, in a safe order"""
+    return ["PRAGMA %s = %s" % (key, settings[key]) for key in PRAGMA_ORDER if key in settings]
+
+
+def apply_sqlite_tuning(connection, settings):
+    """Apply settings to an open weedb or sqlite3 connection.
+
+    Returns the journal mode reported by SQLite, or None if nothing was done."""
+    if getattr(connection, 'dbtype', 'sqlite') != 'sqlite':
+        logdbg("Database is not SQLite, tuning skipped")
+        return None
+    journal_mode = None
+    for statement in pragma_statements(settings):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(statement)
+            row = cursor.fetchone()
+            if statement.startswith("PRAGMA journal_mode") and row:
+                journal_mode = row[0]
+        finally:
+            cursor.close()
+    return journal_mode
+
+
+class DavisConsoleTuning(StdService):
+    """Apply the SQLite tuning profile to the binding when weewx starts"""
+
+    def __init__(self, engine, config_dict):
+        super(DavisConsoleTuning, self).__init__(engine, config_dict)
+
+        options = config_dict.get("DavisConsoleTuning", {})
+        binding = options.get("data_binding", "wx_binding")
+        settings = get_settings(options)
+        if not settings:
+            return
+        try:
+            dbm = self.engine.db_binder.get_manager(data_binding=binding, initialize=True)
+            journal_mode = apply_sqlite_tuning(dbm.connection, settings)
+            if journal_mode is not None:
+                loginf("SQLite tuning for %s: %s (journal_mode %s)" % (binding, settings, journal_mode))
+        except Exception as error:
+            logerr("SQLite tuning for %s failed: %s" % (binding, error))
+
+
+#
+# Benchmark
+#
+
+def _create_archive(path, columns):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE archive (dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY, usUnits INTEGER NOT NULL, "
+                       "interval INTEGER NOT NULL, %s)" % ", ".join("%s REAL" % c for c in columns))
+    connection.commit()
+    connection.close()
+
+
+def _fill(path, columns, start_ts, count):
+    connection = sqlite3.connect(path)
+    sql = "INSERT INTO archive VALUES (%s)" % ", ".join(["?"] * (len(columns) + 3))
+    rows = [[start_ts + i * 300, 1, 5] + [float(i % 97 + j) for j in range(len(columns))] for i in range(count)]
+    connection.executemany(sql, rows)
+    connection.commit()
+    connection.close()
+
+
+def run_benchmark(profile, records, days, columns):
+    """Insert records one per transaction (like weewx) while a reader runs report queries"""
+    settings = PROFILES[profile]
+    tmpdir = tempfile.mkdtemp(prefix='davisconsole_bench_')
+    path = os.path.join(tmpdir, 'bench.sdb')
+    _create_archive(path, columns)
+    history = days * 288
+    start_ts = 1700000000
+    _fill(path, columns, start_ts, history)
+
+    result = {'inserts': 0, 'insert_errors': 0, 'insert_max': 0.0, 'queries': 0, 'query_errors': 0}
+    done = threading.Event()
+
+    def reader():
+        connection = sqlite3.connect(path, timeout=settings.get('busy_timeout', 5000) / 1000.0)
+        apply_sqlite_tuning(connection, settings)
+        sql = "SELECT MIN(%s), MAX(%s), AVG(%s), COUNT(*) FROM archive WHERE dateTime > ?" % (
+            columns[0], columns[1], columns[2])
+        while not done.is_set():
+            try:
+                connection.execute(sql, (start_ts,)).fetchall()
+                result['queries'] += 1
+            except sqlite3.OperationalError:
+                result['query_errors'] += 1
+        connection.close()
+
+    connection = sqlite3.connect(path, timeout=settings.get('busy_timeout', 5000) / 1000.0)
+    apply_sqlite_tuning(connection, settings)
+    sql = "INSERT INTO archive VALUES (%s)" % ", ".join(["?"] * (len(columns) + 3))
+    thread = threading.Thread(target=reader)
+    thread.start()
+    t1 = time.time()
+    for i in range(records):
+        row = [start_ts + (history + i) * 300, 1, 5] + [float(i % 89 + j) for j in range(len(columns))]
+        t = time.time()
+        try:
+            connection.execute(sql, row)
+            connection.commit()
+            result['inserts'] += 1
+        except sqlite3.OperationalError:
+            connection.rollback()
+            result['insert_errors'] += 1
+        result['insert_max'] = max(result['insert_max'], time.time() - t)
+    elapsed = time.time() - t1
+    done.set()
+    thread.join()
+    connection.close()
+    for name in os.listdir(tmpdir):
+        os.remove(os.path.join(tmpdir, name))
+    os.rmdir(tmpdir)
+
+    result['elapsed'] = elapsed
+    return result
+
+
+if __name__ == "__main__":
+    import optparse
+
+    usage = """Usage: %prog --benchmark [--records=N] [--days=N] [--profile=name]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--benchmark', dest='benchmark', action='store_true',
+                      help='Measure insert and report query throughput for each profile')
+    parser.add_option('--records', dest='records', type='int', default=2000,
+                      help='Number of archive records to insert')
+    parser.add_option('--days', dest='days', type='int', default=60,
+                      help='Days of archive data in the database before the test')
+    parser.add_option('--profile', dest='profile', action='append',
+                      help='Profile to test, may be given more than once (default: all)')
+    (options, args) = parser.parse_args()
+
+    if not options.benchmark:
+        parser.print_help()
+        exit(0)
+
+    try:
+        import schemas.wview_davisconsoleapi
+        columns = [c[0] for c in schemas.wview_davisconsoleapi.table
+                   if c[0] not in ('dateTime', 'usUnits', 'interval') and c[1] == 'REAL']
+    except ImportError:
+        columns = ['outTemp', 'outHumidity', 'barometer', 'windSpeed', 'rain', 'radiation']
+
+    print("%-8s %10s %10s %10s %12s %10s" % ('profile', 'inserts/s', 'max ms', 'queries/s', 'lock errors', 'seconds'))
+    for profile in options.profile or sorted(PROFILES):
+        r = run_benchmark(profile, options.records, options.days, columns)
+        print("%-8s %10.1f %10.1f %10.1f %12d %10.2f" % (
+            profile, r['inserts'] / r['elapsed'], r['insert_max'] * 1000.0, r['queries'] / r['elapsed'],
+            r['insert_errors'] + r['query_errors'], r['elapsed']))
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Small helpers shared by the davisconsoleapi extensions: where to keep state
+files and how to write them so a crash never leaves a half written file.
+
+State files are kept next to the SQLite databases (SQLITE_ROOT), because that
+directory is writable by weewx on every installation type.
+"""
+
+import json
+import os
+
+
+def state_root(config_dict):
+    """Return the directory used for state and cache files"""
+    weewx_root = config_dict.get('WEEWX_ROOT', '')
+    sqlite_root = config_dict.get('DatabaseTypes', {}).get('SQLite', {}).get('SQLITE_ROOT', 'archive')
+    return os.path.join(weewx_root, sqlite_root)
+
+
+def state_path(config_dict, filename):
+    """Return the full path of a state file, filename may already be absolute"""
+    return os.path.join(state_root(config_dict), filename)
+
+
+def atomic_write(path, data):
+    """Write bytes to path atomically (temp file, fsync, rename)"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_json(path, obj):
+    """Write obj as JSON to path atomically"""
+    atomic_write(path, json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+
+
+def read_json(path, default=None):
+    """Read a JSON file, return default if it is missing or unreadable"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
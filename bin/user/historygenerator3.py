@@ -56,6 +56,28 @@ Adding the section below to your skins.conf file will create these new tags:
     # refresh_interval is how often in minutes the tables are calculated.
     refresh_interval = 60
 
+    # Keep the cells of complete months and years in a file (in SQLITE_ROOT), only the current month
+    # and year are calculated again. Tables whose cells are all kept read the daily summaries of the
+    # current year only. The cells of a table are calculated again after cache_max_age seconds
+    # (imports, corrections), or delete the file after importing old data.
+    incremental = 1
+    cache_file = historyreport_cache.json
+    cache_max_age = 86400
+
+    # All cells of the tables of an observation are calculated from one query of the daily summary
+    # (archive_day_<obs_type>). Other tables use one query per cell.
+    query_planner = 1
+
+    # Read the daily summaries with this many threads (own database connection each)
+    workers = 1
+
+    # Keep the generated tables and the time of the last refresh in a file (in SQLITE_ROOT). After a
+    # restart the tables are used until refresh_interval expires. Later a table is generated again
+    # only if its options changed or the data it shows is newer: the last value of its observation
+    # (a sensor without new values keeps its table), the month of the last record for the NOAA table.
+    persistent = 1
+    html_cache_file = historyreport_html.json
+
     [[min_temp]]                           # Create a new Cheetah tag which will have a _table suffix: $min_temp_table
         obs_type = outTemp                 # obs_type can be any weewx observation, e.g. outTemp, barometer, wind, ...
         aggregate_type = min               # Any of these: 'sum', 'count', 'avg', 'max', 'min'
@@ -80,7 +102,12 @@ Adding the section below to your skins.conf file will create these new tags:
         fontColors = "#000000", "#000000", "#000000", "#000000", "#000000", "#000000"
 """
 
+import bisect
+import concurrent.futures
 from datetime import datetime
+import hashlib
+import json
+import threading
 import time
 import logging
 import os.path
@@ -89,10 +116,208 @@ from configobj import ConfigObj
 
 from weewx.cheetahgenerator import SearchList
 from weewx.tags import TimespanBinder
+from weewx.units import ValueTuple
+import weewx.manager
+import weewx.units
 import weeutil.weeutil
 
+import user.davisconsoleutil
+
 log = logging.getLogger(__name__)
 
+
+class DaySummaryPlanner(object):
+    """Month and year cells of the tables from the daily summaries.
+
+    The day rows of an observation (archive_day_<obs_type>) are read with one query
+    per binding and observation and shared by all tables of that observation, the
+    cells are aggregated from these rows. Tables with the same binding, observation
+    and aggregate share the cells. Tables this can not do (NOAA, vector
+    observations, observations without daily summary) use the TimespanBinder.
+    """
+
+    # Value of a day row (dateTime, min, max, sum, count, wsum, sumtime) a threshold aggregate compares
+    THRESHOLD_FIELDS = {'max': 2, 'min': 1, 'sum': 3, 'avg': None}
+    THRESHOLD_TESTS = {
+        'ge': lambda x, v: x >= v,
+        'le': lambda x, v: x <= v,
+        'gt': lambda x, v: x > v,
+        'lt': lambda x, v: x < v,
+    }
+    AGGREGATES = ('min', 'max', 'sum', 'count', 'avg',
+                  'max_ge', 'max_le', 'min_ge', 'min_le', 'sum_ge', 'sum_le', 'avg_ge', 'avg_le', 'avg_gt', 'avg_lt')
+
+    def __init__(self, db_lookup):
+        self.db_lookup = db_lookup
+        self.tables = {}
+        # {(binding, obs_type, since): {(year, month): rows}}, since None = all rows
+        self.rows = {}
+        self.results = {}
+
+    def supported(self, binding, obs_type, aggregate_type):
+        if aggregate_type not in self.AGGREGATES or obs_type == 'wind':
+            return False
+        dbm = self.db_lookup(binding)
+        if binding not in self.tables:
+            self.tables[binding] = dbm.connection.tables()
+        return "%s_day_%s" % (dbm.table_name, obs_type) in self.tables[binding]
+
+    def _rows(self, binding, obs_type, since=None):
+        """The day rows of obs_type from since on (a start of month), grouped by (year, month) of local time"""
+        key = (binding, obs_type, since)
+        if key not in self.rows:
+            if since is not None and (binding, obs_type, None) in self.rows:
+                first = time.localtime(since)[:2]
+                self.rows[key] = dict((k, rows) for k, rows in self.rows[(binding, obs_type, None)].items()
+                                      if k >= first)
+            else:
+                self.rows[key] = self._read_rows(self.db_lookup(binding), obs_type, since)
+        return self.rows[key]
+
+    @staticmethod
+    def _read_rows(dbm, obs_type, since=None):
+        months = {}
+        sql = "SELECT dateTime, min, max, sum, count, wsum, sumtime FROM %s_day_%s" % (dbm.table_name, obs_type)
+        for row in dbm.genSql(sql + " WHERE dateTime >= ?" if since is not None else sql,
+                              (since,) if since is not None else ()):
+            months.setdefault(time.localtime(row[0])[:2], []).append(row)
+        return months
+
+    def prefetch(self, pairs, workers, config_dict):
+        """Read the day rows of several (binding, obs_type, since) in a pool of worker threads.
+
+        Every worker opens its own connection to each binding it reads, the
+        connections are closed when all rows are read.
+        """
+        local = threading.local()
+        managers = []
+        lock = threading.Lock()
+
+        def load(pair):
+            binding, obs_type, since = pair
+            if not hasattr(local, 'managers'):
+                local.managers = {}
+            if binding not in local.managers:
+                local.managers[binding] = weewx.manager.open_manager_with_config(config_dict, binding)
+                with lock:
+                    managers.append(local.managers[binding])
+            t1 = time.time()
+            return self._read_rows(local.managers[binding], obs_type, since), time.time() - t1
+
+        timings = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                # map() returns the results in the order of pairs
+                for pair, (months, seconds) in zip(pairs, executor.map(load, pairs)):
+                    self.rows[pair] = months
+                    timings.append((pair, seconds))
+        finally:
+            for dbm in managers:
+                dbm.close()
+        return timings
+
+    def cells(self, binding, obs_type, aggregate_type, threshold, converter, since=None):
+        """Return ({(year, month): value}, {year: value}), values in the units of the report.
+
+        With since (a start of year) only the cells from since on are calculated.
+        """
+        key = (binding, obs_type, aggregate_type, threshold, id(converter), since)
+        if key not in self.results:
+            self.results[key] = self._cells(binding, obs_type, aggregate_type, threshold, converter, since)
+        return self.results[key]
+
+    def _cells(self, binding, obs_type, aggregate_type, threshold, converter, since):
+        dbm = self.db_lookup(binding)
+        months = self._rows(binding, obs_type, since)
+
+        if threshold is not None:
+            field, test = aggregate_type.split('_')
+            unit_group = weewx.units.getStandardUnitType(dbm.std_unit_system, obs_type)[1]
+            threshold = weewx.units.convertStd(ValueTuple(threshold[0], threshold[1], unit_group),
+                                               dbm.std_unit_system)[0]
+            aggregate = self._counter(self.THRESHOLD_FIELDS[field], self.THRESHOLD_TESTS[test], threshold)
+            unit, group = 'count', 'group_count'
+        else:
+            aggregate = getattr(self, '_' + aggregate_type)
+            unit, group = weewx.units.getStandardUnitType(dbm.std_unit_system, obs_type, aggregate_type)
+
+        def value(rows):
+            return converter.convert(ValueTuple(aggregate(rows), unit, group))[0]
+
+        years = {}
+        for (year, month), rows in months.items():
+            years.setdefault(year, []).extend(rows)
+        return (dict((k, value(rows)) for k, rows in months.items()),
+                dict((k, value(rows)) for k, rows in years.items()))
+
+    @staticmethod
+    def _min(rows):
+        values = [r[1] for r in rows if r[1] is not None]
+        return min(values) if values else None
+
+    @staticmethod
+    def _max(rows):
+        values = [r[2] for r in rows if r[2] is not None]
+        return max(values) if values else None
+
+    @staticmethod
+    def _sum(rows):
+        values = [r[3] for r in rows if r[3] is not None]
+        return sum(values) if values else None
+
+    @staticmethod
+    def _count(rows):
+        values = [r[4] for r in rows if r[4] is not None]
+        return sum(values) if values else None
+
+    @staticmethod
+    def _avg(rows):
+        wsum = sum(r[5] for r in rows if r[5] is not None and r[6])
+        sumtime = sum(r[6] for r in rows if r[5] is not None and r[6])
+        return wsum / sumtime if sumtime else None
+
+    @staticmethod
+    def _counter(index, test, threshold):
+        """Number of days whose value (index in the row, None = daily average) passes test"""
+        def count(rows):
+            n = 0
+            for r in rows:
+                x = r[index] if index is not None else (r[5] / r[6] if r[6] else None)
+                if x is not None and test(x, threshold):
+                    n += 1
+            return n
+        return count
+
+
+class ColorScale(object):
+    """The color bands of a table, compiled once: numeric limits and the finished style attributes.
+
+    Bands which do not overlap are found with bisect. If they overlap, the first
+    band in the order of the options wins, as before, so these are searched in order.
+    """
+
+    def __init__(self, bands):
+        self.bands = [(float(low), float(high), ' style="background-color:%s; color:%s"' % (bg, fg))
+                      for low, high, bg, fg in bands]
+        ordered = sorted(self.bands, key=lambda band: band[0])
+        self.bisect = all(a[1] <= b[0] for a, b in zip(ordered, ordered[1:]))
+        self.lows = [band[0] for band in ordered]
+        self.highs = [band[1] for band in ordered]
+        self.styles = [band[2] for band in ordered]
+
+    def style(self, value):
+        """The style attribute for value, '' if no band matches"""
+        if self.bisect:
+            i = bisect.bisect_right(self.lows, value) - 1
+            if i >= 0 and value < self.highs[i]:
+                return self.styles[i]
+            return ''
+        for low, high, style in self.bands:
+            if low <= value < high:
+                return style
+        return ''
+
+
 class MyXSearch(SearchList):
     def __init__(self, generator):
         SearchList.__init__(self, generator)
@@ -105,6 +330,38 @@ class MyXSearch(SearchList):
 
         self.log = int(self.table_dict.get('log', 0))
         self.barometercut = int(self.table_dict.get('barometercut', 0))
+        self.color_scales = {}
+
+        # Read the cells from the daily summaries with one query per observation
+        self.query_planner = weeutil.weeutil.to_bool(self.table_dict.get('query_planner', True))
+        self.planner = None
+        # Worker threads reading the daily summaries for the planner, 1 = no threads
+        self.workers = max(1, int(self.table_dict.get('workers', 1)))
+
+        # Cell values of complete months and years, {table key: {cell key: value}}
+        self.incremental = weeutil.weeutil.to_bool(self.table_dict.get('incremental', False))
+        self.cell_cache_max_age = int(self.table_dict.get('cache_max_age', 86400))
+        self.cell_cache = {}
+        self.cell_cache_dirty = False
+        if self.incremental:
+            self.cell_cache_path = user.davisconsoleutil.state_path(
+                generator.config_dict, self.table_dict.get('cache_file', 'historyreport_cache.json'))
+            # {table key: {'created': time, 'cells': {cell key: value}}}, older files have no time
+            self.cell_cache = dict((k, v) for k, v in user.davisconsoleutil.read_json(self.cell_cache_path, {}).items()
+                                   if isinstance(v, dict) and 'created' in v)
+
+        # The generated tables and the time of the last refresh, kept over restarts
+        self.persistent = weeutil.weeutil.to_bool(self.table_dict.get('persistent', False))
+        self.html_cache = {}
+        self.html_cache_time = 0
+        if self.persistent:
+            self.html_cache_path = user.davisconsoleutil.state_path(
+                generator.config_dict, self.table_dict.get('html_cache_file', 'historyreport_html.json'))
+            self.config_hash = self._hash((self.table_dict, generator.skin_dict.get('Units', {})))
+            stored = user.davisconsoleutil.read_json(self.html_cache_path, {})
+            if stored.get('config') == self.config_hash:
+                self.html_cache = stored.get('tables', {})
+                self.html_cache_time = stored.get('cache_time', 0)
 
         self.search_list_extension = {}
 
@@ -158,6 +415,11 @@ class MyXSearch(SearchList):
         name. If not given, then a default binding will be used.
         """
 
+        # First run after a restart and the tables of the last run are still fresh?
+        if self.cache_time == 0 and self.html_cache and \
+                (time.time() - (self.refresh_interval * 60)) <= self.html_cache_time:
+            self._loadTables(db_lookup)
+
         # Time to recalculate?
         if (time.time() - (self.refresh_interval * 60)) > self.cache_time:
             self.cache_time = time.time()
@@ -168,8 +430,17 @@ class MyXSearch(SearchList):
 
             t1 = time.time()
             ngen = 0
+            self.planner = DaySummaryPlanner(db_lookup) if self.query_planner else None
+            # Lookups shared by the tables of this run
+            self.run_timespans = {}
+            self.run_binders = {}
+            self.run_readings = {}
+
+            if self.planner is not None and self.workers > 1:
+                self._prefetch(db_lookup)
 
             for table in self.table_dict.sections:
+                t_table = time.time()
                 noaa = True if table == 'NOAA' else False
 
                 table_options = weeutil.weeutil.accumulateLeaves(self.table_dict[table])
@@ -185,14 +456,8 @@ class MyXSearch(SearchList):
                 # If this generator has been called in the [SummaryByMonth] or [SummaryByYear]
                 # section in skin.conf then valid_timespan won't contain enough history data for
                 # the colorful summary tables. Use the data binding provided as table option.
-                alltime_timespan = weeutil.weeutil.TimeSpan(db_lookup(data_binding=binding).first_timestamp, db_lookup(data_binding=binding).last_timestamp)
-
-
-                # First, get a TimeSpanStats object for all time. This one is easy
-                # because the object valid_timespan already holds all valid times to be
-                # used in the report. se the data binding provided as table option.
-                all_stats = TimespanBinder(alltime_timespan, db_lookup, data_binding=binding, formatter=self.generator.formatter,
-                                           converter=self.generator.converter)
+                # The binders are shared by all tables of the same binding and start date.
+                all_stats = self._timespanBinder(db_lookup, binding)
 
                 # Now create a small dictionary with keys 'alltime' and 'seven_day':
                 self.search_list_extension['alltime'] = all_stats
@@ -200,15 +465,42 @@ class MyXSearch(SearchList):
                 # Show all time unless starting date specified
                 startdate = table_options.get('startdate', None)
                 if startdate is not None:
-                    table_timespan = weeutil.weeutil.TimeSpan(int(startdate), db_lookup(binding).last_timestamp)
-                    table_stats = TimespanBinder(table_timespan, db_lookup, data_binding=binding, formatter=self.generator.formatter,
-                                                 converter=self.generator.converter)
+                    table_stats = self._timespanBinder(db_lookup, binding, int(startdate))
                 else:
                     table_stats = all_stats
 
                 table_name = table + '_table'
+                if self.persistent:
+                    # Same options, units and data as the stored table: nothing to do
+                    table_key = self._hash((table_options, binding, self._tableEnd(db_lookup, table, table_options, binding)))
+                    stored = self.html_cache.get(table_name)
+                    if stored is not None and stored.get('key') == table_key:
+                        self.search_list_extension[table_name] = stored['html']
+                        continue
                 self.search_list_extension[table_name] = self._statsHTMLTable(table_options, table_stats, table_name, binding, NOAA=noaa)
+                if self.persistent:
+                    self.html_cache[table_name] = {'key': table_key, 'html': self.search_list_extension[table_name]}
                 ngen += 1
+                if (self.log == 1):
+                    log.info("%s: Table %s in %.3f seconds" % (os.path.basename(__file__), table_name,
+                                                               time.time() - t_table))
+
+            if self.cell_cache_dirty:
+                try:
+                    user.davisconsoleutil.write_json(self.cell_cache_path, self.cell_cache)
+                except (IOError, OSError) as e:
+                    log.info("%s: Could not write %s: %s" % (os.path.basename(__file__), self.cell_cache_path, e))
+                self.cell_cache_dirty = False
+
+            if self.persistent:
+                try:
+                    user.davisconsoleutil.write_json(self.html_cache_path, {
+                        'config': self.config_hash, 'cache_time': self.cache_time, 'tables': self.html_cache})
+                except (IOError, OSError) as e:
+                    log.info("%s: Could not write %s: %s" % (os.path.basename(__file__), self.html_cache_path, e))
+
+            self.planner = None
+            self.run_timespans = self.run_binders = self.run_readings = None
 
             t2 = time.time()
             if (self.log == 1):
@@ -217,6 +509,140 @@ class MyXSearch(SearchList):
 
         return [self.search_list_extension]
 
+    def _loadTables(self, db_lookup):
+        """Use the stored tables of the last run, if all tables are there"""
+        tables = {}
+        self.run_timespans = {}
+        self.run_binders = {}
+        for table in self.table_dict.sections:
+            table_name = table + '_table'
+            if table_name not in self.html_cache:
+                self.run_timespans = self.run_binders = None
+                return
+            tables[table_name] = self.html_cache[table_name]['html']
+            binding = weeutil.weeutil.accumulateLeaves(self.table_dict[table]).get('data_binding', 'wx_binding')
+            tables['alltime'] = self._timespanBinder(db_lookup, binding)
+        self.run_timespans = self.run_binders = None
+        self.search_list_extension.update(tables)
+        self.cache_time = self.html_cache_time
+        if (self.log == 1):
+            log.info("%s: Loaded %d tables from %s" % (os.path.basename(__file__), len(tables) - 1,
+                                                       self.html_cache_path))
+
+    @staticmethod
+    def _hash(obj):
+        return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _prefetch(self, db_lookup):
+        """Read the daily summaries of all planner tables in parallel"""
+        since = {}
+        for table in self.table_dict.sections:
+            if table == 'NOAA':
+                continue
+            table_options = weeutil.weeutil.accumulateLeaves(self.table_dict[table])
+            binding = table_options.get('data_binding', 'wx_binding')
+            pair = (binding, table_options.get('obs_type'))
+            try:
+                if self.planner.supported(binding, pair[1], table_options.get('aggregate_type')):
+                    # The rows of the current year are enough if all tables of the pair have their past cells
+                    start = self._cachedSince(table + '_table', table_options, self._tableStats(db_lookup, table_options))
+                    since[pair] = start if pair not in since or since[pair] == start else None
+            except Exception as e:
+                log.info("%s: %s" % (os.path.basename(__file__), e))
+        pairs = [pair + (start,) for pair, start in since.items()]
+        if not pairs:
+            return
+        t1 = time.time()
+        try:
+            timings = self.planner.prefetch(pairs, self.workers, self.generator.config_dict)
+        except Exception as e:
+            # The rows are read by the tables themselves
+            log.info("%s: Parallel read failed: %s" % (os.path.basename(__file__), e))
+            return
+        if (self.log == 1):
+            for (binding, obs_type, start), seconds in timings:
+                log.info("%s: Read daily summary %s of %s in %.3f seconds"
+                         % (os.path.basename(__file__), obs_type, binding, seconds))
+            log.info("%s: Read %d daily summaries with %d workers in %.2f seconds"
+                     % (os.path.basename(__file__), len(pairs), self.workers, time.time() - t1))
+
+    def _timespanBinder(self, db_lookup, binding, startdate=None):
+        """The TimespanBinder from startdate (default first record) to the last record of binding"""
+        if binding not in self.run_timespans:
+            dbm = db_lookup(data_binding=binding)
+            self.run_timespans[binding] = (dbm.first_timestamp, dbm.last_timestamp)
+        first, last = self.run_timespans[binding]
+        key = (binding, startdate)
+        if key not in self.run_binders:
+            timespan = weeutil.weeutil.TimeSpan(first if startdate is None else startdate, last)
+            self.run_binders[key] = TimespanBinder(timespan, db_lookup, data_binding=binding,
+                                                   formatter=self.generator.formatter,
+                                                   converter=self.generator.converter)
+        return self.run_binders[key]
+
+    def _tableEnd(self, db_lookup, table, table_options, binding):
+        """The end of the data a table shows: (last value of its observation, start of the last year).
+
+        The NOAA table links the months, it changes with the month of the last record. Tables of
+        observations which are not archive columns change with every record. The last value is the
+        last day with values in the daily summary and its count, one row read from the end; without
+        a daily summary the last value of the current year in the archive.
+        """
+        last = self.run_timespans[binding][1]
+        if last is None:
+            return None, None
+        year = weeutil.weeutil.archiveYearSpan(last).start
+        if table == 'NOAA':
+            return weeutil.weeutil.archiveMonthSpan(last).start, year
+        dbm = db_lookup(data_binding=binding)
+        obs_type = table_options.get('obs_type')
+        if obs_type not in dbm.sqlkeys:
+            return last, year
+        if obs_type in (getattr(dbm, 'daykeys', None) or ()):
+            row = dbm.getSql("SELECT dateTime, count FROM %s_day_%s WHERE count > 0 ORDER BY dateTime DESC LIMIT 1"
+                             % (dbm.table_name, obs_type))
+            return (list(row) if row else None), year
+        row = dbm.getSql("SELECT dateTime FROM %s WHERE dateTime > ? AND %s IS NOT NULL ORDER BY dateTime DESC LIMIT 1"
+                         % (dbm.table_name, obs_type), (year,))
+        return (row[0] if row else None), year
+
+    def _tableStats(self, db_lookup, table_options):
+        """The TimespanBinder of a table, from its startdate or the first record"""
+        binding = table_options.get('data_binding', 'wx_binding')
+        startdate = table_options.get('startdate', None)
+        return self._timespanBinder(db_lookup, binding, int(startdate) if startdate is not None else None)
+
+    def _cachedSince(self, table_name, table_options, table_stats, cache=None):
+        """The start of the current year if the cells of all complete months and years are cached, else None"""
+        if not self.incremental:
+            return None
+        if cache is None:
+            # Before the table options are resolved: the cache of this table name, if any
+            cache = next((v['cells'] for k, v in self.cell_cache.items() if k.split('|')[0] == table_name), None)
+            if cache is None:
+                return None
+        complete_month = weeutil.weeutil.archiveMonthSpan(table_stats.timespan.stop).start
+        complete_year = weeutil.weeutil.archiveYearSpan(table_stats.timespan.stop).start
+        summary_column = weeutil.weeutil.to_bool(table_options.get("summary_column", False))
+        for year in table_stats.years():
+            if summary_column and year.timespan[1] <= complete_year and "y%d" % year.timespan[0] not in cache:
+                return None
+            for month in year.months():
+                if month.timespan[1] <= complete_month and "m%d" % month.timespan[0] not in cache:
+                    return None
+        return complete_year
+
+    def _reading(self, table_stats, binding, obs_type, aggregate_type, threshold=None):
+        """The all time value of a table (used for its unit and format), shared by equal tables"""
+        key = (binding, table_stats.timespan, obs_type, aggregate_type, threshold)
+        if key not in self.run_readings:
+            readingBinder = getattr(table_stats, obs_type)
+            if threshold is not None:
+                self.run_readings[key] = getattr(readingBinder, aggregate_type)(threshold)
+            else:
+                self.run_readings[key] = getattr(readingBinder, aggregate_type)
+        return self.run_readings[key]
+
     def _parseTableOptions(self, table_options, table_name):
         """Create an orderly list containing lower and upper thresholds, cell background and foreground colors
         """
@@ -235,6 +661,13 @@ class MyXSearch(SearchList):
         return list(zip(table_options['minvalues'], table_options['maxvalues'], table_options['colors'], font_color_list))
 
 
+    def _colorScale(self, table_options, table_name):
+        """The compiled ColorScale of a table, None if the options are wrong"""
+        if table_name not in self.color_scales:
+            bands = self._parseTableOptions(table_options, table_name)
+            self.color_scales[table_name] = ColorScale(bands) if bands is not None else None
+        return self.color_scales[table_name]
+
     def _statsHTMLTable(self, table_options, table_stats, table_name, binding, NOAA=False):
         """
         table_options: Dictionary containing skin.conf options for particluar table
@@ -243,7 +676,7 @@ class MyXSearch(SearchList):
 
         aggregation = False
 
-        cellColors = self._parseTableOptions(table_options, table_name)
+        cellColors = self._colorScale(table_options, table_name)
 
         summary_column = weeutil.weeutil.to_bool(table_options.get("summary_column", False))
 
@@ -258,9 +691,6 @@ class MyXSearch(SearchList):
             aggregate_type = table_options['aggregate_type']
             converter = table_stats.converter
 
-            # obs_type
-            readingBinder = getattr(table_stats, obs_type)
-
             # Some aggregate come with an argument
             if aggregate_type in ['max_ge', 'max_le', 'min_ge', 'min_le',
                                   'sum_ge', 'sum_le', 'avg_ge', 'avg_le',
@@ -277,14 +707,15 @@ class MyXSearch(SearchList):
                 threshold_units = table_options['aggregate_threshold'][1]
 
                 try:
-                    reading = getattr(readingBinder, aggregate_type)((threshold_value, threshold_units))
+                    reading = self._reading(table_stats, binding, obs_type, aggregate_type,
+                                            (threshold_value, threshold_units))
                 except IndexError:
                     log.info("%s: Problem with aggregate_threshold units: %s" % (os.path.basename(__file__),
                                                                                  str(threshold_units)))
                     return "Could not generate table %s" % table_name
             else:
                 try:
-                    reading = getattr(readingBinder, aggregate_type)
+                    reading = self._reading(table_stats, binding, obs_type, aggregate_type)
                 except KeyError:
                     log.info("%s: aggregate_type %s not found" % (os.path.basename(__file__),
                                                                   aggregate_type))
@@ -318,36 +749,52 @@ class MyXSearch(SearchList):
                 else:
                    format_string = reading.formatter.unit_format_dict[unit_type]
 
-        htmlText = '<table class="table historyTable text-center">\n'
-        htmlText += '    <thead><tr>\n'
-        htmlText += '        <th class="head">'
-        #if NOAA is False:
-        #    htmlText += " border-right "
-        htmlText += '%s</th>\n' % unit_formatted
+        # The html is collected in a list and joined once at the end
+        html = ['<table class="table historyTable text-center">\n',
+                '    <thead><tr>\n',
+                '        <th class="head">%s</th>\n' % unit_formatted]
 
+        month_class = "month" if NOAA is False else ""
         for mon in table_options.get('monthnames', ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']):
-            htmlText += '        <th class="'
-            if NOAA is False:
-                htmlText += "month"
-            htmlText += '">%s</th>\n' % mon
-
+            html.append('        <th class="%s">%s</th>\n' % (month_class, mon))
 
         if summary_column:
             if 'summary_heading' in table_options:
-                htmlText += '        <th class="year">%s</th>\n' % table_options['summary_heading']
+                html.append('        <th class="year">%s</th>\n' % table_options['summary_heading'])
+
+        html.append("    </tr></thead><tbody>\n")
+
+        cache = None
+        if self.incremental and NOAA is False:
+            # Months and years which ended before the month (year) of the last record do not change
+            complete_month = weeutil.weeutil.archiveMonthSpan(table_stats.timespan.stop).start
+            complete_year = weeutil.weeutil.archiveYearSpan(table_stats.timespan.stop).start
+            cache = self._tableCache(table_name, table_options, binding, unit_type, format_string)
 
-        htmlText += "    </tr></thead><tbody>\n"
+        planned = None
+        if NOAA is False and self.planner is not None:
+            try:
+                if self.planner.supported(binding, obs_type, aggregate_type):
+                    # All past cells cached: only the daily summaries of the current year are read
+                    since = self._cachedSince(table_name, table_options, table_stats, cache) \
+                        if cache is not None else None
+                    planned = self.planner.cells(binding, obs_type, aggregate_type,
+                                                 (threshold_value, threshold_units) if aggregation else None,
+                                                 converter, since)
+            except Exception as e:
+                log.info("%s: Table %s from the daily summaries failed, using single queries: %s"
+                         % (os.path.basename(__file__), table_name, e))
 
         for year in table_stats.years():
             year_number = datetime.fromtimestamp(year.timespan[0]).year
 
-            htmlLine = (' ' * 8) + '<tr>\n'
+            html.append((' ' * 8) + '<tr>\n')
 
             if NOAA is True:
-                htmlLine += (' ' * 12) + "%s\n" % \
-                            self._NoaaYear(datetime.fromtimestamp(year.timespan[0]), table_options)
+                html.append((' ' * 12) + "%s\n" %
+                            self._NoaaYear(datetime.fromtimestamp(year.timespan[0]), table_options))
             else:
-                htmlLine += (' ' * 12) + '<th class="head">%d</th>\n' % year_number
+                html.append((' ' * 12) + '<th class="head">%d</th>\n' % year_number)
 
             for month in year.months():
                 if NOAA is True:
@@ -356,74 +803,93 @@ class MyXSearch(SearchList):
 
                     if (month.timespan[1] < table_stats.timespan.start) or (month.timespan[0] > table_stats.timespan.stop):
                         # print "No data for... %d, %d" % (year_number, datetime.fromtimestamp(month.timespan[0]).month)
-                        htmlLine += '<td class="noaa">-</td>\n'
+                        html.append('<td class="noaa">-</td>\n')
                     else:
-                        htmlLine += self._NoaaCell(datetime.fromtimestamp(month.timespan[0]), table_options)
+                        html.append(self._NoaaCell(datetime.fromtimestamp(month.timespan[0]), table_options))
                 else:
-                    # update the binding to access the right DB
-                    obsMonth = getattr(month, obs_type)
-                    obsMonth.data_binding = binding;
-                    if aggregation:
-                        try:
-                            value = getattr(obsMonth, aggregate_type)((threshold_value, threshold_units)).value_t
-                        except:
-                            value = [0, 'count']
+                    key = "m%d" % month.timespan[0]
+                    if cache is not None and key in cache:
+                        value = cache[key]
+                    elif planned is not None:
+                        month_dt = datetime.fromtimestamp(month.timespan[0])
+                        value = planned[0].get((month_dt.year, month_dt.month))
                     else:
-                        value = converter.convert(getattr(obsMonth, aggregate_type).value_t)
-
-                    htmlLine += (' ' * 12) + self._colorCell(value[0], format_string, cellColors)
+                        # update the binding to access the right DB
+                        obsMonth = getattr(month, obs_type)
+                        obsMonth.data_binding = binding;
+                        value = self._aggregateValue(obsMonth, aggregate_type, aggregation,
+                                                     (threshold_value, threshold_units) if aggregation else None,
+                                                     converter)
+                    if cache is not None and key not in cache and month.timespan[1] <= complete_month:
+                        cache[key] = value
+                        self.cell_cache_dirty = True
+
+                    html.append((' ' * 12) + self._colorCell(value, format_string, cellColors))
 
             if summary_column:
-                obsYear = getattr(year, obs_type)
-                obsYear.data_binding = binding;
-
-                if aggregation:
-                    try:
-                        value = getattr(obsYear, aggregate_type)((threshold_value, threshold_units)).value_t
-                    except:
-                        value = [0, 'count']
+                key = "y%d" % year.timespan[0]
+                if cache is not None and key in cache:
+                    value = cache[key]
+                elif planned is not None:
+                    value = planned[1].get(year_number)
                 else:
-                    value = converter.convert(getattr(obsYear, aggregate_type).value_t)
+                    obsYear = getattr(year, obs_type)
+                    obsYear.data_binding = binding;
+                    value = self._aggregateValue(obsYear, aggregate_type, aggregation,
+                                                 (threshold_value, threshold_units) if aggregation else None,
+                                                 converter)
+                if cache is not None and key not in cache and year.timespan[1] <= complete_year:
+                    cache[key] = value
+                    self.cell_cache_dirty = True
 
-                htmlLine += (' ' * 12) + self._colorCell(value[0], format_string, cellColors, summary=True, noaa=NOAA)
+                html.append((' ' * 12) + self._colorCell(value, format_string, cellColors, summary=True, noaa=NOAA))
 
-            htmlLine += (' ' * 8) + "</tr>\n"
+            html.append((' ' * 8) + "</tr>\n")
 
-            htmlText += htmlLine
+        html.append("</tbody></table>\n")
 
-        htmlText += "</tbody></table>\n"
+        return ''.join(html)
 
-        return htmlText
+    def _aggregateValue(self, obs_binder, aggregate_type, aggregation, threshold, converter):
+        """The value of one cell, in the units of the report"""
+        if aggregation:
+            try:
+                return getattr(obs_binder, aggregate_type)(threshold).value_t[0]
+            except:
+                return 0
+        return converter.convert(getattr(obs_binder, aggregate_type).value_t)[0]
+
+    def _tableCache(self, table_name, table_options, binding, unit_type, format_string, now=None):
+        """The cached cells of a table. A changed table option or unit or cells older than
+        cache_max_age start a new cache"""
+        config = repr((sorted((k, str(v)) for k, v in table_options.items()), binding, unit_type, format_string))
+        key = "%s|%s" % (table_name, hashlib.sha1(config.encode('utf-8')).hexdigest()[:16])
+        now = time.time() if now is None else now
+        if key not in self.cell_cache or now - self.cell_cache[key]['created'] >= self.cell_cache_max_age:
+            # Drop the cells of an older configuration of this table
+            for old_key in [k for k in self.cell_cache if k.split('|')[0] == table_name]:
+                del self.cell_cache[old_key]
+            self.cell_cache[key] = {'created': now, 'cells': {}}
+            self.cell_cache_dirty = True
+        return self.cell_cache[key]['cells']
 
     def _colorCell(self, value, format_string, cellColors, summary=False, noaa=False):
         """Returns a '<div style= background-color: XX; color: YY"> z.zz </div>' html table entry string.
 
         value: Numeric value for the observation
         format_string: How the numberic value should be represented in the table cell.
-        cellColors: An array containing 4 lists. [minvalues], [maxvalues], [background color], [foreground color]
+        cellColors: The ColorScale of the table
         """
 
-        cellText = '<td class="'
-
         if summary is False:
-            if noaa is False:
-                cellText += ' month"'
+            cellStart = '<td class=" month"' if noaa is False else '<td class="'
         else:
-            cellText += ' year"'
+            cellStart = '<td class=" year"'
 
         if value is not None:
-            for c in cellColors:
-                if (value >= float(c[0])) and (value < float(c[1])):
-                    cellText += ' style="background-color:%s; color:%s"' % (c[2], c[3])
-                    break
-            formatted_value = format_string % value
-
-        else:
-            formatted_value = '-'
+            return '%s%s>%s</td>\n' % (cellStart, cellColors.style(value), format_string % value)
 
-        cellText += '>%s</td>\n' % formatted_value
-
-        return cellText
+        return '%s>-</td>\n' % cellStart
 
     def _NoaaCell(self, dt, table_options):
         cellText = '<td class="noaa"><a href="%s" class="btn btn-sm btn-light primaryLight btnNOAA">%s</a> </td>\n' % \
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Small JSON file with the latest values and the high/low of the day, written
+from the loop packets (and archive records) of the driver.
+
+The console and healthc pages load this file every few seconds (console.js,
+healthc.js) and replace the text of all elements with a data-obs attribute.
+The values stay current while the Cheetah pages are generated much less often.
+
+    {"dateTime": 1714567890, "obs": {"outTemp": {"value": 12.3, "formatted": "12.3°C",
+     "hi": "14.1°C", "hi_time": "13:05", "lo": "8.2°C", "lo_time": "05:45"}, ...}}
+
+The values are converted and formatted with the units and formats of the skin
+(skin.conf merged over [StdReport] [[Defaults]]), the high/low of the day
+starts with the values of the daily summaries.
+
+Settings in weewx.conf:
+
+[Engine]
+    [[Services]]
+        report_services = weewx.engine.StdPrint, weewx.engine.StdReport, user.livejson.LiveJson
+
+[LiveJson]
+    data_binding = wx_binding
+    skin = console                      # units and formats of this skin
+    json_file = live.json               # relative to HTML_ROOT of [StdReport] or absolute, may be a list
+    write_interval = 10                 # seconds between two writes
+    #obs_types = outTemp, outHumidity, barometer, windSpeed, rain   # default: all numeric values
+
+In the skin.conf of the skin:
+
+[Extras]
+    live_json = live.json
+    live_interval = 10
+"""
+
+import json
+import os
+import time
+
+from configobj import ConfigObj
+
+import weewx
+import weewx.units
+from weewx.engine import StdService
+import weeutil.weeutil
+
+import user.davisconsoleutil
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "LiveJson: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+SKIP_KEYS = ('dateTime', 'usUnits', 'interval')
+
+
+def skin_units(config_dict, skin):
+    """Return the converter and formatter of a skin"""
+    skin_dict = ConfigObj()
+    skin_dict.merge(config_dict.get('StdReport', {}).get('Defaults', {}))
+    if skin:
+        skin_path = os.path.join(config_dict.get('WEEWX_ROOT', ''),
+                                 config_dict.get('StdReport', {}).get('SKIN_ROOT', 'skins'), skin, 'skin.conf')
+        try:
+            skin_dict.merge(ConfigObj(skin_path, encoding='utf-8'))
+        except (IOError, SyntaxError) as error:
+            logerr("Could not read %s: %s" % (skin_path, error))
+    return weewx.units.Converter.fromSkinDict(skin_dict), weewx.units.Formatter.fromSkinDict(skin_dict)
+
+
+class DayHighLow(object):
+    """High and low of the day for each observation, in database units"""
+
+    def __init__(self, dbm):
+        self.dbm = dbm
+        self.day = None
+        self.values = {}
+
+    def add(self, obs_type, value, ts):
+        day = weeutil.weeutil.startOfDay(ts)
+        if day != self.day:
+            self.day = day
+            self.values = {}
+        hilo = self.values.get(obs_type)
+        if hilo is None:
+            hilo = self.values[obs_type] = self._from_summary(obs_type) or [value, ts, value, ts]
+        if value < hilo[0]:
+            hilo[0], hilo[1] = value, ts
+        if value > hilo[2]:
+            hilo[2], hilo[3] = value, ts
+        return hilo
+
+    def _from_summary(self, obs_type):
+        """[min, mintime, max, maxtime] of the daily summary of today, after a restart"""
+        if self.dbm is None:
+            return None
+        try:
+            sql = "SELECT min, mintime, max, maxtime FROM %s_day_%s WHERE dateTime = ?" % (self.dbm.table_name, obs_type)
+            row = self.dbm.getSql(sql, (self.day,))
+        except Exception as error:
+            logdbg("No daily summary for %s: %s" % (obs_type, error))
+            return None
+        if row is None or row[0] is None or row[2] is None:
+            return None
+        return list(row)
+
+
+class LiveJson(StdService):
+    """Write the latest values and the high/low of the day to a JSON file"""
+
+    def __init__(self, engine, config_dict):
+        super(LiveJson, self).__init__(engine, config_dict)
+
+        options = config_dict.get("LiveJson", {})
+        binding = options.get("data_binding", "wx_binding")
+        html_root = os.path.join(config_dict.get('WEEWX_ROOT', ''),
+                                 config_dict.get('StdReport', {}).get('HTML_ROOT', 'public_html'))
+        self.paths = [os.path.join(html_root, name) for name in
+                      weeutil.weeutil.option_as_list(options.get("json_file", "live.json"))]
+        self.write_interval = float(options.get("write_interval", 10))
+        obs_types = weeutil.weeutil.option_as_list(options.get("obs_types"))
+        self.obs_types = set(obs_types) if obs_types else None
+        self.converter, self.formatter = skin_units(config_dict, options.get("skin", "console"))
+
+        try:
+            dbm = self.engine.db_binder.get_manager(data_binding=binding, initialize=True)
+            self.std_unit_system = dbm.std_unit_system
+        except Exception as error:
+            logerr("No database for the high/low of the day: %s" % error)
+            dbm = None
+            self.std_unit_system = None
+        self.hilo = DayHighLow(dbm)
+        self.latest = {}
+        self.last_ts = None
+        self.last_write = 0
+
+        loginf("Live values every %s seconds to %s" % (self.write_interval, ", ".join(self.paths)))
+        self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
+
+    def new_loop_packet(self, event):
+        self._add(event.packet)
+        if time.time() - self.last_write >= self.write_interval:
+            self.write()
+
+    def new_archive_record(self, event):
+        # Values only in archive records (e.g. the health data of the console)
+        self._add(event.record)
+        self.write()
+
+    def _add(self, packet):
+        if packet.get('dateTime') is None:
+            return
+        if self.std_unit_system is not None and packet.get('usUnits') not in (None, self.std_unit_system):
+            packet = weewx.units.to_std_system(packet, self.std_unit_system)
+        ts = packet['dateTime']
+        for obs_type, value in packet.items():
+            if obs_type in SKIP_KEYS or value is None or isinstance(value, (bool, str)):
+                continue
+            if not isinstance(value, (int, float)):
+                continue
+            if self.obs_types is not None and obs_type not in self.obs_types:
+                continue
+            self.latest[obs_type] = (value, packet.get('usUnits', self.std_unit_system), self.hilo.add(obs_type, value, ts))
+        self.last_ts = ts
+
+    def _format(self, value, unit_system, obs_type):
+        value_t = self.converter.convert(weewx.units.as_value_tuple(
+            {'usUnits': unit_system, obs_type: value}, obs_type))
+        return value_t, self.formatter.toString(value_t)
+
+    def snapshot(self):
+        """The JSON document of the latest values"""
+        values = {}
+        for obs_type, (value, unit_system, hilo) in self.latest.items():
+            try:
+                value_t, formatted = self._format(value, unit_system, obs_type)
+                entry = {'value': value_t[0], 'unit': value_t[1], 'formatted': formatted}
+                for key, (hilo_value, hilo_ts) in (('lo', hilo[0:2]), ('hi', hilo[2:4])):
+                    entry[key] = self._format(hilo_value, unit_system, obs_type)[1]
+                    entry[key + '_time'] = time.strftime("%H:%M", time.localtime(hilo_ts)) if hilo_ts else None
+            except (KeyError, TypeError, ValueError) as error:
+                logdbg("%s not formatted: %s" % (obs_type, error))
+                continue
+            values[obs_type] = entry
+        return {'dateTime': self.last_ts, 'obs': values}
+
+    def write(self):
+        if not self.latest:
+            return
+        data = json.dumps(self.snapshot(), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        for path in self.paths:
+            try:
+                user.davisconsoleutil.atomic_write(path, data)
+            except (IOError, OSError) as error:
+                logerr("Could not write %s: %s" % (path, error))
+        self.last_write = time.time()
@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+CheetahGenerator for the console skin which regenerates the NOAA month and year
+summaries (SummaryByMonth, SummaryByYear) only when their data changed.
+
+The CheetahGenerator writes a summary of a past month only if the file does not
+exist. A month imported or corrected later is never written again. This
+generator reads one fingerprint per month (days, records, last day and the sums
+of a few observations) from the daily summaries with one query and keeps them
+in a manifest in SQLITE_ROOT. Before the templates are run, the month and year
+files of every month whose fingerprint changed are removed, the CheetahGenerator
+then writes them again. All other past months are not touched.
+
+Settings in skin.conf:
+
+[CheetahGenerator]
+    summary_manifest = console_summaries.json   # relative to SQLITE_ROOT
+    summary_obs = outTemp, rain, windSpeed, barometer
+
+[Generators]
+    generator_list = user.noaagenerator.IncrementalCheetahGenerator, weewx.imagegenerator.ImageGenerator, ...
+
+The first run only records the fingerprints, existing files are kept. After an
+import, regenerate all summaries (or those from a month on) in the next report run:
+    PYTHONPATH=/usr/share/weewx python3 noaagenerator.py --config=/etc/weewx/weewx.conf
+                                                         --manifest=console_summaries.json --regenerate [--start=YYYY-mm]
+"""
+
+from __future__ import print_function
+
+import os
+import time
+
+import weewx.cheetahgenerator
+import weeutil.weeutil
+
+import user.davisconsoleutil
+
+try:
+    from weeutil.config import accumulateLeaves
+except ImportError:
+    from weeutil.weeutil import accumulateLeaves
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "NOAAGenerator: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+DEFAULT_OBS = ['outTemp', 'rain', 'windSpeed', 'barometer']
+
+# Report type and the time span of a summary file
+SUMMARY_SPANS = {
+    'SummaryByMonth': weeutil.weeutil.archiveMonthSpan,
+    'SummaryByYear': weeutil.weeutil.archiveYearSpan,
+}
+
+
+def month_fingerprints(dbm, obs_types):
+    """Return {'YYYY-mm': [days, records, last day, sum obs_1, ...]} of local months.
+
+    The day rows of all observations are read with one query (the daily summaries
+    joined on dateTime), observations without daily summary are left out.
+    """
+    tables = dbm.connection.tables()
+    obs_types = [obs for obs in obs_types if "%s_day_%s" % (dbm.table_name, obs) in tables]
+    if not obs_types:
+        return {}
+    columns = ["t0.dateTime", "t0.count"]
+    joins = ["%s_day_%s AS t0" % (dbm.table_name, obs_types[0])]
+    for i, obs in enumerate(obs_types):
+        columns.append("t%d.sum" % i)
+        if i:
+            joins.append("LEFT JOIN %s_day_%s AS t%d ON t%d.dateTime = t0.dateTime"
+                         % (dbm.table_name, obs, i, i))
+    sql = "SELECT %s FROM %s WHERE t0.count > 0" % (", ".join(columns), " ".join(joins))
+    months = {}
+    for row in dbm.genSql(sql):
+        key = time.strftime("%Y-%m", time.localtime(row[0]))
+        fingerprint = months.get(key)
+        if fingerprint is None:
+            fingerprint = months[key] = [0, 0, 0] + [0.0] * len(obs_types)
+        fingerprint[0] += 1
+        fingerprint[1] += row[1] or 0
+        fingerprint[2] = max(fingerprint[2], row[0])
+        for i, value in enumerate(row[2:]):
+            fingerprint[3 + i] += value or 0.0
+    # Rounded, so the float sums compare equal after a JSON round trip
+    return dict((key, f[:3] + [round(v, 3) for v in f[3:]]) for key, f in months.items())
+
+
+def month_start(key):
+    """Start of the local month 'YYYY-mm'"""
+    year, month = key.split('-')
+    return int(time.mktime((int(year), int(month), 1, 0, 0, 0, 0, 0, -1)))
+
+
+class IncrementalCheetahGenerator(weewx.cheetahgenerator.CheetahGenerator):
+    """CheetahGenerator which writes past NOAA summaries again after their data changed"""
+
+    def run(self):
+        gen_dict = self.skin_dict.get('CheetahGenerator', {})
+        manifest_path = user.davisconsoleutil.state_path(
+            self.config_dict,
+            gen_dict.get('summary_manifest', "%s_summaries.json" % self.skin_dict.get('REPORT_NAME', 'report')))
+        obs_types = weeutil.weeutil.option_as_list(gen_dict.get('summary_obs')) or DEFAULT_OBS
+        binding = gen_dict.get('data_binding', self.skin_dict.get('data_binding', 'wx_binding'))
+
+        months = None
+        try:
+            t1 = time.time()
+            dbm = self.db_binder.get_manager(binding)
+            fingerprints = month_fingerprints(dbm, obs_types)
+            self._remove_changed(manifest_path, fingerprints, obs_types)
+            # Only after the changed summaries are removed, otherwise the next run tries again
+            months = fingerprints
+            logdbg("Summary fingerprints of %d months in %.2f seconds" % (len(months), time.time() - t1))
+        except Exception as error:
+            # Without fingerprints the generator works like the CheetahGenerator
+            logerr("Summary fingerprints failed: %s" % error)
+
+        super(IncrementalCheetahGenerator, self).run()
+
+        if months is not None:
+            user.davisconsoleutil.write_json(manifest_path, {
+                'binding': binding, 'obs': obs_types, 'months': months, 'updated': int(time.time())})
+
+    def _remove_changed(self, manifest_path, months, obs_types):
+        manifest = user.davisconsoleutil.read_json(manifest_path)
+        if manifest is None or manifest.get('obs') != obs_types:
+            loginf("New summary manifest %s, existing summaries kept" % manifest_path)
+            return
+        regenerate_from = manifest.get('regenerate_from')
+        old = manifest.get('months', {})
+        changed = [key for key in months
+                   if old.get(key) != months[key]
+                   or (regenerate_from is not None and month_start(key) >= regenerate_from)]
+        if not changed:
+            return
+        removed = 0
+        for key in changed:
+            start = month_start(key)
+            for report_type, span in SUMMARY_SPANS.items():
+                removed += self._remove_summary(report_type, span(start + 1))
+        loginf("%d changed months, %d summary files removed" % (len(changed), removed))
+
+    def _remove_summary(self, report_type, timespan):
+        """Remove the files of all templates of report_type for timespan"""
+        section = self.skin_dict.get('CheetahGenerator', {}).get(report_type)
+        if not section or (self.gen_ts and timespan.includesArchiveTime(self.gen_ts)):
+            # The summary of the current month/year is written in every run anyway
+            return 0
+        removed = 0
+        for name in section.sections:
+            report_dict = accumulateLeaves(section[name])
+            path = os.path.join(self.config_dict['WEEWX_ROOT'], report_dict['HTML_ROOT'],
+                                os.path.dirname(report_dict['template']),
+                                self._getFileName(report_dict['template'],
+                                                  time.localtime(timespan.start)))
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+if __name__ == "__main__":
+    import optparse
+
+    import weecfg
+
+    usage = """Usage: %prog --config=CONFIG_FILE --manifest=FILE --regenerate [--start=YYYY-mm]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--config', dest='config_path', metavar='CONFIG_FILE',
+                      help='Use configuration file CONFIG_FILE')
+    parser.add_option('--manifest', dest='manifest', default='console_summaries.json',
+                      help='summary_manifest of the skin (default console_summaries.json)')
+    parser.add_option('--regenerate', dest='regenerate', action='store_true',
+                      help='Write the summaries again in the next report run')
+    parser.add_option('--start', dest='start', default=None,
+                      help='Only the summaries from this month on (YYYY-mm)')
+    (options, args) = parser.parse_args()
+
+    if not options.regenerate:
+        parser.print_help()
+        exit(0)
+
+    config_path, config_dict = weecfg.read_config(options.config_path, args)
+    path = user.davisconsoleutil.state_path(config_dict, options.manifest)
+    manifest = user.davisconsoleutil.read_json(path)
+    if manifest is None:
+        print("No manifest %s, the generator has not run yet" % path)
+        exit(1)
+    manifest['regenerate_from'] = month_start(options.start) if options.start else 0
+    user.davisconsoleutil.write_json(path, manifest)
+    print("Summaries %s will be written again in the next report run"
+          % ("from %s" % options.start if options.start else "of all months"))
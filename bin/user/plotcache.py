@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+ImageGenerator which keeps the time series of the plots between report runs.
+
+The ImageGenerator reads the whole time span of every plot line from the
+database in every report run, for a year plot 365 daily aggregates. Only the
+last interval or two are new. This generator keeps the series of each plot line
+(observation, binding, aggregation and the line options) in one binary file in
+SQLITE_ROOT and reads only the tail from the last complete interval on:
+
+  - the intervals before the new start of the plot are dropped
+  - the last complete interval is read again together with the new ones and
+    must be equal to the kept one, otherwise (different interval grid, changed
+    data) the whole series is read again
+  - a series older than max_age is read again completely (imports, corrections),
+    series of plots not drawn for max_age are dropped from the file
+
+Cumulative aggregates and the observation types in exclude_types are always
+read completely.
+
+Settings in skin.conf:
+
+[ImageGenerator]
+    series_cache_file = console_series.bin     # relative to SQLITE_ROOT
+    series_max_age = 86400                     # seconds
+    #series_exclude_types = windvec
+
+[Generators]
+    generator_list = ..., user.plotcache.CachedImageGenerator, ...
+"""
+
+import array
+import bisect
+import json
+import math
+import struct
+import sys
+import threading
+import time
+
+import weewx.imagegenerator
+import weewx.xtypes
+from weewx.units import ValueTuple
+import weeutil.weeutil
+
+import user.davisconsoleutil
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "PlotCache: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+MAGIC = b'WXSERIES1\n'
+
+
+def _pack_values(values):
+    """Return (kind, list of arrays) of a data vector, or None if it can not be packed"""
+    real = array.array('d')
+    if all(value is None or isinstance(value, (int, float)) for value in values):
+        real.extend(float('nan') if value is None else value for value in values)
+        return 'd', [real]
+    if all(value is None or isinstance(value, (int, float, complex)) for value in values):
+        # Wind vectors
+        imag = array.array('d')
+        for value in values:
+            if value is None:
+                real.append(float('nan'))
+                imag.append(float('nan'))
+            else:
+                real.append(value.real)
+                imag.append(complex(value).imag)
+        return 'c', [real, imag]
+    return None
+
+
+def _unpack_values(kind, arrays):
+    if kind == 'c':
+        return [None if math.isnan(r) else complex(r, i) for r, i in zip(arrays[0], arrays[1])]
+    return [None if math.isnan(r) else r for r in arrays[0]]
+
+
+class Series(object):
+    """One cached series: interval starts and stops, values and their units"""
+
+    def __init__(self, start, stop, data, units, req_start, complete_ts, created):
+        self.start = start
+        self.stop = stop
+        self.data = data
+        self.units = units
+        self.req_start = req_start
+        self.complete_ts = complete_ts
+        self.created = created
+
+    @classmethod
+    def from_vectors(cls, vectors, req_start, complete_ts, created):
+        start_vec_t, stop_vec_t, data_vec_t = vectors
+        units = [start_vec_t[1], start_vec_t[2], stop_vec_t[1], stop_vec_t[2], data_vec_t[1], data_vec_t[2]]
+        return cls(list(start_vec_t[0]), list(stop_vec_t[0]), list(data_vec_t[0]), units,
+                   req_start, complete_ts, created)
+
+
+class SeriesCache(object):
+    """The series of all plot lines of a report, in one binary file.
+
+    File layout: MAGIC, length of the JSON header (8 bytes), JSON header, then
+    for each series its int64 starts, int64 stops and float64 values (two
+    arrays for complex values). None is stored as NaN.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.series = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return
+        if not data.startswith(MAGIC):
+            return
+        try:
+            pos = len(MAGIC)
+            header_len = struct.unpack('<Q', data[pos:pos + 8])[0]
+            pos += 8
+            header = json.loads(data[pos:pos + header_len].decode('utf-8'))
+            pos += header_len
+            for key, meta in header.items():
+                n, kind = meta['n'], meta['kind']
+                arrays = []
+                for typecode in ['q', 'q'] + ['d'] * (2 if kind == 'c' else 1):
+                    a = array.array(typecode)
+                    a.frombytes(data[pos:pos + 8 * n])
+                    if sys.byteorder == 'big':
+                        a.byteswap()
+                    pos += 8 * n
+                    arrays.append(a)
+                self.series[key] = Series(arrays[0].tolist(), arrays[1].tolist(), _unpack_values(kind, arrays[2:]),
+                                          meta['units'], meta['req_start'], meta['complete_ts'], meta['created'])
+        except (ValueError, KeyError, struct.error) as error:
+            logerr("Series cache %s not readable, starting empty: %s" % (self.path, error))
+            self.series = {}
+
+    def save(self, max_age, now=None):
+        """Write the series younger than max_age seconds, older ones would be read completely anyway.
+
+        Series not used in this run are kept: plots with an aggregate interval are
+        skipped by the ImageGenerator until the next interval begins.
+        """
+        now = time.time() if now is None else now
+        header = {}
+        blobs = []
+        for key in sorted(self.series):
+            series = self.series[key]
+            if now - series.created >= max_age:
+                continue
+            packed = _pack_values(series.data)
+            if packed is None:
+                continue
+            kind, arrays = packed
+            arrays = [array.array('q', series.start), array.array('q', series.stop)] + arrays
+            for a in arrays:
+                if sys.byteorder == 'big':
+                    a.byteswap()
+                blobs.append(a.tobytes())
+            header[key] = {'n': len(series.start), 'kind': kind, 'units': series.units,
+                           'req_start': series.req_start, 'complete_ts': series.complete_ts,
+                           'created': series.created}
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        user.davisconsoleutil.atomic_write(
+            self.path, MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes + b''.join(blobs))
+
+
+class CachedImageGenerator(weewx.imagegenerator.ImageGenerator):
+    """ImageGenerator which reads only the new intervals of the plot series"""
+
+    def run(self):
+        image_dict = self.skin_dict.get('ImageGenerator', {})
+        self.max_age = int(image_dict.get('series_max_age', 86400))
+        self.exclude_types = set(weeutil.weeutil.option_as_list(image_dict.get('series_exclude_types')) or [])
+        self.cache = SeriesCache(user.davisconsoleutil.state_path(
+            self.config_dict,
+            image_dict.get('series_cache_file', "%s_series.bin" % self.skin_dict.get('REPORT_NAME', 'report'))))
+        self.stats = {'tail': 0, 'full': 0, 'direct': 0}
+        self.thread_id = threading.current_thread().ident
+        self.original_get_series = weewx.xtypes.get_series
+
+        # The ImageGenerator calls weewx.xtypes.get_series(), it is replaced while the images are generated
+        weewx.xtypes.get_series = self.get_series
+        try:
+            super(CachedImageGenerator, self).run()
+        finally:
+            weewx.xtypes.get_series = self.original_get_series
+        try:
+            self.cache.save(self.max_age)
+        except (IOError, OSError) as error:
+            logerr("Series cache not written: %s" % error)
+        logdbg("Series: %(tail)d tail reads, %(full)d full reads, %(direct)d not cached" % self.stats)
+
+    def get_series(self, obs_type, timespan, db_manager, aggregate_type=None, aggregate_interval=None,
+                   **option_dict):
+        if threading.current_thread().ident != self.thread_id or aggregate_type == 'cumulative' \
+                or obs_type in self.exclude_types:
+            self.stats['direct'] += 1
+            return self.original_get_series(obs_type, timespan, db_manager, aggregate_type, aggregate_interval,
+                                            **option_dict)
+
+        options = dict((k, v) for k, v in option_dict.items() if k != 'plotgen_ts')
+        key = json.dumps([obs_type, db_manager.database_name, db_manager.table_name, aggregate_type,
+                          aggregate_interval, options], sort_keys=True, default=str)
+        complete_ts = db_manager.last_timestamp
+        now = time.time()
+
+        series = self.cache.series.get(key)
+        if series is not None and now - series.created < self.max_age and complete_ts is not None \
+                and complete_ts >= series.complete_ts:
+            result = self._tail(series, obs_type, timespan, db_manager, aggregate_type, aggregate_interval,
+                                option_dict)
+            if result is not None:
+                self.stats['tail'] += 1
+                self.cache.series[key] = Series.from_vectors(result, timespan.start, complete_ts, series.created)
+                return result
+
+        self.stats['full'] += 1
+        result = self.original_get_series(obs_type, timespan, db_manager, aggregate_type, aggregate_interval,
+                                          **option_dict)
+        if complete_ts is not None and all(isinstance(ts, int) for ts in result[0][0]) \
+                and _pack_values(result[2][0]) is not None:
+            self.cache.series[key] = Series.from_vectors(result, timespan.start, complete_ts, now)
+        else:
+            self.cache.series.pop(key, None)
+        return result
+
+    def _tail(self, series, obs_type, timespan, db_manager, aggregate_type, aggregate_interval, option_dict):
+        """Kept intervals plus the intervals read from the last complete one on, None if they do not fit"""
+        if aggregate_type:
+            # The intervals start at the start of the plot, it must be one of the kept interval starts
+            first = bisect.bisect_left(series.start, timespan.start)
+            if not (first < len(series.start) and series.start[first] == timespan.start) \
+                    and series.req_start != timespan.start:
+                return None
+        else:
+            # Archive records from the start of the plot on. Whether a record at the start itself
+            # belongs to the series depends on the type, a query of an empty time span tells.
+            first = bisect.bisect_left(series.stop, timespan.start)
+            if first < len(series.stop) and series.stop[first] == timespan.start:
+                probe = self.original_get_series(obs_type, weeutil.weeutil.TimeSpan(timespan.start, timespan.start),
+                                                 db_manager, aggregate_type, aggregate_interval, **option_dict)
+                if not probe[0][0]:
+                    first += 1
+        # Intervals which ended before the last record at the time they were read are complete
+        last = bisect.bisect_right(series.stop, series.complete_ts) - 1
+        if last < first:
+            return None
+
+        tail = self.original_get_series(obs_type, weeutil.weeutil.TimeSpan(series.start[last], timespan.stop),
+                                        db_manager, aggregate_type, aggregate_interval, **option_dict)
+        tail_series = Series.from_vectors(tail, series.start[last], None, None)
+        # Some types include the record at the start of the time span, the tail starts at the kept interval
+        k = bisect.bisect_left(tail_series.start, series.start[last])
+        if k >= len(tail_series.start) or tail_series.units != series.units \
+                or tail_series.start[k] != series.start[last] or tail_series.stop[k] != series.stop[last] \
+                or tail_series.data[k] != series.data[last]:
+            # Different interval grid or changed data
+            return None
+        u = series.units
+        return (ValueTuple(series.start[first:last] + tail_series.start[k:], u[0], u[1]),
+                ValueTuple(series.stop[first:last] + tail_series.stop[k:], u[2], u[3]),
+                ValueTuple(series.data[first:last] + tail_series.data[k:], u[4], u[5]))
@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Generators which measure where the time of a report run goes. They are
+opt-in: the skins run their own generators, a profiling generator replaces one
+of them in generator_list while the times are needed.
+
+While a generator runs, these calls of its thread are timed:
+
+  - template:  each template of [CheetahGenerator] (all files it writes)
+  - extension: get_extension_list() of each search list extension
+  - history:   each table of [HistoryReport] (user.historygenerator3.MyXSearch)
+  - tag:       each tag lookup of the templates ($current.outTemp, $month.rain.sum ...)
+  - plot:      each plot of [ImageGenerator] (series and drawing)
+  - sql:       each query of the database managers (getSql, genSql, getRecord),
+               numbers in the statement are replaced by ?
+
+Per name the count and the seconds are written to profile_file (JSON), the
+self time of every call stack to stack_file in the collapsed format of
+flamegraph.pl / speedscope ("generator;template:index.html.tmpl;tag:day.rain.sum 1234",
+microseconds). Both files are in SQLITE_ROOT, one entry per generator, written
+after every report run. Queries of other threads (HistoryReport workers > 1)
+are not counted.
+
+Settings in skin.conf:
+
+[Profiler]
+    enable = 1
+    profile_file = console_profile.json         # relative to SQLITE_ROOT
+    stack_file = console_profile.folded         # relative to SQLITE_ROOT
+
+[Generators]
+    generator_list = user.reportprofiler.ProfilingCheetahGenerator, user.reportprofiler.ProfilingImageGenerator, ...
+
+ProfilingCheetahGenerator and ProfilingImageGenerator are the stock weewx
+generators with the timing of CheetahProfilerMixin and ImageProfilerMixin. To
+profile another generator, combine it with the mixin in a module of user/:
+
+    class ProfilingIncrementalCheetahGenerator(user.reportprofiler.CheetahProfilerMixin,
+                                               user.noaagenerator.IncrementalCheetahGenerator):
+        pass
+
+The slowest calls of the last run:
+    PYTHONPATH=/usr/share/weewx python3 reportprofiler.py --config=/etc/weewx/weewx.conf
+                                                          --file=console_profile.json [--top=20]
+"""
+
+from __future__ import print_function
+
+import re
+import threading
+import time
+
+import Cheetah.Template
+import weeplot.genplot
+import weewx.cheetahgenerator
+import weewx.imagegenerator
+import weewx.manager
+import weeutil.weeutil
+
+import user.davisconsoleutil
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "ReportProfiler: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+# Name lookups of the compiled Cheetah templates, one call per tag
+TAG_FUNCTIONS = ('VFFSL', 'VFSL', 'VFN')
+
+NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+SPACE = re.compile(r"\s+")
+
+
+def sql_name(sql):
+    """The statement without numbers and line breaks, usable in a stack"""
+    return NUMBER.sub('?', SPACE.sub(' ', sql.strip())).replace(';', '')[:200]
+
+
+class Profile(object):
+    """Times and call stacks of the calls of one thread"""
+
+    def __init__(self, root):
+        self.thread_id = threading.current_thread().ident
+        self.root = root
+        # [label, category, name, start, time of the calls inside]
+        self.stack = []
+        self.stacks = {}
+        self.stats = {}
+        self.start = time.time()
+        self.t1 = time.perf_counter()
+
+    def active(self):
+        return threading.current_thread().ident == self.thread_id
+
+    def enter(self, category, name):
+        self.stack.append(["%s:%s" % (category, name), category, name, time.perf_counter(), 0.0])
+
+    def leave(self, count=1):
+        label, category, name, t1, inner = self.stack.pop()
+        elapsed = time.perf_counter() - t1
+        path = ';'.join([self.root] + [frame[0] for frame in self.stack] + [label])
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - inner
+        if self.stack:
+            self.stack[-1][4] += elapsed
+        stat = self.stats.setdefault(category, {}).setdefault(name, [0, 0.0])
+        stat[0] += count
+        stat[1] += elapsed
+
+    def wrap(self, category, name, function):
+        """function timed as category:name(*args) in the thread of the profile"""
+        def timed(*args, **kwargs):
+            if not self.active():
+                return function(*args, **kwargs)
+            self.enter(category, name(*args) if callable(name) else name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+        return timed
+
+    def wrap_generator(self, category, name, function):
+        """Generator function timed per row, counted once"""
+        def timed(*args, **kwargs):
+            if not self.active():
+                for item in function(*args, **kwargs):
+                    yield item
+                return
+            label = name(*args)
+            rows = function(*args, **kwargs)
+            count = 1
+            while True:
+                self.enter(category, label)
+                try:
+                    item = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    self.leave(count)
+                    count = 0
+                yield item
+        return timed
+
+    def result(self):
+        total = time.perf_counter() - self.t1
+        stats = {}
+        for category, names in self.stats.items():
+            stats[category] = [{'name': name, 'count': count, 'seconds': round(seconds, 6)}
+                               for name, (count, seconds) in sorted(names.items(), key=lambda x: -x[1][1])]
+        return {'start': int(self.start), 'seconds': round(total, 6), 'stats': stats,
+                'stacks': dict((path, int(seconds * 1e6)) for path, seconds in self.stacks.items())}
+
+
+class ProfilerMixin(object):
+    """Runs a generator with timed calls and writes the result"""
+
+    def profile_run(self, run):
+        options = self.skin_dict.get('Profiler', {})
+        if not weeutil.weeutil.to_bool(options.get('enable', False)):
+            return run()
+        report = self.skin_dict.get('REPORT_NAME', 'report')
+        self.profile = Profile(report)
+        patches = [(weewx.manager.Manager, 'getSql', self.profile.wrap(
+                        'sql', lambda dbm, sql, *args: sql_name(sql), weewx.manager.Manager.getSql)),
+                   (weewx.manager.Manager, 'genSql', self.profile.wrap_generator(
+                        'sql', lambda dbm, sql, *args: sql_name(sql), weewx.manager.Manager.genSql)),
+                   (weewx.manager.Manager, 'getRecord', self.profile.wrap(
+                        'sql', 'getRecord', weewx.manager.Manager.getRecord))] + self.profile_patches()
+        originals = [(owner, name, owner.__dict__[name]) for owner, name, _ in patches]
+        for owner, name, function in patches:
+            setattr(owner, name, function)
+        try:
+            self.profile.enter('run', self.__class__.__name__)
+            try:
+                run()
+            finally:
+                self.profile.leave()
+        finally:
+            for owner, name, function in originals:
+                setattr(owner, name, function)
+            self.profile_restore()
+        self._write_profile(options, report)
+
+    def profile_patches(self):
+        """[(class, attribute, timed function)] replaced while the generator runs"""
+        return []
+
+    def profile_restore(self):
+        pass
+
+    def _write_profile(self, options, report):
+        result = self.profile.result()
+        profile_path = user.davisconsoleutil.state_path(
+            self.config_dict, options.get('profile_file', "%s_profile.json" % report))
+        stack_path = user.davisconsoleutil.state_path(
+            self.config_dict, options.get('stack_file', "%s_profile.folded" % report))
+        try:
+            profiles = user.davisconsoleutil.read_json(profile_path, {})
+            profiles[self.__class__.__name__] = result
+            user.davisconsoleutil.write_json(profile_path, profiles)
+            lines = ["%s %d" % (path, value) for name in sorted(profiles)
+                     for path, value in sorted(profiles[name].get('stacks', {}).items()) if value > 0]
+            user.davisconsoleutil.atomic_write(stack_path, ('\n'.join(lines) + '\n').encode('utf-8'))
+        except (IOError, OSError) as error:
+            logerr("Profile not written: %s" % error)
+            return
+        loginf("Profile of %s for report %s: %.2f seconds, %d queries, written to %s"
+               % (self.__class__.__name__, report, result['seconds'],
+                  sum(entry['count'] for entry in result['stats'].get('sql', [])), profile_path))
+
+
+class CheetahProfilerMixin(ProfilerMixin):
+    """Timed templates, extensions, tags and queries of a CheetahGenerator"""
+
+    def run(self):
+        self.tag_globals = []
+        self.profile_run(super(CheetahProfilerMixin, self).run)
+
+    def profile_patches(self):
+        # Templates and their #include files are compiled by Template.compile()
+        original = Cheetah.Template.Template.__dict__['compile']
+
+        def compile_template(klass, *args, **kwargs):
+            result = original.__get__(None, klass)(*args, **kwargs)
+            if isinstance(result, type) and self.profile.active():
+                self._wrap_tags(result)
+            return result
+        return [(Cheetah.Template.Template, 'compile', classmethod(compile_template))]
+
+    def profile_restore(self):
+        # The compiled template classes are kept by Cheetah, their lookups must be the original ones again
+        for module_globals, originals in self.tag_globals:
+            module_globals.update(originals)
+        self.tag_globals = []
+
+    def _wrap_tags(self, template_class):
+        """Time the name lookups in the module of the compiled template"""
+        module_globals = getattr(getattr(template_class, 'respond', None), '__globals__', None)
+        if module_globals is None or any(g is module_globals for g, _ in self.tag_globals):
+            return
+        originals = dict((name, module_globals[name]) for name in TAG_FUNCTIONS if name in module_globals)
+        self.tag_globals.append((module_globals, originals))
+        for name, function in originals.items():
+            # VFFSL(searchList, name, ...), VFSL(searchList, name, ...), VFN(object, name, ...)
+            if name == 'VFN':
+                # Attributes of a call result ($month($months_ago=1).rain.sum), named by the class of the result
+                tag = lambda obj, key, *args, **kwargs: "%s.%s" % (obj.__class__.__name__, key)
+            else:
+                tag = lambda search_list, key, *args, **kwargs: key
+            module_globals[name] = self.profile.wrap('tag', tag, function)
+
+    def generate(self, section, section_name, gen_ts):
+        if 'template' not in section or not getattr(self, 'profile', None) or not self.profile.active():
+            return super(CheetahProfilerMixin, self).generate(section, section_name, gen_ts)
+        self.profile.enter('template', section['template'])
+        try:
+            return super(CheetahProfilerMixin, self).generate(section, section_name, gen_ts)
+        finally:
+            self.profile.leave()
+
+    def init_extensions(self, gen_dict):
+        super(CheetahProfilerMixin, self).init_extensions(gen_dict)
+        self._wrap_extensions()
+
+    def initExtensions(self, gen_dict):
+        # weewx 4
+        super(CheetahProfilerMixin, self).initExtensions(gen_dict)
+        self._wrap_extensions()
+
+    def _wrap_extensions(self):
+        if not getattr(self, 'profile', None) or not self.profile.active():
+            return
+        for obj in self.search_list_objs:
+            name = "%s.%s" % (obj.__class__.__module__, obj.__class__.__name__)
+            obj.get_extension_list = self.profile.wrap('extension', name, obj.get_extension_list)
+            if hasattr(obj, '_statsHTMLTable'):
+                # MyXSearch: one call per [HistoryReport] table
+                obj._statsHTMLTable = self.profile.wrap(
+                    'history', lambda table_options, table_stats, table_name, *args, **kwargs: table_name,
+                    obj._statsHTMLTable)
+
+
+class ImageProfilerMixin(ProfilerMixin):
+    """Timed plots and queries of an ImageGenerator"""
+
+    def run(self):
+        self.plot_name = None
+        self.profile_run(super(ImageProfilerMixin, self).run)
+
+    def profile_patches(self):
+        # The image is drawn after gen_plot() returned
+        return [(weeplot.genplot.GeneralPlot, 'render', self.profile.wrap(
+            'plot', lambda plot: "%s (render)" % self.plot_name, weeplot.genplot.GeneralPlot.render))]
+
+    def gen_plot(self, plotgen_ts, plot_options, plot_dict):
+        if not getattr(self, 'profile', None) or not self.profile.active():
+            return super(ImageProfilerMixin, self).gen_plot(plotgen_ts, plot_options, plot_dict)
+        # [ImageGenerator] section / plot
+        self.plot_name = "%s/%s" % (plot_dict.parent.name, plot_dict.name)
+        self.profile.enter('plot', self.plot_name)
+        try:
+            return super(ImageProfilerMixin, self).gen_plot(plotgen_ts, plot_options, plot_dict)
+        finally:
+            self.profile.leave()
+
+
+class ProfilingCheetahGenerator(CheetahProfilerMixin, weewx.cheetahgenerator.CheetahGenerator):
+    """CheetahGenerator with timed templates, extensions, tags and queries"""
+
+
+class ProfilingImageGenerator(ImageProfilerMixin, weewx.imagegenerator.ImageGenerator):
+    """ImageGenerator with timed plots and queries"""
+
+
+if __name__ == "__main__":
+    import optparse
+
+    import weecfg
+
+    usage = """Usage: %prog --config=CONFIG_FILE --file=FILE [--top=N]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--config', dest='config_path', metavar='CONFIG_FILE',
+                      help='Use configuration file CONFIG_FILE')
+    parser.add_option('--file', dest='file', default='console_profile.json',
+                      help='profile_file of the skin (default console_profile.json)')
+    parser.add_option('--top', dest='top', type='int', default=10,
+                      help='Show the N slowest names of each category (default 10)')
+    (options, args) = parser.parse_args()
+
+    config_path, config_dict = weecfg.read_config(options.config_path, args)
+    path = user.davisconsoleutil.state_path(config_dict, options.file)
+    profiles = user.davisconsoleutil.read_json(path)
+    if profiles is None:
+        print("No profile %s, the profiling generators have not run yet" % path)
+        exit(1)
+    for generator in sorted(profiles):
+        profile = profiles[generator]
+        print("%s, %s: %.2f seconds" % (generator, time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                 time.localtime(profile['start'])),
+                                        profile['seconds']))
+        for category in sorted(profile['stats']):
+            entries = profile['stats'][category]
+            print("  %s: %d calls, %.2f seconds" % (category, sum(e['count'] for e in entries),
+                                                    sum(e['seconds'] for e in entries)))
+            for entry in entries[:options.top]:
+                print("    %8.3f s %6d  %s" % (entry['seconds'], entry['count'], entry['name']))
@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+"""
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+Daily solar summary: possible and actual sunshine per day.
+
+For every (local) day one row is stored in the table solar_day of the data
+binding, next to the rollups and daily summaries:
+
+    dateTime        start of the day
+    dayLength       seconds the sun is above the horizon (sunevents.py)
+    maxSunshine     seconds a clear sky would count as sunshine (sunrainduration.py:
+                    clear-sky radiation above sunshine_min)
+    clearSkyEnergy  clear-sky radiation of the day in Wh/m²
+
+The rows depend only on the station and the date, they are calculated once
+by the service (the days of the current year, then one more day every day) or
+by --rebuild. The search list only reads the table. The actual sunshine
+duration comes from the daily summary of sunshineDur.
+
+Settings in weewx.conf:
+
+[Engine]
+    [[Services]]
+        archive_services = ..., user.solarsummary.SolarSummary
+
+[SolarSummary]
+    data_binding = wx_binding
+    table = solar_day
+    #backend = noaa         # sun events with pyephem (default if installed) or noaa
+
+sunshine_min is taken from [RadiationDays].
+
+Search list tags (skin.conf [CheetahGenerator] search_list_extensions = ..., user.solarsummary.SolarSummarySearch):
+
+    $solar_summary.today        the day of the report
+    $solar_summary.days         all days of the year of the report
+    $solar_summary.months       the months of the year of the report
+
+Every entry is a dict of ValueHelpers (formatted and converted like $day.outTemp.max):
+dateTime, dayLength, maxSunshine, sunshineDur (group_deltatime), clearSkyEnergy
+(Wh/m²), relativeSunshine (percent of maxSunshine) and for the months the number
+of days:
+
+    #for $d in $solar_summary.months
+    $d.dateTime.format("%b") $d.sunshineDur $d.maxSunshine $d.relativeSunshine
+    #end for
+
+Fill the table for the whole archive (the service adds the current year only):
+    PYTHONPATH=/usr/share/weewx python3 solarsummary.py --config=/etc/weewx/weewx.conf --rebuild
+"""
+
+from __future__ import print_function
+
+import time
+
+import weedb
+import weewx
+import weewx.units
+from weewx.engine import StdService
+from weewx.units import ValueHelper, ValueTuple
+import weeutil.weeutil
+
+import user.sunevents
+import user.sunrainduration
+
+try:
+    from weewx.cheetahgenerator import SearchList
+except ImportError:
+    SearchList = object
+
+try:
+    # Test for new-style weewx logging by trying to import weeutil.logger
+    import weeutil.logger
+    import logging
+
+    log = logging.getLogger(__name__)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        log.debug(msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        log.info(msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        log.error(msg)
+
+
+except ImportError:
+    # Old-style weewx logging
+    import syslog
+
+    def logmsg(level, msg):
+        """Log messages"""
+        syslog.syslog(level, "SolarSummary: %s:" % msg)
+
+    def logdbg(msg):
+        """Log debug messages"""
+        logmsg(syslog.LOG_DEBUG, msg)
+
+    def loginf(msg):
+        """Log info messages"""
+        logmsg(syslog.LOG_INFO, msg)
+
+    def logerr(msg):
+        """Log error messages"""
+        logmsg(syslog.LOG_ERR, msg)
+
+
+COLUMNS = ('dateTime', 'dayLength', 'maxSunshine', 'clearSkyEnergy')
+
+# Units of the values of a day or month
+UNITS = {
+    'dateTime': ('unix_epoch', 'group_time'),
+    'dayLength': ('second', 'group_deltatime'),
+    'maxSunshine': ('second', 'group_deltatime'),
+    'sunshineDur': ('second', 'group_deltatime'),
+    'clearSkyEnergy': ('watt_hour_per_meter_squared', 'group_radiation_energy'),
+    'relativeSunshine': ('percent', 'group_percent'),
+    'days': ('count', 'group_count'),
+}
+
+# Radiation energy per area is not a unit of weewx
+for unit_system in (weewx.units.USUnits, weewx.units.MetricUnits, weewx.units.MetricWXUnits):
+    unit_system.setdefault('group_radiation_energy', 'watt_hour_per_meter_squared')
+weewx.units.default_unit_format_dict.setdefault('watt_hour_per_meter_squared', '%.0f')
+weewx.units.default_unit_label_dict.setdefault('watt_hour_per_meter_squared', u' Wh/m²')
+
+
+def day_lengths(day_spans, latitude, longitude, backend=None):
+    """Seconds of daylight per day span, from the sunrise/sunset events of SunEvents"""
+    start_ts, stop_ts = day_spans[0].start, day_spans[-1].stop
+    events = user.sunevents.SunEvents(start_ts, stop_ts, str(longitude), str(latitude), 0,
+                                      backend=backend).get_transits(0)
+    lengths = [0] * len(day_spans)
+
+    def add(start, stop):
+        for i, span in enumerate(day_spans):
+            if start < span.stop and stop > span.start:
+                lengths[i] += min(stop, span.stop) - max(start, span.start)
+
+    up = events[0][1] > 0
+    rise_ts = last_ts = start_ts
+    for ts, alt, name in events[1:]:
+        if name in ('transit', 'antitransit'):
+            # Near the polar day/night one of two risings (settings) of a UTC day is not
+            # in the events, the altitude of the transits tells the state of the sun
+            if alt > 0 and not up:
+                up, rise_ts = True, last_ts
+            elif alt < 0 and up:
+                add(rise_ts, last_ts)
+                up = False
+        elif name == 'rising' and not up:
+            up, rise_ts = True, ts
+        elif name in ('setting', 'end') and up:
+            add(rise_ts, ts)
+            up = False
+        last_ts = ts
+    return lengths
+
+
+def clear_sky(span, latitude, longitude, sunshine_min):
+    """Seconds with clear-sky radiation above sunshine_min and the clear-sky energy (Wh/m²) of a day"""
+    minutes = range(span.start, span.stop, 60)
+    if user.sunrainduration.numpy is not None:
+        radiation = user.sunrainduration.sunshine_threshold_array(list(minutes), latitude, longitude, 1.0)
+        return 60 * int((radiation > max(sunshine_min, 0.0)).sum()), float(radiation.sum()) / 60.0
+    solar = user.sunrainduration.SolarGeometry(latitude, longitude, 1.0)
+    radiation = [solar.threshold(ts) for ts in minutes]
+    return 60 * sum(1 for r in radiation if r > max(sunshine_min, 0.0)), sum(radiation) / 60.0
+
+
+class SolarDayStore(object):
+    """The solar_day table in the database of a manager"""
+
+    def __init__(self, dbm, latitude, longitude, sunshine_min=0.0, table='solar_day', backend=None, create=True):
+        self.dbm = dbm
+        self.latitude = latitude
+        self.longitude = longitude
+        self.sunshine_min = sunshine_min
+        self.table = table
+        self.backend = backend
+        if create and table not in self.dbm.connection.tables():
+            self.dbm.connection.execute(
+                "CREATE TABLE %s (dateTime INTEGER NOT NULL PRIMARY KEY, dayLength INTEGER, "
+                "maxSunshine INTEGER, clearSkyEnergy REAL)" % table)
+            loginf("Created table %s" % table)
+
+    def fill(self, start_ts, stop_ts):
+        """Calculate and store the days of start_ts to stop_ts which are not in the table yet"""
+        spans = list(weeutil.weeutil.genDaySpans(start_ts, stop_ts))
+        if not spans:
+            return 0
+        have = set(row[0] for row in self.dbm.genSql(
+            "SELECT dateTime FROM %s WHERE dateTime >= ? AND dateTime < ?" % self.table,
+            (spans[0].start, spans[-1].stop)))
+        missing = [span for span in spans if span.start not in have]
+        if not missing:
+            return 0
+        lengths = day_lengths(missing, self.latitude, self.longitude, self.backend)
+        rows = []
+        for span, length in zip(missing, lengths):
+            max_sunshine, energy = clear_sky(span, self.latitude, self.longitude, self.sunshine_min)
+            rows.append((span.start, length, max_sunshine, round(energy, 1)))
+        with weedb.Transaction(self.dbm.connection) as cursor:
+            for row in rows:
+                cursor.execute("REPLACE INTO %s (%s) VALUES (?, ?, ?, ?)" % (self.table, ", ".join(COLUMNS)), row)
+        logdbg("Stored %d days in %s" % (len(rows), self.table))
+        return len(rows)
+
+    def get_days(self, start_ts, stop_ts):
+        """Return the stored day dicts for start_ts <= dateTime < stop_ts, with the actual sunshine duration"""
+        try:
+            rows = list(self.dbm.genSql("SELECT %s FROM %s WHERE dateTime >= ? AND dateTime < ? ORDER BY dateTime"
+                                        % (", ".join(COLUMNS), self.table), (start_ts, stop_ts)))
+        except weedb.DatabaseError as error:
+            # Not filled yet (no service, no --rebuild)
+            logdbg("No solar summary in %s: %s" % (self.table, error))
+            return []
+        sunshine = self._sunshine(start_ts, stop_ts)
+        days = []
+        for row in rows:
+            day = dict(zip(COLUMNS, row))
+            day['sunshineDur'] = sunshine.get(row[0])
+            days.append(with_relative(day))
+        return days
+
+    def _sunshine(self, start_ts, stop_ts):
+        """{day start: sunshineDur sum} from the daily summary"""
+        try:
+            return dict((row[0], row[1]) for row in self.dbm.genSql(
+                "SELECT dateTime, sum FROM %s_day_sunshineDur WHERE dateTime >= ? AND dateTime < ?"
+                % self.dbm.table_name, (start_ts, stop_ts)))
+        except weedb.DatabaseError:
+            return {}
+
+
+def with_relative(day):
+    if day['sunshineDur'] is not None and day['maxSunshine']:
+        day['relativeSunshine'] = 100.0 * day['sunshineDur'] / day['maxSunshine']
+    else:
+        day['relativeSunshine'] = None
+    return day
+
+
+def by_month(days):
+    """Sum day dicts to month dicts (dateTime = first day of the month)"""
+    months = []
+    for day in days:
+        month = time.localtime(day['dateTime'])[:2]
+        if not months or months[-1][0] != month:
+            months.append((month, {'dateTime': day['dateTime'], 'days': 0, 'dayLength': 0, 'maxSunshine': 0,
+                                   'clearSkyEnergy': 0.0, 'sunshineDur': None}))
+        total = months[-1][1]
+        total['days'] += 1
+        for key in ('dayLength', 'maxSunshine', 'clearSkyEnergy'):
+            total[key] += day[key]
+        if day['sunshineDur'] is not None:
+            total['sunshineDur'] = (total['sunshineDur'] or 0) + day['sunshineDur']
+    return [with_relative(total) for _, total in months]
+
+
+def store_from_config(config_dict, dbm, create=True):
+    options = config_dict.get('SolarSummary', {})
+    radiation_dict = config_dict.get('RadiationDays', {})
+    return SolarDayStore(dbm,
+                         float(config_dict['Station']['latitude']),
+                         float(config_dict['Station']['longitude']),
+                         float(radiation_dict.get('sunshine_min', 0)),
+                         options.get('table', 'solar_day'),
+                         options.get('backend'),
+                         create)
+
+
+class SolarSummary(StdService):
+    """Add the missing rows of the current year and the next day when a new day starts"""
+
+    def __init__(self, engine, config_dict):
+        super(SolarSummary, self).__init__(engine, config_dict)
+
+        binding = config_dict.get('SolarSummary', {}).get('data_binding', 'wx_binding')
+        dbm = self.engine.db_binder.get_manager(data_binding=binding, initialize=True)
+        self.store = store_from_config(config_dict, dbm)
+        self.day = None
+
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
+
+    def new_archive_record(self, event):
+        day = weeutil.weeutil.startOfArchiveDay(event.record['dateTime'])
+        if day == self.day:
+            return
+        try:
+            year = weeutil.weeutil.archiveYearSpan(event.record['dateTime'])
+            n = self.store.fill(year.start, max(year.stop, day + 2 * 86400))
+            if n > 2:
+                loginf("Solar summary of %d days stored" % n)
+            self.day = day
+        except weedb.DatabaseError as error:
+            logerr("Solar summary update failed: %s" % error)
+
+
+class SolarSummaryTags(object):
+    """$solar_summary in the templates"""
+
+    def __init__(self, store, timespan, formatter=None, converter=None):
+        self.store = store
+        self.timespan = timespan
+        self.formatter = formatter if formatter is not None else weewx.units.Formatter()
+        self.converter = converter
+        self._days = None
+
+    def _year_days(self):
+        if self._days is None:
+            year = weeutil.weeutil.archiveYearSpan(self.timespan.stop)
+            self._days = self.store.get_days(year.start, year.stop)
+        return self._days
+
+    def _helpers(self, values, context):
+        return dict((key, ValueHelper(ValueTuple(value, UNITS[key][0], UNITS[key][1]), context,
+                                      self.formatter, self.converter))
+                    for key, value in values.items())
+
+    @property
+    def days(self):
+        return [self._helpers(d, 'month') for d in self._year_days()]
+
+    @property
+    def months(self):
+        return [self._helpers(m, 'year') for m in by_month(self._year_days())]
+
+    @property
+    def today(self):
+        day = weeutil.weeutil.archiveDaySpan(self.timespan.stop)
+        for d in self._year_days():
+            if d['dateTime'] == day.start:
+                return self._helpers(d, 'month')
+        return None
+
+
+class SolarSummarySearch(SearchList):
+    """Search list extension for $solar_summary"""
+
+    def __init__(self, generator):
+        SearchList.__init__(self, generator)
+        self.binding = generator.config_dict.get('SolarSummary', {}).get('data_binding', 'wx_binding')
+
+    def get_extension_list(self, timespan, db_lookup):
+        # Read only, the table is filled by the service or --rebuild
+        store = store_from_config(self.generator.config_dict, db_lookup(self.binding), create=False)
+        return [{'solar_summary': SolarSummaryTags(store, timespan, self.generator.formatter,
+                                                   self.generator.converter)}]
+
+
+if __name__ == "__main__":
+    import optparse
+
+    import weecfg
+    import weewx.manager
+
+    usage = """Usage: %prog --config=CONFIG_FILE --rebuild [--binding=BINDING]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--config', dest='config_path', metavar='CONFIG_FILE',
+                      help='Use configuration file CONFIG_FILE')
+    parser.add_option('--binding', dest='binding', default=None,
+                      help='Data binding (default from [SolarSummary] or wx_binding)')
+    parser.add_option('--rebuild', dest='rebuild', action='store_true',
+                      help='Calculate the solar summary of all days of the archive')
+    (options, args) = parser.parse_args()
+
+    if not options.rebuild:
+        parser.print_help()
+        exit(0)
+
+    config_path, config_dict = weecfg.read_config(options.config_path, args)
+    weeutil.logger.setup('solarsummary', config_dict)
+    binding = options.binding or config_dict.get('SolarSummary', {}).get('data_binding', 'wx_binding')
+
+    with weewx.manager.open_manager_with_config(config_dict, binding) as dbm:
+        store = store_from_config(config_dict, dbm)
+        first = dbm.firstGoodStamp()
+        if first is None:
+            print("No data in %s" % binding)
+            exit(0)
+        store.dbm.connection.execute("DELETE FROM %s" % store.table)
+        t1 = time.time()
+        n = 0
+        for year in weeutil.weeutil.genYearSpans(first, dbm.lastGoodStamp()):
+            n += store.fill(year.start, year.stop)
+        print("Calculated %d days in %.1f seconds" % (n, time.time() - t1))
@@ -6,22 +6,49 @@
 
 Tested on Weewx release 4.10.1
 
+The events of a day depend only on the UTC day, the station and the horizon angle.
+They are memoised per (UTC day, lat, lon, elevation, horizon angle) for the whole
+process; with cache_file they are also kept on disk for the next report run:
+
+    SunEvents(start_ts, end_ts, lon, lat, elev, cache_file='/var/lib/weewx/sunevents.json')
+
+Two backends calculate the events:
+    ephem   pyephem (default if installed)
+    noaa    the NOAA solar position algorithm, pure Python, all days at once with
+            numpy if installed. Used if pyephem is not installed. The times differ
+            from pyephem by about a minute at most, the results are not cached.
+
+    SunEvents(start_ts, end_ts, lon, lat, elev, backend='noaa')
+
+lon and lat as for pyephem: strings are degrees ('11.5' or '11:30:00'), numbers
+are radians.
+
 ############################################################################################
 #
 """
 
+import math
 from math import pi
 
+import json
 import logging
 from weeutil.weeutil import startOfDayUTC
 from weewx.almanac import djd_to_timestamp, timestamp_to_djd
 
+import user.davisconsoleutil
+
 log = logging.getLogger(__name__)
 
 try:
     import ephem
 except ImportError:
-    log.info("pyephem not found, some features are not available.")
+    ephem = None
+    log.info("pyephem not found, using the NOAA algorithm for sun events.")
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def rad_2_deg(value):
     return value * 180.0 / pi
@@ -31,13 +58,217 @@ def deg_2_rad(value):
     return value * pi / 180.0
 
 
+def to_degrees(value):
+    """Longitude/latitude in degrees, value as accepted by ephem.Observer"""
+    if isinstance(value, str):
+        sign = -1.0 if value.strip().startswith('-') else 1.0
+        degrees = 0.0
+        for i, part in enumerate(value.strip().lstrip('+-').split(':')):
+            degrees += float(part) / 60.0 ** i
+        return sign * degrees
+    return rad_2_deg(float(value))
+
+
+class _ScalarOps(object):
+    """math functions for one day at a time"""
+    sin = staticmethod(math.sin)
+    cos = staticmethod(math.cos)
+    tan = staticmethod(math.tan)
+    arcsin = staticmethod(math.asin)
+    radians = staticmethod(math.radians)
+    degrees = staticmethod(math.degrees)
+
+    @staticmethod
+    def arccos(value):
+        return math.acos(value) if -1.0 <= value <= 1.0 else float('nan')
+
+    @staticmethod
+    def where(condition, a, b):
+        return a if condition else b
+
+
+class _ArrayOps(object):
+    """numpy functions for all days at once"""
+
+    def __getattr__(self, name):
+        return getattr(numpy, name)
+
+    @staticmethod
+    def arccos(value):
+        return numpy.where(numpy.abs(value) <= 1.0, numpy.arccos(numpy.clip(value, -1.0, 1.0)), numpy.nan)
+
+
+def _refraction(altitude_deg):
+    """Bennett: refraction in degrees for an apparent altitude"""
+    if altitude_deg < -1.0:
+        return 0.0
+    return 1.0 / math.tan(math.radians(altitude_deg + 7.31 / (altitude_deg + 4.4))) / 60.0
+
+
+class NoaaSun(object):
+    """Sun events with the NOAA solar position algorithm (Jean Meeus, low accuracy).
+
+    All methods take a list of UTC day starts and return one result per day; with
+    numpy the days are calculated at once. The events are the ones within the UTC
+    day, None for a day without the event. Altitudes are apparent (refracted)
+    altitudes in radians.
+    """
+
+    def __init__(self, lon, lat):
+        self.lon = lon
+        self.lat = math.radians(lat)
+        self.ops = _ArrayOps() if numpy is not None else _ScalarOps()
+
+    def _solar(self, ts):
+        """Declination (radians) and equation of time (minutes) at ts"""
+        m = self.ops
+        jc = (ts / 86400.0 + 2440587.5 - 2451545.0) / 36525.0
+        l0 = m.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360.0)
+        ma = m.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+        ecc = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+        center = (m.sin(ma) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+                  + m.sin(2.0 * ma) * (0.019993 - 0.000101 * jc) + m.sin(3.0 * ma) * 0.000289)
+        omega = m.radians(125.04 - 1934.136 * jc)
+        app_long = l0 + m.radians(center - 0.00569 - 0.00478 * m.sin(omega))
+        obliquity = m.radians(23.0 + (26.0 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60.0) / 60.0
+                              + 0.00256 * m.cos(omega))
+        decl = m.arcsin(m.sin(obliquity) * m.sin(app_long))
+        y = m.tan(obliquity / 2.0) ** 2
+        eqtime = 4.0 * m.degrees(y * m.sin(2.0 * l0) - 2.0 * ecc * m.sin(ma)
+                                 + 4.0 * ecc * y * m.sin(ma) * m.cos(2.0 * l0)
+                                 - 0.5 * y * y * m.sin(4.0 * l0) - 1.25 * ecc * ecc * m.sin(2.0 * ma))
+        return decl, eqtime
+
+    def _altitude(self, ts):
+        """Apparent altitude (radians) at ts"""
+        m = self.ops
+        decl, eqtime = self._solar(ts)
+        hour_angle = m.radians(((ts % 86400.0) / 60.0 + eqtime + 4.0 * self.lon) / 4.0 - 180.0)
+        alt = m.degrees(m.arcsin(math.sin(self.lat) * m.sin(decl)
+                                 + math.cos(self.lat) * m.cos(decl) * m.cos(hour_angle)))
+        # Saemundsson, true to apparent altitude
+        refraction = m.where(alt > -1.0, 1.02 / m.tan(m.radians(alt + 10.3 / (alt + 5.11))) / 60.0, 0.0)
+        return m.radians(alt + refraction)
+
+    def _event(self, day_start, minutes, altitude=None, sign=0.0):
+        """Time of solar noon + minutes (+ sign * hour angle of altitude) within the UTC day"""
+        m = self.ops
+        result = float('nan')
+        for offset in (1, 0, -1):
+            base = day_start + offset * 86400.0
+            t = base + (720.0 + minutes - 4.0 * self.lon) * 60.0
+            for _ in range(3):
+                decl, eqtime = self._solar(t)
+                hour_angle = 0.0
+                if altitude is not None:
+                    hour_angle = m.degrees(m.arccos((math.sin(altitude) - math.sin(self.lat) * m.sin(decl))
+                                                    / (math.cos(self.lat) * m.cos(decl))))
+                t = base + (720.0 + minutes - 4.0 * self.lon - eqtime + sign * 4.0 * hour_angle) * 60.0
+            # Each event is in exactly one UTC day, a day without it gets nan
+            result = m.where((t >= day_start) & (t < day_start + 86400.0), t, result)
+        return result
+
+    def _per_day(self, day_starts, fn):
+        """Call fn with all days (numpy) or with every day, returns lists per result"""
+        if numpy is not None:
+            return [numpy.asarray(r).tolist() for r in fn(numpy.asarray(day_starts, dtype=float))]
+        return [list(r) for r in zip(*[fn(float(day)) for day in day_starts])]
+
+    @staticmethod
+    def _ts(value):
+        return int(value) if value == value else None
+
+    def transits(self, day_starts):
+        """[((transit_ts, alt, "transit"), (antitransit_ts, alt, "antitransit")), ...]"""
+
+        def calc(days):
+            transit = self._event(days, 0.0)
+            antitransit = self._event(days, -720.0)
+            return transit, self._altitude(transit), antitransit, self._altitude(antitransit)
+
+        t, t_alt, a, a_alt = self._per_day(day_starts, calc)
+        return [((self._ts(t[i]), t_alt[i], "transit"), (self._ts(a[i]), a_alt[i], "antitransit"))
+                for i in range(len(t))]
+
+    def rise_set(self, day_starts, horizon):
+        """[((rise_ts, horizon, "rising"), (set_ts, horizon, "setting")), ...], horizon in radians"""
+        horizon_deg = rad_2_deg(horizon)
+        altitude = deg_2_rad(horizon_deg - _refraction(horizon_deg))
+
+        def calc(days):
+            return self._event(days, 0.0, altitude, -1.0), self._event(days, 0.0, altitude, 1.0)
+
+        rise, sets = self._per_day(day_starts, calc)
+        return [((self._ts(rise[i]), horizon, "rising"), (self._ts(sets[i]), horizon, "setting"))
+                for i in range(len(rise))]
+
+    def altitude(self, ts):
+        """Apparent altitude (radians) at ts"""
+        return float(self._altitude(float(ts)))
+
+
+class SunEventCache():
+    """Sun events per day and horizon angle, optionally backed by a JSON file"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = {}
+        self.dirty = False
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    self.events = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+
+    @staticmethod
+    def key(day_ts, lon, lat, elev, angle):
+        return "%d|%s|%s|%s|%s" % (day_ts, lat, lon, elev, angle)
+
+    def get(self, key):
+        return self.events.get(key)
+
+    def put(self, key, events):
+        self.events[key] = events
+        self.dirty = True
+
+    def save(self):
+        if self.path and self.dirty:
+            try:
+                user.davisconsoleutil.write_json(self.path, self.events)
+                self.dirty = False
+            except (IOError, OSError) as e:
+                log.info("Could not write sun event cache %s: %s" % (self.path, e))
+
+
+# One cache per file (None = memory only), shared by all SunEvents of the process
+_caches = {}
+
+
+def get_cache(path=None):
+    if path not in _caches:
+        _caches[path] = SunEventCache(path)
+    return _caches[path]
+
+
 class SunEvents():
-    def __init__(self, start_ts, end_ts, lon, lat, elev):
+    def __init__(self, start_ts, end_ts, lon, lat, elev, cache_file=None, backend=None):
         self.start_ts = start_ts
         self.end_ts = end_ts
-        station = ephem.Observer()
-        station.lon, station.lat, station.elevation = lon, lat, elev
-        self.station = station
+        if backend not in (None, 'ephem', 'noaa'):
+            log.info("Unknown sun event backend '%s'" % backend)
+            backend = None
+        if backend != 'noaa' and ephem is None:
+            backend = 'noaa'
+        self.backend = backend or 'ephem'
+        if self.backend == 'noaa':
+            self.sun = NoaaSun(to_degrees(lon), to_degrees(lat))
+        else:
+            station = ephem.Observer()
+            station.lon, station.lat, station.elevation = lon, lat, elev
+            self.station = station
+        self.location = (lon, lat, elev)
+        self.cache = get_cache(cache_file)
         self.transits = []
 
     def calc_rise_set(self, horizon, use_center=True):
@@ -78,40 +309,80 @@ class SunEvents():
         return (transit_date_ts, transit_alt, "transit"), (
         antitransit_date_ts, antitransit_alt, "antitransit")
 
-    def append_transits(self, values):
+    def append_transits(self, values, transits=None):
+        if transits is None:
+            transits = self.transits
         for value in values:
             value_ts = value[0]
             value_angle = value[1]
             value_text = value[2]
             if value_ts is not None and self.start_ts <= value_ts <= self.end_ts:
-                self.transits.append([value_ts, rad_2_deg(value_angle), value_text])
+                transits.append([value_ts, rad_2_deg(value_angle), value_text])
 
     def get_transits(self, angle_degree):
+        self.transits = self.get_transits_multi([angle_degree])[angle_degree]
+        return self.transits
 
-        angle_rad = deg_2_rad(angle_degree)
-        ephem_start = ephem.Date(timestamp_to_djd(self.start_ts))
-        self.station.date = ephem_start
-        sun = ephem.Sun(self.station)
-        self.append_transits([[self.start_ts, sun.alt, "start"]])
+    def get_transits_multi(self, angles_degree):
+        """Events for several horizon angles in one pass over the days.
 
-        for t in range(self.start_ts - 3600 * 24, self.end_ts + 3600 * 24 + 1, 3600 * 24):
-            start_of_day_utc = startOfDayUTC(t)
+        Returns {angle_degree: transits}, each list like the result of get_transits.
+        Transit and antitransit are calculated once per day for all angles.
+        """
+        result = dict((angle_degree, []) for angle_degree in angles_degree)
+        days = [startOfDayUTC(t) for t in range(self.start_ts - 3600 * 24, self.end_ts + 3600 * 24 + 1, 3600 * 24)]
 
-            self.station.date = ephem.Date(timestamp_to_djd(start_of_day_utc))
+        if self.backend == 'noaa':
+            start_alt = self.sun.altitude(self.start_ts)
+            end_alt = self.sun.altitude(self.end_ts)
+            transits_per_day = self.sun.transits(days)
+            rise_set_per_day = {}
+            for angle_degree in result:
+                angle_rad = deg_2_rad(angle_degree)
+                rise_set_per_day[angle_degree] = [list(below) + list(above) for below, above in zip(
+                    self.sun.rise_set(days, -angle_rad), self.sun.rise_set(days, angle_rad))]
+        else:
+            self.station.date = ephem.Date(timestamp_to_djd(self.start_ts))
+            start_alt = ephem.Sun(self.station).alt
+            self.station.date = ephem.Date(timestamp_to_djd(self.end_ts))
+            end_alt = ephem.Sun(self.station).alt
+            transits_per_day, rise_set_per_day = self._ephem_events(days, result)
 
-            lower_rise_set = self.calc_rise_set(-angle_rad)
-            self.append_transits(lower_rise_set)
-            upper_rise_set = self.calc_rise_set(angle_rad)
-            self.append_transits(upper_rise_set)
+        for transits in result.values():
+            self.append_transits([[self.start_ts, start_alt, "start"]], transits)
+        for i in range(len(days)):
+            for angle_degree, transits in result.items():
+                self.append_transits(rise_set_per_day[angle_degree][i], transits)
+                self.append_transits(transits_per_day[i], transits)
+        for transits in result.values():
+            self.append_transits([[self.end_ts, end_alt, "end"]], transits)
+            transits.sort(key=lambda x: x[0])
+        return result
 
-            transit_antitransit = self.calc_transits()
-            self.append_transits(transit_antitransit)
+    def _ephem_events(self, days, angles_degree):
+        """Transits per day and {angle: rise/set per day} with pyephem and the cache"""
+        transits_per_day = []
+        rise_set_per_day = dict((angle_degree, []) for angle_degree in angles_degree)
+        for start_of_day_utc in days:
+            day_date = ephem.Date(timestamp_to_djd(start_of_day_utc))
 
-        ephem_end = timestamp_to_djd(self.end_ts)
-        self.station.date = ephem_end
-        sun = ephem.Sun(self.station)
-        self.append_transits([[self.end_ts, sun.alt, "end"]])
+            key = SunEventCache.key(start_of_day_utc, *self.location, angle='transit')
+            transit_antitransit = self.cache.get(key)
+            if transit_antitransit is None:
+                self.station.date = day_date
+                transit_antitransit = self.calc_transits()
+                self.cache.put(key, transit_antitransit)
+            transits_per_day.append(transit_antitransit)
 
-        self.transits.sort(key=lambda x: x[0])
-        return self.transits
+            for angle_degree in angles_degree:
+                key = SunEventCache.key(start_of_day_utc, *self.location, angle=angle_degree)
+                rise_set = self.cache.get(key)
+                if rise_set is None:
+                    angle_rad = deg_2_rad(angle_degree)
+                    self.station.date = day_date
+                    rise_set = list(self.calc_rise_set(-angle_rad)) + list(self.calc_rise_set(angle_rad))
+                    self.cache.put(key, rise_set)
+                rise_set_per_day[angle_degree].append(rise_set)
 
+        self.cache.save()
+        return transits_per_day, rise_set_per_day
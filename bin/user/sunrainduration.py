@@ -48,6 +48,22 @@ weewx.conf:
     sunshine2_log = 0
     rainDur2_log = 0
 
+    duration_mode = step    # interpolate: estimate the time between sparse loop packets (API driver),
+                            # only for the channels with loop = 1 (sunshine_loop, rainDur_loop ...).
+                            # A channel with loop = 0 takes the archive record: whole interval or 0
+    state_file = sunrainduration_state.json   # checkpoint of the counters (in SQLITE_ROOT)
+    state_max_age = 900     # seconds, older checkpoints are not restored after a restart
+                            # (the downtime is not counted, records archived before the first loop
+                            # packet after the restart get the whole-interval fallback)
+
+    # more duration channels (e.g. a third station), see class SunshineDuration
+    #[[Channels]]
+    #    [[[sunshine_3]]]
+    #        obs = radiation_3
+    #        output = sunshineDur_3
+    #        predicate = sunshine          # or positive (rain, hail)
+    #        loop = 1
+
 
 add_sunrain.sh:
 #!/bin/bash
@@ -88,13 +104,19 @@ weewx.units.obs_group_dict['rainDur_2'] = 'group_deltatime'
 
 import syslog
 from math import sin,cos,pi,asin
-from datetime import datetime
 import time
 import weewx
 import weewx.units
 from weewx.wxengine import StdService
+
+import user.davisconsoleutil
 #import schemas.wview_extendedmy
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     # Test for new-style weewx logging by trying to import weeutil.logger
     import weeutil.logger
@@ -146,366 +168,462 @@ weewx.units.obs_group_dict['hailDur'] = 'group_deltatime'
 weewx.units.obs_group_dict['sunshineDur_2'] = 'group_deltatime'
 weewx.units.obs_group_dict['rainDur_2'] = 'group_deltatime'
 
-class SunshineDuration(StdService):
-    def __init__(self, engine, config_dict):
-        # Pass the initialization information on to my superclass:
-        super(SunshineDuration, self).__init__(engine, config_dict)
-
-        # Default threshold value is 0.8
-        self.sunshine_coeff = 0.8
-
-        # Default Log threshold
-        self.sunshine_log = 0
-        self.rainDur_log = 0
-        self.hailDur_log = 0
-
-        # Default min value
-        self.sunshine_min = 0
-
-        self.sunshine_loop = 1
-        self.rainDur_loop = 0
-        self.hailDur_loop = 0
-
-        self.sunshine2 = 0
-        self.rain2 = 0
+class SolarGeometry(object):
+    """Sunshine threshold (W/m²) for a station.
+
+    The day constants (equation of time, declination, seasonal factor) are
+    calculated once per UTC day, the threshold once per minute of the day.
+    """
+
+    def __init__(self, latitude, longitude, coeff):
+        self.latitude = latitude
+        self.sin_lat = sin((pi / 180) * latitude)
+        self.cos_lat = cos((pi / 180) * latitude)
+        self.corrtemps = longitude * 4
+        self.coeff = coeff
+        self.day = None
+        self.minutes = None
+
+    def set_day(self, mydatetime):
+        """Calculate the constants of the UTC day of mydatetime"""
+        self.day = int(mydatetime // 86400)
+        dayofyear = time.gmtime(mydatetime).tm_yday
+        theta = 360 * dayofyear / 365
+        self.equatemps = 0.0172 + 0.4281 * cos((pi / 180) * theta) - 7.3515 * sin(
+            (pi / 180) * theta) - 3.3495 * cos(2 * (pi / 180) * theta) - 9.3619 * sin(
+            2 * (pi / 180) * theta)
+        declinaison = asin(0.006918 - 0.399912 * cos((pi / 180) * theta) + 0.070257 * sin(
+            (pi / 180) * theta) - 0.006758 * cos(2 * (pi / 180) * theta) + 0.000908 * sin(
+            2 * (pi / 180) * theta)) * (180 / pi)
+        self.sin_decl = sin((pi / 180) * declinaison)
+        self.cos_decl = cos((pi / 180) * declinaison)
+        self.season = (0.73 + 0.06 * cos((pi / 180) * 360 * dayofyear / 365)) * 1080 * self.coeff
+        self.minutes = [None] * 1440
+
+    def threshold(self, mydatetime):
+        if int(mydatetime // 86400) != self.day:
+            self.set_day(mydatetime)
+        minutesjour = int(mydatetime % 86400) // 60
+        seuil = self.minutes[minutesjour]
+        if seuil is None:
+            seuil = self.minutes[minutesjour] = self.minute_threshold(minutesjour)
+        return seuil
 
-        self.sunshine2_loop = 1
-        self.rainDur2_loop = 0
+    def minute_threshold(self, minutesjour):
+        tempsolaire = (minutesjour + self.corrtemps + self.equatemps) / 60
+        angle_horaire = (tempsolaire - 12) * 15
+        hauteur_soleil = asin(self.sin_lat * self.sin_decl + self.cos_lat * self.cos_decl * cos(
+            (pi / 180) * angle_horaire)) * (180 / pi)
+        if hauteur_soleil > 0:
+            seuil = self.season * pow((sin(pi / 180 * hauteur_soleil)), 1.25)
+        else :
+            seuil=0
+        return seuil
 
-        self.sunshine2_log = 0
-        self.rainDur2_log = 0
 
+def sunshine_threshold_array(timestamps, latitude, longitude, coeff):
+    """The threshold formula of SolarGeometry for a whole array of time stamps (needs numpy)"""
+    ts = numpy.asarray(timestamps, dtype=numpy.int64)
+    days = (ts // 86400).astype('datetime64[D]')
+    dayofyear = (days - days.astype('datetime64[Y]')).astype(numpy.int64) + 1
+    theta = (pi / 180) * (360 * dayofyear / 365)
+    equatemps = 0.0172 + 0.4281 * numpy.cos(theta) - 7.3515 * numpy.sin(theta) \
+        - 3.3495 * numpy.cos(2 * theta) - 9.3619 * numpy.sin(2 * theta)
+    declinaison = numpy.arcsin(0.006918 - 0.399912 * numpy.cos(theta) + 0.070257 * numpy.sin(theta)
+                               - 0.006758 * numpy.cos(2 * theta) + 0.000908 * numpy.sin(2 * theta))
+    minutesjour = (ts % 86400) // 60
+    angle_horaire = ((minutesjour + longitude * 4 + equatemps) / 60 - 12) * 15
+    sin_hauteur = sin((pi / 180) * latitude) * numpy.sin(declinaison) \
+        + cos((pi / 180) * latitude) * numpy.cos(declinaison) * numpy.cos((pi / 180) * angle_horaire)
+    sin_hauteur = numpy.clip(sin_hauteur, 0.0, None)
+    return (0.73 + 0.06 * numpy.cos(theta)) * 1080 * numpy.power(sin_hauteur, 1.25) * coeff
+
+
+def recompute_sunshine(dbm, latitude, longitude, coeff, sunshine_min, start_ts=0, stop_ts=None,
+                       chunk_size=20000, progress_fn=None):
+    """Recalculate sunshineDur, sunshine_time and sunshineThreshold of the archive from radiation.
+
+    Like newArchiveRecord without loop packets: the whole interval counts as
+    sunshine if radiation is above the threshold of the record time.
+    Returns the number of updated records."""
+    import weedb
+
+    columns = [c for c in ('sunshineDur', 'sunshine_time', 'sunshineThreshold') if c in dbm.sqlkeys]
+    if 'sunshineDur' not in columns:
+        raise weewx.ViolatedPrecondition("Column sunshineDur is missing in table %s" % dbm.table_name)
+    if stop_ts is None:
+        stop_ts = dbm.lastGoodStamp() or 0
+    select = "SELECT dateTime, radiation, `interval` FROM %s WHERE dateTime > ? AND dateTime <= ? " \
+             "AND radiation IS NOT NULL ORDER BY dateTime LIMIT %d" % (dbm.table_name, chunk_size)
+    update = "UPDATE %s SET %s WHERE dateTime = ?" % (dbm.table_name, ", ".join("%s = ?" % c for c in columns))
+    solar = SolarGeometry(latitude, longitude, coeff)
+    nrecs = 0
+    last_ts = start_ts
+    while True:
+        rows = list(dbm.genSql(select, (last_ts, stop_ts)))
+        if not rows:
+            break
+        if numpy is not None:
+            data = numpy.array(rows, dtype=numpy.float64)
+            seuil = sunshine_threshold_array(data[:, 0], latitude, longitude, coeff)
+            sunny = (data[:, 1] > seuil) & (data[:, 1] > sunshine_min) & (seuil > 0)
+            duration = numpy.where(sunny, data[:, 2] * 60, 0.0)
+            values = zip(duration.tolist(), seuil.tolist())
+        else:
+            values = []
+            for row in rows:
+                seuil = solar.threshold(row[0])
+                sunny = row[1] > seuil and row[1] > sunshine_min and seuil > 0
+                values.append((row[2] * 60.0 if sunny else 0.0, seuil))
+        params = [[duration] + [seuil] * (len(columns) - 1) + [row[0]]
+                  for (duration, seuil), row in zip(values, rows)]
+        with weedb.Transaction(dbm.connection) as cursor:
+            for p in params:
+                cursor.execute(update, p)
+        nrecs += len(rows)
+        last_ts = rows[-1][0]
+        if progress_fn:
+            progress_fn(nrecs, last_ts)
+    return nrecs
+
+
+class DurationChannel(object):
+    """One duration channel: seconds per archive interval in which obs is "on".
+
+    predicate 'sunshine': obs (radiation) above the sunshine threshold and sunshine_min
+    predicate 'positive': obs (rain, hail) above 0
+
+    interpolate: estimate the part of the time between two loop packets, instead of
+    crediting the whole gap based on the latest packet (see SunshineDuration.interpolate)
+    """
+
+    __slots__ = ('name', 'obs', 'output', 'sunshine', 'threshold_fields', 'loop', 'log',
+                 'interpolate', 'rate_obs', 'recent_obs',
+                 'last_ts', 'seconds', 'last_threshold', 'first_archive', 'last_margin', 'restored_ts',
+                 'restored_seconds')
+
+    def __init__(self, name, obs, output, predicate='positive', threshold_fields=(), loop=True, log=False,
+                 interpolate=False, rate_obs=None, recent_obs=()):
+        self.name = name
+        self.obs = obs
+        self.output = output
+        self.sunshine = predicate == 'sunshine'
+        self.threshold_fields = tuple(threshold_fields)
+        self.loop = loop
+        self.log = log
+        self.interpolate = interpolate
+        self.rate_obs = rate_obs
+        self.recent_obs = tuple(recent_obs)
+        self.last_ts = 0
+        self.seconds = 0
+        self.last_threshold = 0
+        self.first_archive = True
+        self.last_margin = None
+        # last_ts of a restored checkpoint, records up to it were archived before the restart
+        self.restored_ts = 0
+        # seconds of the checkpoint, they belong to the record whose interval contains restored_ts
+        self.restored_seconds = 0
+
+
+def fraction_above(margin0, margin1):
+    """Part of a gap in which a linear margin from margin0 to margin1 is above 0"""
+    if margin0 > 0 and margin1 > 0:
+        return 1.0
+    if margin0 <= 0 and margin1 <= 0:
+        return 0.0
+    crossing = margin0 / (margin0 - margin1)
+    return crossing if margin0 > 0 else 1.0 - crossing
 
-        if 'RadiationDays' in config_dict:
-            self.sunshine_coeff = float(config_dict['RadiationDays'].get('sunshine_coeff', self.sunshine_coeff))
-            self.sunshine_log = int(config_dict['RadiationDays'].get('sunshine_log', self.sunshine_log))
-            self.sunshine_min = float(config_dict['RadiationDays'].get('sunshine_min', self.sunshine_min))
-            self.sunshine_loop = int(config_dict['RadiationDays'].get('sunshine_loop', self.sunshine_loop))
-            self.rainDur_loop = int(config_dict['RadiationDays'].get('rainDur_loop', self.rainDur_loop))
-            self.hailDur_loop = int(config_dict['RadiationDays'].get('hailDur_loop', self.hailDur_loop))
-            self.rainDur_log = int(config_dict['RadiationDays'].get('rainDur_log', self.rainDur_log))
-            self.hailDur_log = int(config_dict['RadiationDays'].get('hailDur_log', self.hailDur_log))
 
-            self.sunshine2 = int(config_dict['RadiationDays'].get('sunshine2', self.sunshine2))
-            self.rain2 = int(config_dict['RadiationDays'].get('rain2', self.rain2))
+class SunshineDuration(StdService):
+    def __init__(self, engine, config_dict):
+        # Pass the initialization information on to my superclass:
+        super(SunshineDuration, self).__init__(engine, config_dict)
 
-            self.sunshine2_loop = int(config_dict['RadiationDays'].get('sunshine2_loop', self.sunshine2_loop))
-            self.rainDur2_loop = int(config_dict['RadiationDays'].get('rainDur2_loop', self.rainDur2_loop))
-            self.sunshine2_log = int(config_dict['RadiationDays'].get('sunshine2_log', self.sunshine2_log))
-            self.rainDur2_log = int(config_dict['RadiationDays'].get('rainDur2_log', self.rainDur2_log))
+        radiation_dict = config_dict.get('RadiationDays', {})
 
+        # Default threshold value is 0.8
+        self.sunshine_coeff = float(radiation_dict.get('sunshine_coeff', 0.8))
+        # Default min value
+        self.sunshine_min = float(radiation_dict.get('sunshine_min', 0))
+
+        def option(name, default):
+            return int(radiation_dict.get(name, default))
+
+        # duration_mode = interpolate: estimate sunshine/rain time between sparse loop packets
+        # (e.g. the API driver with 300 sec polling), default is step
+        interpolate = radiation_dict.get('duration_mode', 'step') == 'interpolate'
+
+        # The standard channels, configured with the options of the former versions
+        self.channels = [
+            DurationChannel('sunshine', 'radiation', 'sunshineDur', 'sunshine', ('sunshineThreshold', 'sunshine_time'),
+                            option('sunshine_loop', 1) == 1, option('sunshine_log', 0) == 1, interpolate),
+            DurationChannel('rain', 'rain', 'rainDur', 'positive', (),
+                            option('rainDur_loop', 0) == 1, option('rainDur_log', 0) == 1, interpolate,
+                            'rainRate', (('rain15', 900), ('rain60', 3600))),
+            DurationChannel('hail', 'hail', 'hailDur', 'positive', (),
+                            option('hailDur_loop', 0) == 1, option('hailDur_log', 0) == 1, interpolate),
+        ]
+        if option('sunshine2', 0) == 1:
+            self.channels.append(
+                DurationChannel('sunshine_2', 'radiation_2', 'sunshineDur_2', 'sunshine', ('sunshineThreshold2',),
+                                option('sunshine2_loop', 1) == 1, option('sunshine2_log', 0) == 1, interpolate))
+        if option('rain2', 0) == 1:
+            self.channels.append(
+                DurationChannel('rain_2', 'rain_2', 'rainDur_2', 'positive', (),
+                                option('rainDur2_loop', 0) == 1, option('rainDur2_log', 0) == 1, interpolate,
+                                'rainRate_2', (('rain15_2', 900), ('rain60_2', 3600))))
+
+        # Additional channels, a channel with the name of a standard channel replaces it
+        #   [RadiationDays]
+        #     [[Channels]]
+        #       [[[sunshine_3]]]
+        #           obs = radiation_3
+        #           output = sunshineDur_3
+        #           predicate = sunshine          # or positive
+        #           threshold_fields = sunshineThreshold3
+        #           loop = 1
+        #           log = 0
+        #           duration_mode = interpolate
+        #           rate_obs = rainRate_3         # positive channels: rate per hour bounds the duration
+        channels_dict = radiation_dict.get('Channels', {})
+        for name in channels_dict.sections if hasattr(channels_dict, 'sections') else []:
+            c = channels_dict[name]
+            threshold_fields = c.get('threshold_fields', [])
+            if isinstance(threshold_fields, str):
+                threshold_fields = [threshold_fields]
+            channel = DurationChannel(name, c.get('obs', name), c.get('output', name + 'Dur'),
+                                      c.get('predicate', 'positive'), threshold_fields,
+                                      int(c.get('loop', 1)) == 1, int(c.get('log', 0)) == 1,
+                                      c.get('duration_mode', radiation_dict.get('duration_mode', 'step')) == 'interpolate',
+                                      c.get('rate_obs'))
+            self.channels = [ch for ch in self.channels if ch.name != name] + [channel]
+
+        self.solar = SolarGeometry(float(config_dict["Station"]["latitude"]),
+                                   float(config_dict["Station"]["longitude"]),
+                                   self.sunshine_coeff)
 
         # Start intercepting events:
         self.bind(weewx.NEW_LOOP_PACKET, self.newLoopPacket)
         self.bind(weewx.NEW_ARCHIVE_RECORD, self.newArchiveRecord)
 
-        self.lastdateTime = 0
-        self.LoopDuration = 0
-        self.sunshineSeconds = 0
-        self.lastSeuil = 0
-        self.firstArchive = True
-
-        self.lastdateTimeRain = 0
-        self.LoopDurationRain = 0
-        self.rainSeconds = 0
-        self.lastRain = 0
-        self.firstArchiveRain = True
-
-        self.lastdateTimeHail = 0
-        self.LoopDurationHail = 0
-        self.hailSeconds = 0
-        self.lastHail = 0
-        self.firstArchiveHail = True
-
-        self.lastdateTime2 = 0
-        self.LoopDuration2 = 0
-        self.sunshineSeconds2 = 0
-        self.lastSeuil2 = 0
-        self.firstArchive2 = True
-
-        self.lastdateTimeRain2 = 0
-        self.LoopDurationRain2 = 0
-        self.rainSeconds2 = 0
-        self.lastRain2 = 0
-        self.firstArchiveRain2 = True
-
         self.Archive = False
 
-
+        # Checkpoint of the channel counters, restored after a restart if not older than state_max_age
+        self.state_file = user.davisconsoleutil.state_path(
+            config_dict, radiation_dict.get('state_file', 'sunrainduration_state.json'))
+        self.state_max_age = int(radiation_dict.get('state_max_age', 900))
+        self.loadState()
+
+        loginf("Duration channels: %s" % ", ".join("%s->%s" % (ch.obs, ch.output) for ch in self.channels))
+        # Interpolation estimates the seconds between loop packets, without loop it has nothing to do
+        ignored = [ch.name for ch in self.channels if ch.interpolate and not ch.loop]
+        if ignored:
+            logerr("duration_mode = interpolate is ignored for %s (loop = 0, whole archive interval or 0)"
+                   % ", ".join(ignored))
+
+    def loadState(self):
+        """Restore the channel counters of the last checkpoint if it is fresh enough"""
+        state = user.davisconsoleutil.read_json(self.state_file)
+        if not state:
+            return
+        age = time.time() - state.get('saved', 0)
+        if age > self.state_max_age:
+            loginf("Duration state is %.0f sec old, not restored" % age)
+            return
+        restored = []
+        for channel in self.channels:
+            saved = state.get('channels', {}).get(channel.name)
+            if saved is None:
+                continue
+            if not saved['last_ts']:
+                continue
+            # The counters of the current interval. The gap from the checkpoint to the first
+            # loop packet after the restart is downtime, the next packet starts a new gap
+            channel.seconds = saved['seconds']
+            channel.last_threshold = saved['last_threshold']
+            channel.last_margin = saved.get('last_margin')
+            channel.restored_ts = saved['last_ts']
+            channel.restored_seconds = saved['seconds']
+            channel.first_archive = False
+            restored.append(channel.name)
+        loginf("Duration state restored for %s (%.0f sec old)" % (", ".join(restored), age))
+
+    def saveState(self):
+        """Write the channel counters atomically to the state file"""
+        state = {'saved': time.time(), 'channels': dict(
+            (channel.name, {'last_ts': channel.last_ts, 'seconds': channel.seconds,
+                            'last_threshold': channel.last_threshold, 'last_margin': channel.last_margin})
+            for channel in self.channels)}
+        try:
+            user.davisconsoleutil.write_json(self.state_file, state)
+        except (IOError, OSError) as e:
+            logerr("Could not save duration state %s: %s" % (self.state_file, e))
+
+    def shutDown(self):
+        self.saveState()
+
+    def isOn(self, channel, value, mydatetime):
+        """Returns True if the value of the channel counts for the duration"""
+        if channel.sunshine:
+            seuil = self.sunshineThreshold(mydatetime)
+            channel.last_threshold = seuil
+            return value > seuil and value > self.sunshine_min and seuil > 0
+        return value > 0
+
+    def interpolate(self, channel, value, dateTime, duration, packet):
+        """Estimated seconds of the gap since the last packet in which the channel was on.
+
+        Sunshine: radiation and threshold are taken as linear over the gap, the
+        part above the threshold follows from where the difference crosses 0.
+        Rain: the whole gap, shortened to amount / rate if a rain rate is known
+        and to the time before the last 15/60 minutes if rain15/rain60 are 0.
+        """
+        if channel.sunshine:
+            seuil = self.sunshineThreshold(dateTime)
+            channel.last_threshold = seuil
+            margin = value - max(seuil, self.sunshine_min) if seuil > 0 else -1.0
+            last_margin = channel.last_margin
+            channel.last_margin = margin
+            if last_margin is None:
+                return duration if margin > 0 else 0
+            return duration * fraction_above(last_margin, margin)
+        if value <= 0:
+            return 0
+        estimate = duration
+        rate = packet.get(channel.rate_obs) if channel.rate_obs else None
+        if rate:
+            estimate = min(estimate, value / rate * 3600.0)
+        for recent_obs, window in channel.recent_obs:
+            recent = packet.get(recent_obs)
+            if recent is not None and recent <= 0 and duration > window:
+                estimate = min(estimate, duration - window)
+        return estimate
 
     def newLoopPacket(self, event):
         """Gets called on a new loop packet event."""
-        radiation = event.packet.get('radiation')
-        if radiation is not None:
-            if self.lastdateTime == 0:
-                self.lastdateTime = event.packet.get('dateTime')
-            self.LoopDuration = event.packet.get('dateTime') - self.lastdateTime
-            self.lastdateTime = event.packet.get('dateTime')
-            seuil = self.sunshineThreshold(event.packet.get('dateTime'))
-            
-            if radiation > seuil and radiation > self.sunshine_min and seuil > 0:
-                self.sunshineSeconds += self.LoopDuration
-            self.lastSeuil = seuil
-            if radiation > 0 and self.sunshine_log == 1:
-               loginf("LOOP time=%.0f sec, sum sunshineSeconds=%.0f, radiation=%.2f, threshold=%.4f, %.3f" % (
-                self.LoopDuration, self.sunshineSeconds, radiation, seuil, self.sunshine_coeff))
-
-        if self.sunshine2 == 1:
-          radiation_2 = event.packet.get('radiation_2')
-          if radiation_2 is not None:
-            if self.lastdateTime2 == 0:
-                self.lastdateTime2 = event.packet.get('dateTime')
-            self.LoopDuration2 = event.packet.get('dateTime') - self.lastdateTime2
-            self.lastdateTime2 = event.packet.get('dateTime')
-            seuil = self.sunshineThreshold(event.packet.get('dateTime'))
-            
-            if radiation_2 > seuil and radiation_2 > self.sunshine_min and seuil > 0:
-                self.sunshineSeconds2 += self.LoopDuration2
-            self.lastSeuil2 = seuil
-            if radiation_2 > 0 and self.sunshine2_log == 1:
-               loginf("LOOP time=%.0f sec, sum sunshineSeconds2=%.0f, radiation_2=%.2f, threshold=%.4f, %.3f" % (
-                self.LoopDuration2, self.sunshineSeconds2, radiation_2, seuil, self.sunshine_coeff))
-
-        rain = event.packet.get('rain')
-        if rain is not None:
-            if self.lastdateTimeRain == 0:
-                self.lastdateTimeRain = event.packet.get('dateTime')
-            self.LoopDurationRain = event.packet.get('dateTime') - self.lastdateTimeRain
-            self.lastdateTimeRain = event.packet.get('dateTime')
-            
-            if rain > 0:
-                self.rainSeconds += self.LoopDurationRain
-            #self.lastRain = rainDur
-            if rain > 0 and self.rainDur_log == 1:
-               loginf("LOOP time=%.0f sec, sum rainSeconds=%.0f, rain=%.3f" % (
-                self.LoopDurationRain, self.rainSeconds, rain))
-
-        if self.rain2 == 1:
-          rain_2 = event.packet.get('rain_2')
-          if rain_2 is not None:
-            if self.lastdateTimeRain2 == 0:
-                self.lastdateTimeRain2 = event.packet.get('dateTime')
-            self.LoopDurationRain2 = event.packet.get('dateTime') - self.lastdateTimeRain2
-            self.lastdateTimeRain2 = event.packet.get('dateTime')
-            
-            if rain_2 > 0:
-                self.rainSeconds2 += self.LoopDurationRain2
-            #self.lastRain2 = rainDur_2
-            if rain_2 > 0 and self.rainDur2_log == 1:
-               loginf("LOOP time=%.0f sec, sum rainSeconds2=%.0f, rain_2=%.3f" % (
-                self.LoopDurationRain2, self.rainSeconds2, rain_2))
-
-        hail = event.packet.get('hail')
-        if hail is not None:
-            if self.lastdateTimeHail == 0:
-                self.lastdateTimeHail = event.packet.get('dateTime')
-            self.LoopDurationHail = event.packet.get('dateTime') - self.lastdateTimeHail
-            self.lastdateTimeHail = event.packet.get('dateTime')
-            
-            if hail > 0:
-                self.hailSeconds += self.LoopDurationHail
-            #self.lastHail = hailDur
-            if hail > 0 and self.hailDur_log == 1:
-               loginf("LOOP time=%.0f sec, sum hailSeconds=%.0f, hail=%.3f" % (
-                self.LoopDurationHail, self.hailSeconds, hail))
+        packet = event.packet
+        dateTime = packet.get('dateTime')
+        for channel in self.channels:
+            value = packet.get(channel.obs)
+            if value is None:
+                continue
+            if channel.last_ts == 0:
+                channel.last_ts = dateTime
+            duration = dateTime - channel.last_ts
+            channel.last_ts = dateTime
+            if channel.interpolate:
+                channel.seconds += self.interpolate(channel, value, dateTime, duration, packet)
+            elif self.isOn(channel, value, dateTime):
+                channel.seconds += duration
+            if value > 0 and channel.log:
+                loginf("LOOP time=%.0f sec, sum %s seconds=%.0f, %s=%.3f, threshold=%.4f" % (
+                    duration, channel.name, channel.seconds, channel.obs, value, channel.last_threshold))
 
     def newArchiveRecord(self, event):
         """Gets called on a new archive record event."""
-        self.secondsInterval = event.record['interval'] * 60
-        radiation = event.record.get('radiation')
-        # maxtime = self.secondsInterval
-        if self.lastdateTime == 0 or self.firstArchive:  # LOOP packets not yet captured : missing archive record extracted from datalogger at start OR first archive record after weewx start
-            event.record['sunshineDur'] = 0.0
-            event.record['sunshineThreshold'] = 0.0
-            event.record['sunshine_time'] = 0.0
-            if radiation is not None:
-                seuil = self.sunshineThreshold(event.record.get('dateTime'))
-                self.lastSeuil = seuil
-                event.record['sunshine_time'] = seuil
-                if radiation > seuil and radiation > self.sunshine_min and seuil > 0:
-                    event.record['sunshineDur'] = self.secondsInterval
-                if self.lastdateTime != 0:  # LOOP already started, this is the first regular archive after weewx start
-                    self.firstArchive = False
-                event.record['sunshineThreshold'] = self.lastSeuil
-                if radiation > 0 and self.sunshine_log == 1:
-                   loginf("Sunshine - archive record=%.0f sec, radiation=%.2f, threshold=%.4f" % (
-                      event.record['sunshineDur'], event.record['radiation'], event.record['sunshineThreshold']))
- 
-        else:
-            event.record['sunshineThreshold'] = self.lastSeuil
-            event.record['sunshine_time'] = self.lastSeuil
-            if self.sunshineSeconds > self.secondsInterval * 2:
-              event.record['sunshineDur'] = self.secondsInterval
-            else:
-              if self.sunshine_loop != 1:
-               event.record['sunshineDur'] = self.secondsInterval
-              else: 
-               event.record['sunshineDur'] = self.sunshineSeconds
-            if radiation is not None:
-             if radiation > 0 and self.sunshine_log == 1:
-               loginf("Sunshine - loop packets=%.0f sec, radiation=%.2f, threshold=%.4f" % (
-                event.record['sunshineDur'], event.record['radiation'], event.record['sunshineThreshold']))
-        self.sunshineSeconds = 0
-
-        if self.sunshine2 == 1:
-          radiation_2 = event.record.get('radiation_2')
-          if self.lastdateTime == 0 or self.firstArchive:  # LOOP packets not yet captured : missing archive record extracted from datalogger at start OR first archive record after weewx start
-            event.record['sunshineDur_2'] = 0.0
-            event.record['sunshineThreshold2'] = 0.0
-            if radiation_2 is not None:
-                seuil = self.sunshineThreshold(event.record.get('dateTime'))
-                self.lastSeuil2 = seuil
-                #event.record['sunshine_time'] = seuil
-                if radiation_2 > seuil and radiation_2 > self.sunshine_min and seuil > 0:
-                    event.record['sunshineDur_2'] = self.secondsInterval
-                if self.lastdateTime != 0:  # LOOP already started, this is the first regular archive after weewx start
-                    self.firstArchive = False
-                event.record['sunshineThreshold2'] = self.lastSeuil
-                if radiation_2 > 0 and self.sunshine2_log == 1:
-                   loginf("Sunshine2 - archive record=%.0f sec, radiation_2=%.2f, threshold=%.4f" % (
-                      event.record['sunshineDur_2'], event.record['radiation_2'], event.record['sunshineThreshold2']))
- 
-          else:
-            event.record['sunshineThreshold2'] = self.lastSeuil
-            #event.record['sunshine_time'] = self.lastSeuil
-            if self.sunshineSeconds2 > self.secondsInterval * 2:
-              event.record['sunshineDur_2'] = self.secondsInterval
-            else:
-              if self.sunshine2_loop != 1:
-               event.record['sunshineDur_2'] = self.secondsInterval
-              else: 
-               event.record['sunshineDur_2'] = self.sunshineSeconds
-            if radiation_2 is not None:
-             if radiation_2 > 0 and self.sunshine2_log == 1:
-               loginf("Sunshine2 - loop packets=%.0f sec, radiation_2=%.2f, threshold=%.4f" % (
-                event.record['sunshineDur_2'], event.record['radiation_2'], event.record['sunshineThreshold2']))
-          self.sunshineSeconds2 = 0
-
-
-        rain = event.record.get('rain')
-        # maxtime = self.secondsInterval
+        record = event.record
+        self.secondsInterval = record['interval'] * 60
         if self.Archive == False:
-          loginf("Archiv-Record-Interval=%.0f sec" % (self.secondsInterval))		# 5 minutes default
-          self.Archive = True
-        if self.lastdateTimeRain == 0 or self.firstArchiveRain:  # LOOP packets not yet captured : missing archive record extracted from datalogger at start OR first archive record after weewx start
-            event.record['rainDur'] = 0.0
-            if rain is not None:
-                self.lastRain = rain 
-                if rain > 0:
-                    event.record['rainDur'] = self.secondsInterval
-                if self.lastdateTimeRain != 0:  # LOOP already started, this is the first regular archive after weewx start
-                    self.firstArchiveRain = False
-                if rain > 0 and self.rainDur_log == 1:
-                   loginf("RainDur - archive record=%.0f sec, rain=%.3f" % (
-                      event.record['rainDur'], event.record['rain']))
- 
-        else:
-            #event.record['rainDurThreshold'] = self.lastRain
-            if self.rainSeconds > self.secondsInterval * 2:
-              event.record['rainDur'] = self.secondsInterval
-            else:
-              if self.rainDur_loop == 1:
-                 event.record['rainDur'] = self.rainSeconds
-              else: 
-                if self.rainSeconds > 0:
-                   event.record['rainDur'] = self.secondsInterval
-                else: 
-                   event.record['rainDur'] = 0
-            if rain is not None:
-             if rain > 0 and self.rainDur_log == 1:
-               loginf("RainDur - loop packets=%.0f sec, rain=%.3f" % (
-                event.record['rainDur'], event.record['rain']))
-        self.rainSeconds = 0
-
-        if self.rain2 == 1:
-          rain_2 = event.record.get('rain_2')
-          if self.Archive == False:
             loginf("Archiv-Record-Interval=%.0f sec" % (self.secondsInterval))		# 5 minutes default
             self.Archive = True
-          if self.lastdateTimeRain2 == 0 or self.firstArchiveRain2:  # LOOP packets not yet captured : missing archive record extracted from datalogger at start OR first archive record after weewx start
-            event.record['rainDur_2'] = 0.0
-            if rain_2 is not None:
-                self.lastRain2 = rain_2 
-                if rain_2 > 0:
-                    event.record['rainDur_2'] = self.secondsInterval
-                if self.lastdateTimeRain2 != 0:  # LOOP already started, this is the first regular archive after weewx start
-                    self.firstArchiveRain2 = False
-                if rain_2 > 0 and self.rainDur2_log == 1:
-                   loginf("RainDur_2 - archive record=%.0f sec, rain_2=%.3f" % (
-                      event.record['rainDur_2'], event.record['rain_2']))
- 
-          else:
-            if self.rainSeconds2 > self.secondsInterval * 2:
-              event.record['rainDur_2'] = self.secondsInterval
-            else:
-              if self.rainDur2_loop == 1:
-                 event.record['rainDur_2'] = self.rainSeconds2
-              else: 
-                if self.rainSeconds2 > 0:
-                   event.record['rainDur_2'] = self.secondsInterval
-                else: 
-                   event.record['rainDur_2'] = 0
-            if rain_2 is not None:
-             if rain_2 > 0 and self.rainDur2_log == 1:
-               loginf("RainDur_2 - loop packets=%.0f sec, rain_2=%.3f" % (
-                event.record['rainDur_2'], event.record['rain_2']))
-          self.rainSeconds2 = 0
-
-        hail = event.record.get('hail')
-        # maxtime = self.secondsInterval
-        if self.lastdateTimeHail == 0 or self.firstArchiveHail:  # LOOP packets not yet captured : missing archive record extracted from datalogger at start OR first archive record after weewx start
-            event.record['hailDur'] = 0.0
-            if hail is not None:
-                self.lastHail = hail
-                if hail > 0:
-                    event.record['hailDur'] = self.secondsInterval
-                if self.lastdateTimeHail != 0:  # LOOP already started, this is the first regular archive after weewx start
-                    self.firstArchiveHail = False
-                if hail > 0 and self.hailDur_log == 1:
-                   loginf("HailDur - archive record=%.0f sec, hail=%.3f" % (
-                      event.record['hailDur'], event.record['hail']))
- 
-        else:
-            #event.record['hailDurThreshold'] = self.lastHail
-            if self.hailSeconds > self.secondsInterval * 2:
-              event.record['hailDur'] = self.secondsInterval
+
+        for channel in self.channels:
+            value = record.get(channel.obs)
+            # Archived before the restored checkpoint, its time is not in the counters
+            older = record['dateTime'] <= channel.restored_ts
+            if channel.restored_ts and not older:
+                if record['dateTime'] - self.secondsInterval >= channel.restored_ts:
+                    # The interval of the checkpoint was archived while weewx was down
+                    channel.seconds -= channel.restored_seconds
+                channel.restored_ts = 0
+                channel.restored_seconds = 0
+            if channel.last_ts == 0 or channel.first_archive or older:
+                # LOOP packets not yet captured : missing archive record extracted from datalogger at start
+                # OR first archive record after weewx start
+                record[channel.output] = 0.0
+                for field in channel.threshold_fields:
+                    record[field] = 0.0
+                if value is not None:
+                    if self.isOn(channel, value, record['dateTime']):
+                        record[channel.output] = self.secondsInterval
+                    if channel.last_ts != 0 and not older:  # LOOP already started, this is the first regular archive after weewx start
+                        channel.first_archive = False
+                    for field in channel.threshold_fields:
+                        record[field] = channel.last_threshold
+                source = "archive record"
             else:
-              if self.hailDur_loop == 1:
-                 event.record['hailDur'] = self.hailSeconds
-              else: 
-                if self.hailSeconds > 0:
-                   event.record['hailDur'] = self.secondsInterval
-                else: 
-                   event.record['hailDur'] = 0
-            if hail is not None:
-             if hail > 0 and self.hailDur_log == 1:
-               loginf("HailDur - loop packets=%.0f sec, hail=%.3f" % (
-                event.record['hailDur'], event.record['hail']))
-        self.hailSeconds = 0
+                for field in channel.threshold_fields:
+                    record[field] = channel.last_threshold
+                if channel.seconds > self.secondsInterval * 2:
+                    record[channel.output] = self.secondsInterval
+                elif channel.loop:
+                    record[channel.output] = channel.seconds
+                elif channel.sunshine:
+                    # archive mode: the radiation of the archive record decides
+                    on = value is not None and self.isOn(channel, value, record['dateTime'])
+                    record[channel.output] = self.secondsInterval if on else 0
+                else:
+                    record[channel.output] = self.secondsInterval if channel.seconds > 0 else 0
+                source = "loop packets"
+            if value is not None and value > 0 and channel.log:
+                loginf("%s - %s=%.0f sec, %s=%.3f, threshold=%.4f" % (
+                    channel.name, source, record[channel.output], channel.obs, value, channel.last_threshold))
+            if not older:
+                channel.seconds = 0
+        self.saveState()
 
     def sunshineThreshold(self, mydatetime):
-        #coeff = 0.9  # change to calibrate with your sensor
-        utcdate = datetime.utcfromtimestamp(mydatetime)
-        dayofyear = int(time.strftime("%j", time.gmtime(mydatetime)))
-        theta = 360 * dayofyear / 365
-        equatemps = 0.0172 + 0.4281 * cos((pi / 180) * theta) - 7.3515 * sin(
-            (pi / 180) * theta) - 3.3495 * cos(2 * (pi / 180) * theta) - 9.3619 * sin(
-            2 * (pi / 180) * theta)
-
-        latitude = float(self.config_dict["Station"]["latitude"])
-        longitude = float(self.config_dict["Station"]["longitude"])
-        corrtemps = longitude * 4
-        declinaison = asin(0.006918 - 0.399912 * cos((pi / 180) * theta) + 0.070257 * sin(
-            (pi / 180) * theta) - 0.006758 * cos(2 * (pi / 180) * theta) + 0.000908 * sin(
-            2 * (pi / 180) * theta)) * (180 / pi)
-        minutesjour = utcdate.hour * 60 + utcdate.minute
-        tempsolaire = (minutesjour + corrtemps + equatemps) / 60
-        angle_horaire = (tempsolaire - 12) * 15
-        hauteur_soleil = asin(sin((pi / 180) * latitude) * sin((pi / 180) * declinaison) + cos(
-            (pi / 180) * latitude) * cos((pi / 180) * declinaison) * cos((pi / 180) * angle_horaire)) * (180 / pi)
-        if hauteur_soleil > 0:
-            seuil = (0.73 + 0.06 * cos((pi / 180) * 360 * dayofyear / 365)) * 1080 * pow(
-                (sin(pi / 180 * hauteur_soleil)), 1.25) * self.sunshine_coeff
-        else :
-            seuil=0
-        return seuil
+        return self.solar.threshold(mydatetime)
+
+
+# Recalculate the sunshine duration of the archive, e.g. after importing data or
+# after changing sunshine_coeff or sunshine_min:
+#   PYTHONPATH=/usr/share/weewx python3 /usr/share/weewx/user/sunrainduration.py --config=/etc/weewx/weewx.conf --recompute
+# Afterwards rebuild the daily summaries: weectl database rebuild-daily
+#
+if __name__ == "__main__":
+    import optparse
+
+    import weecfg
+    import weewx.manager
+
+    usage = """Usage: %prog --config=CONFIG_FILE --recompute [--binding=BINDING] [--start=YYYY-mm-dd] [--end=YYYY-mm-dd]"""
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--config', dest='config_path', metavar='CONFIG_FILE',
+                      help='Use configuration file CONFIG_FILE')
+    parser.add_option('--binding', dest='binding', default='wx_binding',
+                      help='Data binding (default wx_binding)')
+    parser.add_option('--recompute', dest='recompute', action='store_true',
+                      help='Recalculate sunshineDur, sunshine_time and sunshineThreshold from radiation')
+    parser.add_option('--start', dest='start', help='First day (YYYY-mm-dd), default first record')
+    parser.add_option('--end', dest='end', help='Last day (YYYY-mm-dd), default last record')
+    parser.add_option('--chunk', dest='chunk', type='int', default=20000,
+                      help='Records read and updated at once (default 20000)')
+    (options, args) = parser.parse_args()
+
+    if not options.recompute:
+        parser.print_help()
+        exit(0)
+
+    config_path, config_dict = weecfg.read_config(options.config_path, args)
+    weeutil.logger.setup('sunrainduration', config_dict)
+    radiation_dict = config_dict.get('RadiationDays', {})
+    start_ts = int(time.mktime(time.strptime(options.start, "%Y-%m-%d"))) if options.start else 0
+    stop_ts = int(time.mktime(time.strptime(options.end, "%Y-%m-%d"))) + 86400 if options.end else None
+
+    def progress(nrecs, ts):
+        print("%d records, %s" % (nrecs, time.strftime("%Y-%m-%d", time.localtime(ts))), end='\r')
+
+    with weewx.manager.open_manager_with_config(config_dict, options.binding) as dbm:
+        t1 = time.time()
+        n = recompute_sunshine(dbm,
+                               float(config_dict['Station']['latitude']),
+                               float(config_dict['Station']['longitude']),
+                               float(radiation_dict.get('sunshine_coeff', 0.8)),
+                               float(radiation_dict.get('sunshine_min', 0)),
+                               start_ts, stop_ts, options.chunk, progress)
+        print("\nRecalculated %d records in %.1f seconds%s" % (
+            n, time.time() - t1, "" if numpy is not None else " (without numpy)"))
+        print("Rebuild the daily summaries now: weectl database rebuild-daily")
@@ -163,3 +163,34 @@ function load_file(div_id, var_name) {
     }
 }
 
+
+/* Load the JSON file of user.livejson.LiveJson every interval seconds and
+ * replace the text of all elements with a data-obs attribute. The attribute
+ * data-field selects 'hi', 'lo', 'hi_time' ... instead of the current value.
+ */
+function live_update(url, interval) {
+    const update = function () {
+        let xhr = new XMLHttpRequest();
+        xhr.onload = function () {
+            if (this.status !== 200) return;
+            let data;
+            try {
+                data = JSON.parse(this.responseText);
+            } catch (e) {
+                return;
+            }
+            const elements = document.querySelectorAll('[data-obs]');
+            for (let i = 0; i < elements.length; i++) {
+                const values = data.obs[elements[i].getAttribute('data-obs')];
+                const field = elements[i].getAttribute('data-field') || 'formatted';
+                if (values && values[field] !== undefined && values[field] !== null) {
+                    elements[i].textContent = values[field];
+                }
+            }
+        };
+        xhr.open('GET', url + '?' + Date.now());
+        xhr.send();
+    };
+    update();
+    setInterval(update, interval * 1000);
+}
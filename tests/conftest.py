@@ -0,0 +1,31 @@
+"""Test setup: the modules in bin/user are imported as user.<module>, like weewx does.
+
+The tests need weewx (4.10 or 5) on the path, e.g.
+    PYTHONPATH=/usr/share/weewx python3 -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+
+
+@pytest.fixture
+def config_dict(tmp_path):
+    """weewx.conf with the state files (SQLITE_ROOT) and the HTML_ROOT in tmp_path"""
+    configobj = pytest.importorskip('configobj')
+    config = configobj.ConfigObj(interpolation=False)
+    config.update({
+        'WEEWX_ROOT': str(tmp_path),
+        'StdReport': {'SKIN_ROOT': 'skins', 'HTML_ROOT': 'html'},
+        'DataBindings': {'wx_binding': {'database': 'archive_sqlite',
+                                        'manager': 'weewx.manager.DaySummaryManager',
+                                        'table_name': 'archive',
+                                        'schema': 'schemas.wview_extended.schema'}},
+        'Databases': {'archive_sqlite': {'database_name': 'weewx.sdb', 'database_type': 'SQLite'}},
+        'DatabaseTypes': {'SQLite': {'driver': 'weedb.sqlite', 'SQLITE_ROOT': str(tmp_path / 'archive')}},
+    })
+    (tmp_path / 'archive').mkdir()
+    return config
@@ -0,0 +1,112 @@
+"""Tests of user.changetracking: hashes of the pages and plots"""
+
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import configobj
+
+import user.changetracking
+
+GEN_TS = 1718000000 - 1718000000 % 3600
+
+
+class Manager(object):
+    def __init__(self, record):
+        self.record = record
+
+    def getRecord(self, ts):
+        return dict(self.record, dateTime=ts)
+
+    def lastGoodStamp(self):
+        return GEN_TS
+
+
+class Binder(object):
+    def __init__(self, record):
+        self.manager = Manager(record)
+
+    def get_manager(self, binding):
+        return self.manager
+
+
+def make_generator(cls, config_dict, record, gen_ts=GEN_TS):
+    generator = cls.__new__(cls)
+    skin_dict = configobj.ConfigObj(interpolation=False)
+    skin_dict.update({
+        'REPORT_NAME': 'healthc',
+        'HTML_ROOT': 'html',
+        'ChangeTracking': {'max_age': '3600'},
+        'ImageGenerator': {
+            'day_images': {'aggregate_type': 'none', 'dayrx': {'rxCheckPercent': {}}},
+            'week_images': {'aggregate_type': 'avg', 'aggregate_interval': '3600',
+                            'weekvolt': {'supercap': {'data_type': 'supercapVolt'}}},
+        }})
+    generator.config_dict = config_dict
+    generator.skin_dict = skin_dict
+    generator.gen_ts = gen_ts
+    generator.db_binder = Binder(record)
+    return generator
+
+
+def run_skip(config_dict, record, gen_ts, plot):
+    """One run of the skip check of the ImageGenerator for plot, True if skipped"""
+    generator = make_generator(user.changetracking.ChangeTrackingImageGenerator, config_dict, record, gen_ts)
+    generator.tracker = user.changetracking.ChangeTracker(generator)
+    generator.plot_state = generator.tracker.load('plots')
+    generator.plot_inputs = generator._plot_inputs()
+    generator.skipped = 0
+    generator.tracking_thread = threading.current_thread().ident
+    img_file = os.path.join(config_dict['WEEWX_ROOT'], 'html', '%s.png' % plot)
+    if not os.path.exists(img_file):
+        os.makedirs(os.path.dirname(img_file), exist_ok=True)
+        open(img_file, 'w').close()
+    skipped = generator._skip_function(lambda *args: False)(gen_ts, {}, img_file)
+    generator.tracker.save('plots', generator.plot_state)
+    return skipped
+
+
+RECORD = {'interval': 5, 'rxCheckPercent': 100.0, 'supercapVolt': 3.1, 'appUptimeC': 1000}
+
+
+def test_time_series_plot_follows_the_report_time(config_dict):
+    assert not run_skip(config_dict, RECORD, GEN_TS, 'dayrx')
+    # Same values, same report time
+    assert run_skip(config_dict, RECORD, GEN_TS, 'dayrx')
+    # Same values, next archive interval: the time axis moved
+    assert not run_skip(config_dict, RECORD, GEN_TS + 300, 'dayrx')
+
+
+def test_aggregated_plot_skipped_within_aggregation_interval(config_dict):
+    assert not run_skip(config_dict, RECORD, GEN_TS, 'weekvolt')
+    assert run_skip(config_dict, RECORD, GEN_TS + 300, 'weekvolt')
+    assert not run_skip(config_dict, dict(RECORD, supercapVolt=3.0), GEN_TS + 600, 'weekvolt')
+    assert not run_skip(config_dict, dict(RECORD, supercapVolt=3.0), GEN_TS + 3600, 'weekvolt')
+
+
+def test_page_ignores_uptimes(config_dict):
+    tracker = user.changetracking.ChangeTracker(
+        make_generator(user.changetracking.ChangeTrackingCheetahGenerator, config_dict, RECORD))
+    changed = user.changetracking.ChangeTracker(
+        make_generator(user.changetracking.ChangeTrackingCheetahGenerator, config_dict,
+                       dict(RECORD, appUptimeC=1300)))
+    assert tracker.fingerprint('wx_binding') == changed.fingerprint('wx_binding')
+
+
+def test_derived_types_are_not_tracked(config_dict):
+    tracker = user.changetracking.ChangeTracker(
+        make_generator(user.changetracking.ChangeTrackingCheetahGenerator, config_dict, RECORD))
+    assert tracker.fingerprint('wx_binding', ['windvec']) is None
+
+
+def test_pages_generated_on_a_new_day(config_dict, monkeypatch):
+    runs = []
+    monkeypatch.setattr(user.changetracking.weewx.cheetahgenerator.CheetahGenerator, 'run',
+                        lambda self: runs.append(self.gen_ts))
+    for gen_ts in (GEN_TS, GEN_TS + 300, GEN_TS + 86400):
+        make_generator(user.changetracking.ChangeTrackingCheetahGenerator, config_dict, RECORD, gen_ts).run()
+    # Same values: skipped within the day, generated again the next day
+    assert runs == [GEN_TS, GEN_TS + 86400]
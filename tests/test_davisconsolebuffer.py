@@ -0,0 +1,92 @@
+"""Tests of user.davisconsolebuffer: the journal and the work after a flush"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import weewx
+import weewx.manager
+
+import user.davisconsolebuffer
+import user.davisconsolerollup
+
+START = 1704067200
+
+
+def record(ts):
+    return {'dateTime': ts, 'usUnits': weewx.US, 'interval': 5, 'outTemp': 40.0 + (ts // 300) % 10}
+
+
+def journal(buffer):
+    with open(buffer.path) as f:
+        return f.readlines()
+
+
+@pytest.fixture
+def dbm(config_dict):
+    manager = weewx.manager.open_manager_with_config(config_dict, 'wx_binding', initialize=True)
+    yield manager
+    manager.close()
+
+
+def test_records_written_then_rollups_folded(config_dict, dbm):
+    folded = []
+
+    def on_flushed(flush_dbm):
+        store = user.davisconsolerollup.RollupStore(flush_dbm)
+        store.add_records(list(flush_dbm.genBatchRecords(START, START + 900)))
+        # All records appended so far are in the database and folded in
+        folded.append((flush_dbm.getSql("SELECT COUNT(*) FROM archive")[0],
+                       store.get_series('outTemp', START, START + 3600, 'hour')[0][5]))
+
+    buffer = user.davisconsolebuffer.ArchiveBuffer(config_dict, 'wx_binding', 'buffer.jsonl', on_flushed=on_flushed)
+    for i in range(1, 4):
+        buffer.append(record(START + 300 * i))
+    buffer.shutDown()
+
+    assert journal(buffer) == []
+    assert folded[-1] == (3, 3)
+    assert all(stored == rolled_up for stored, rolled_up in folded)
+
+
+def test_records_kept_while_database_fails(config_dict, dbm, monkeypatch):
+    flushed = []
+
+    def fail(*args, **kwargs):
+        raise weewx.UnknownBinding("database not reachable")
+    monkeypatch.setattr(weewx.manager, 'open_manager_with_config', fail)
+    buffer = user.davisconsolebuffer.ArchiveBuffer(config_dict, 'wx_binding', 'buffer.jsonl',
+                                                   on_flushed=flushed.append)
+    buffer.append(record(START + 300))
+    buffer.shutDown()
+
+    assert len(journal(buffer)) == 1
+    assert flushed == []
+    assert dbm.getSql("SELECT COUNT(*) FROM archive")[0] == 0
+    assert os.path.dirname(buffer.path) == config_dict['DatabaseTypes']['SQLite']['SQLITE_ROOT']
+
+
+def test_refused_record_rejected_after_attempts(config_dict, dbm):
+    dbm.addRecord(record(START))
+    buffer = user.davisconsolebuffer.ArchiveBuffer(config_dict, 'wx_binding', 'buffer.jsonl', max_attempts=3)
+    # Metric record in a US database, addRecord raises on it
+    bad = dict(record(START + 300), usUnits=weewx.METRIC)
+    buffer.append(bad)
+    buffer.append(record(START + 600))
+    buffer.shutDown()
+
+    # The record behind the refused one is written
+    assert dbm.getSql("SELECT dateTime FROM archive WHERE dateTime = ?", (START + 600,)) is not None
+    for attempt in range(3):
+        if not journal(buffer):
+            break
+        assert buffer.flush()
+    buffer._close()
+
+    assert journal(buffer) == []
+    with open(buffer.path + '.rejected') as f:
+        assert [json.loads(line) for line in f] == [bad]
+    assert dbm.getSql("SELECT COUNT(*) FROM archive")[0] == 2
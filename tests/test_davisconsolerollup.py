@@ -0,0 +1,139 @@
+"""Tests of user.davisconsolerollup: the rollups, the xtype which reads them and folding a record once"""
+
+import time
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import weewx
+import weewx.manager
+import weewx.xtypes
+from weeutil.weeutil import TimeSpan
+
+import user.davisconsolerollup
+
+START = int(time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1)))
+DAYS = 10
+
+
+def record(ts):
+    return {'dateTime': ts, 'usUnits': weewx.US, 'interval': 5,
+            'outTemp': None if ts % 7 == 0 else 30.0 + (ts // 300) % 37,
+            'rain': 0.01 if (ts // 300) % 13 == 0 else 0.0,
+            'windSpeed': (ts // 300) % 11, 'windDir': (ts // 300) % 360}
+
+
+def make_config(path):
+    return {
+        'WEEWX_ROOT': str(path),
+        'DataBindings': {'wx_binding': {'database': 'archive_sqlite',
+                                        'manager': 'weewx.manager.DaySummaryManager',
+                                        'table_name': 'archive',
+                                        'schema': 'schemas.wview_extended.schema'}},
+        'Databases': {'archive_sqlite': {'database_name': 'weewx.sdb', 'database_type': 'SQLite'}},
+        'DatabaseTypes': {'SQLite': {'driver': 'weedb.sqlite', 'SQLITE_ROOT': str(path)}}}
+
+
+def make_manager(path, days, skip=0):
+    config = make_config(path)
+    manager = weewx.manager.open_manager_with_config(config, 'wx_binding', initialize=True)
+    records = [record(START + 300 * i) for i in range(1, 12 * 24 * days + 1)]
+    manager.addRecord(records)
+    store = user.davisconsolerollup.RollupStore(manager)
+    # The first day folded in as the service does, one record at a time; the first skip records
+    # were archived before the rollups were set up
+    for r in records[skip:skip + 288]:
+        store.add_record(r)
+    store.add_records(records[skip + 288:])
+    manager.close()
+    # Opened again, like the report thread does, so last_timestamp is set
+    return weewx.manager.open_manager_with_config(config, 'wx_binding')
+
+
+@pytest.fixture(scope='module')
+def dbm(tmp_path_factory):
+    manager = make_manager(tmp_path_factory.mktemp('rollup'), DAYS)
+    yield manager
+    manager.close()
+
+
+def archive_series(dbm, obs_type, span, aggregate_type, aggregate_interval):
+    return weewx.xtypes.ArchiveTable.get_series(obs_type, span, dbm, aggregate_type, aggregate_interval)
+
+
+@pytest.mark.parametrize('obs_type, aggregate_type, aggregate_interval', [
+    ('outTemp', 'avg', 3600), ('outTemp', 'max', 3 * 3600), ('outTemp', 'min', 86400),
+    ('rain', 'sum', 86400), ('rain', 'sum', 3600), ('windSpeed', 'count', 6 * 3600)])
+def test_series_same_as_archive(dbm, obs_type, aggregate_type, aggregate_interval):
+    store = user.davisconsolerollup.RollupStore(dbm)
+    xtype = user.davisconsolerollup.RollupSeries(store)
+    span = TimeSpan(START, START + (DAYS + 1) * 86400)
+
+    expected = archive_series(dbm, obs_type, span, aggregate_type, aggregate_interval)
+    result = xtype.get_series(obs_type, span, dbm, aggregate_type, aggregate_interval)
+    assert result[0] == expected[0]
+    assert result[1] == expected[1]
+    assert result[2].unit == expected[2].unit
+    assert result[2].value == pytest.approx(expected[2].value)
+
+
+def test_not_covered_left_to_other_xtypes(dbm):
+    store = user.davisconsolerollup.RollupStore(dbm)
+    xtype = user.davisconsolerollup.RollupSeries(store)
+    span = TimeSpan(START, START + 86400)
+    # Not on hour boundaries
+    with pytest.raises(weewx.UnknownAggregation):
+        xtype.get_series('outTemp', span, dbm, 'avg', 1800)
+    # Directions and types not in the archive
+    for obs_type in ('windDir', 'windvec'):
+        with pytest.raises(weewx.UnknownType):
+            xtype.get_series(obs_type, span, dbm, 'avg', 3600)
+    # Time series
+    with pytest.raises(weewx.UnknownAggregation):
+        xtype.get_series('outTemp', span, dbm)
+
+
+def test_records_before_rollups(tmp_path):
+    manager = make_manager(tmp_path, 3, skip=288)
+    xtype = user.davisconsolerollup.RollupSeries(user.davisconsolerollup.RollupStore(manager))
+    with pytest.raises(weewx.UnknownAggregation):
+        xtype.get_series('outTemp', TimeSpan(START, START + 3 * 86400), manager, 'avg', 3600)
+    series = xtype.get_series('outTemp', TimeSpan(START + 86400, START + 3 * 86400), manager, 'avg', 3600)
+    assert len(series[0].value) == 48
+    manager.close()
+
+
+def test_record_folded_in_once(dbm):
+    store = user.davisconsolerollup.RollupStore(dbm)
+    before = store.get_series('windSpeed', START, START + DAYS * 86400)
+    # Added again, e.g. by a catch up after a restart
+    store.add_record(record(START + 300))
+    store.add_records([record(START + 300 * i) for i in range(1, 100)])
+    assert store.get_series('windSpeed', START, START + DAYS * 86400) == before
+    assert store.catch_up() == 0
+
+
+def test_catch_up(tmp_path):
+    manager = make_manager(tmp_path, 1)
+    store = user.davisconsolerollup.RollupStore(manager)
+    last = manager.lastGoodStamp()
+    # Archived while the service was not running
+    manager.addRecord([record(last + 300 * i) for i in range(1, 13)])
+    assert store.catch_up() == 12
+    assert store.get_meta('rollup_hour.last_ts') == last + 3600
+    row = store.get_series('windSpeed', start_of_hour(last + 300), last + 3600, 'hour')[0]
+    assert row[5] == 12
+    manager.close()
+
+
+def test_rebuild_keeps_later_records_once(dbm):
+    store = user.davisconsolerollup.RollupStore(dbm)
+    before = store.get_series('outTemp', START, START + DAYS * 86400, 'hour')
+    assert store.rebuild(START + 2 * 86400, START + 4 * 86400) > 0
+    assert store.get_series('outTemp', START, START + DAYS * 86400, 'hour') == before
+    assert store.get_meta('rollup_hour.last_ts') == dbm.lastGoodStamp()
+
+
+def start_of_hour(ts):
+    return user.davisconsolerollup.start_of_hour(ts)
@@ -0,0 +1,179 @@
+"""Tests of user.historygenerator3: the cell cache, the planner reads and the stored tables"""
+
+import time
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import configobj
+import weewx
+import weewx.defaults
+import weewx.manager
+import weewx.units
+
+import user.davisconsoleutil
+import user.historygenerator3
+
+START = int(time.mktime((2022, 10, 1, 0, 0, 0, 0, 0, -1)))
+STOP = int(time.mktime((2024, 3, 15, 0, 0, 0, 0, 0, -1)))
+
+HISTORY = """
+[HistoryReport]
+    refresh_interval = 60
+    incremental = 1
+    query_planner = 1
+    minvalues = -50, 10
+    maxvalues = 10, 60
+    colors = "#0029E5", "#FF0F2D"
+    [[max_temp]]
+        obs_type = outTemp
+        aggregate_type = max
+        summary_column = true
+        summary_heading = Max
+    [[rain]]
+        obs_type = rain
+        aggregate_type = sum
+"""
+
+
+def make_config(path):
+    return {
+        'WEEWX_ROOT': str(path),
+        'DataBindings': {'wx_binding': {'database': 'archive_sqlite',
+                                        'manager': 'weewx.manager.DaySummaryManager',
+                                        'table_name': 'archive',
+                                        'schema': 'schemas.wview_extended.schema'}},
+        'Databases': {'archive_sqlite': {'database_name': 'weewx.sdb', 'database_type': 'SQLite'}},
+        'DatabaseTypes': {'SQLite': {'driver': 'weedb.sqlite', 'SQLITE_ROOT': str(path)}}}
+
+
+def make_manager(path):
+    config = make_config(path)
+    manager = weewx.manager.open_manager_with_config(config, 'wx_binding', initialize=True)
+    # One record every 6 hours, the extraTemp1 sensor stopped in 2023
+    manager.addRecord(record(ts) for ts in range(START + 21600, STOP + 1, 21600))
+    manager.close()
+    return weewx.manager.open_manager_with_config(config, 'wx_binding')
+
+
+def record(ts):
+    return {'dateTime': ts, 'usUnits': weewx.US, 'interval': 360,
+            'outTemp': 20.0 + (ts // 21600) % 50, 'rain': 0.1 if (ts // 21600) % 5 == 0 else 0.0,
+            'extraTemp1': 50.0 + (ts // 21600) % 7 if ts < STOP - 200 * 86400 else None}
+
+
+@pytest.fixture(scope='module')
+def dbm(tmp_path_factory):
+    manager = make_manager(tmp_path_factory.mktemp('history'))
+    yield manager
+    manager.close()
+
+
+def make_search(config_dict, extra='', **options):
+    skin_dict = configobj.ConfigObj((HISTORY + extra).splitlines(), interpolation=False)
+    skin_dict['HistoryReport'].update(options)
+    generator = type('Generator', (), {})()
+    generator.skin_dict = skin_dict
+    generator.config_dict = config_dict
+    generator.formatter = weewx.units.Formatter.fromSkinDict(weewx.defaults.defaults)
+    generator.converter = weewx.units.Converter.fromSkinDict(weewx.defaults.defaults)
+    return user.historygenerator3.MyXSearch(generator)
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """The since argument of every read of the daily summaries"""
+    calls = []
+    original = user.historygenerator3.DaySummaryPlanner._read_rows
+
+    def read_rows(dbm, obs_type, since=None):
+        calls.append((obs_type, since))
+        return original(dbm, obs_type, since)
+    monkeypatch.setattr(user.historygenerator3.DaySummaryPlanner, '_read_rows', staticmethod(read_rows))
+    return calls
+
+
+def tables(search, dbm):
+    # Refresh interval expired
+    search.cache_time = 0
+    result = search.get_extension_list(None, lambda data_binding=None: dbm)[0]
+    return result['max_temp_table'], result['rain_table']
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    """The names of the tables generated"""
+    names = []
+    original = user.historygenerator3.MyXSearch._statsHTMLTable
+
+    def stats_table(self, table_options, table_stats, table_name, binding, NOAA=False):
+        names.append(table_name)
+        return original(self, table_options, table_stats, table_name, binding, NOAA)
+    monkeypatch.setattr(user.historygenerator3.MyXSearch, '_statsHTMLTable', stats_table)
+    return names
+
+
+def test_cached_past_cells_read_current_year_only(config_dict, dbm, reads):
+    first = tables(make_search(config_dict), dbm)
+    assert sorted(reads) == [('outTemp', None), ('rain', None)]
+
+    # Next run, also after a restart: the past cells come from the cache file
+    del reads[:]
+    year_start = int(time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1)))
+    assert tables(make_search(config_dict), dbm) == first
+    assert sorted(reads) == [('outTemp', year_start), ('rain', year_start)]
+
+
+def test_prefetch_reads_current_year_only(config_dict, dbm, reads):
+    first = tables(make_search(config_dict, workers=2), dbm)
+    del reads[:]
+    year_start = int(time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1)))
+    assert tables(make_search(config_dict, workers=2), dbm) == first
+    assert sorted(reads) == [('outTemp', year_start), ('rain', year_start)]
+
+
+def test_cells_calculated_again_after_max_age(config_dict, dbm, reads):
+    search = make_search(config_dict, cache_max_age=3600)
+    first = tables(search, dbm)
+    for entry in search.cell_cache.values():
+        entry['created'] -= 3600
+    del reads[:]
+    assert tables(search, dbm) == first
+    assert sorted(reads) == [('outTemp', None), ('rain', None)]
+
+
+def test_old_cache_file_ignored(config_dict, dbm):
+    search = make_search(config_dict)
+    user.davisconsoleutil.write_json(search.cell_cache_path, {'max_temp_table|0': {'m1': 1.0}})
+    assert make_search(config_dict).cell_cache == {}
+
+
+
+def test_stored_table_kept_while_its_data_is_the_same(config_dict, tmp_path, generated):
+    extra = """
+    [[extra_temp]]
+        obs_type = extraTemp1
+        aggregate_type = max
+"""
+    path = tmp_path / 'db'
+    path.mkdir()
+    dbm = make_manager(path)
+    search = make_search(config_dict, extra, persistent=1)
+    tables(search, dbm)
+    assert sorted(generated) == ['extra_temp_table', 'max_temp_table', 'rain_table']
+
+    # A new record, then weewx restarted after refresh_interval
+    dbm.addRecord(record(STOP + 21600))
+    dbm.close()
+    dbm = weewx.manager.open_manager_with_config(make_config(path), 'wx_binding')
+    stored = user.davisconsoleutil.read_json(search.html_cache_path)
+    stored['cache_time'] = 0
+    user.davisconsoleutil.write_json(search.html_cache_path, stored)
+    del generated[:]
+    search = make_search(config_dict, extra, persistent=1)
+    tables(search, dbm)
+    # The extraTemp1 sensor has no new value
+    assert sorted(generated) == ['max_temp_table', 'rain_table']
+    assert search.search_list_extension['extra_temp_table'] == stored['tables']['extra_temp_table']['html']
+    dbm.close()
@@ -0,0 +1,107 @@
+"""Tests of user.noaagenerator: removal of changed summaries and the manifest"""
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import configobj
+import weewx.cheetahgenerator
+import weeutil.weeutil
+
+import user.davisconsoleutil
+import user.noaagenerator
+
+
+def make_generator(config_dict, gen_ts):
+    generator = user.noaagenerator.IncrementalCheetahGenerator.__new__(
+        user.noaagenerator.IncrementalCheetahGenerator)
+    skin_dict = configobj.ConfigObj(interpolation=False)
+    skin_dict.update({
+        'REPORT_NAME': 'console',
+        'HTML_ROOT': 'html',
+        'CheetahGenerator': {
+            'summary_manifest': 'console_summaries.json',
+            'SummaryByMonth': {'NOAA_month': {'template': 'NOAA/NOAA-%Y-%m.txt.tmpl'}},
+            'SummaryByYear': {'NOAA_year': {'template': 'NOAA/NOAA-%Y.txt.tmpl'}},
+        }})
+    generator.config_dict = config_dict
+    generator.skin_dict = skin_dict
+    generator.gen_ts = gen_ts
+    generator.db_binder = None
+    return generator
+
+
+def touch(config_dict, name):
+    path = os.path.join(config_dict['WEEWX_ROOT'], 'html', 'NOAA', name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
+    return path
+
+
+def test_remove_summary_of_past_month(config_dict):
+    gen_ts = user.noaagenerator.month_start('2024-06') + 86400
+    generator = make_generator(config_dict, gen_ts)
+    month = touch(config_dict, 'NOAA-2024-03.txt')
+    other = touch(config_dict, 'NOAA-2024-04.txt')
+
+    span = weeutil.weeutil.archiveMonthSpan(user.noaagenerator.month_start('2024-03') + 1)
+    assert generator._remove_summary('SummaryByMonth', span) == 1
+    assert not os.path.exists(month)
+    assert os.path.exists(other)
+
+
+def test_current_month_is_kept(config_dict):
+    gen_ts = user.noaagenerator.month_start('2024-06') + 86400
+    generator = make_generator(config_dict, gen_ts)
+    path = touch(config_dict, 'NOAA-2024-06.txt')
+    span = weeutil.weeutil.archiveMonthSpan(gen_ts)
+    assert generator._remove_summary('SummaryByMonth', span) == 0
+    assert os.path.exists(path)
+
+
+def test_changed_month_removed_and_manifest_updated(config_dict, monkeypatch):
+    gen_ts = user.noaagenerator.month_start('2024-06') + 86400
+    generator = make_generator(config_dict, gen_ts)
+    manifest_path = user.davisconsoleutil.state_path(config_dict, 'console_summaries.json')
+    obs = user.noaagenerator.DEFAULT_OBS
+    user.davisconsoleutil.write_json(manifest_path, {'obs': obs, 'months': {'2024-03': [31, 8928, 1, 1.0]}})
+    month = touch(config_dict, 'NOAA-2024-03.txt')
+    year = touch(config_dict, 'NOAA-2023.txt')
+
+    fingerprints = {'2024-03': [31, 8928, 1, 2.0]}
+    monkeypatch.setattr(user.noaagenerator, 'month_fingerprints', lambda dbm, obs_types: fingerprints)
+    monkeypatch.setattr(weewx.cheetahgenerator.CheetahGenerator, 'run', lambda self: None)
+    generator.db_binder = type('Binder', (), {'get_manager': lambda self, binding: None})()
+    generator.run()
+
+    assert not os.path.exists(month)
+    assert os.path.exists(year)
+    assert user.davisconsoleutil.read_json(manifest_path)['months'] == fingerprints
+
+
+def test_failed_removal_keeps_old_manifest(config_dict, monkeypatch):
+    gen_ts = user.noaagenerator.month_start('2024-06') + 86400
+    generator = make_generator(config_dict, gen_ts)
+    manifest_path = user.davisconsoleutil.state_path(config_dict, 'console_summaries.json')
+    old = {'obs': user.noaagenerator.DEFAULT_OBS, 'months': {'2024-03': [31, 8928, 1, 1.0]}}
+    user.davisconsoleutil.write_json(manifest_path, old)
+
+    def fail(self, report_type, timespan):
+        raise OSError("read-only file system")
+    monkeypatch.setattr(user.noaagenerator, 'month_fingerprints',
+                        lambda dbm, obs_types: {'2024-03': [31, 8928, 1, 2.0]})
+    monkeypatch.setattr(user.noaagenerator.IncrementalCheetahGenerator, '_remove_summary', fail)
+    monkeypatch.setattr(weewx.cheetahgenerator.CheetahGenerator, 'run', lambda self: None)
+    generator.db_binder = type('Binder', (), {'get_manager': lambda self, binding: None})()
+    generator.run()
+
+    # The change is found again in the next run
+    assert user.davisconsoleutil.read_json(manifest_path) == old
+
+
+def test_month_start():
+    assert time.localtime(user.noaagenerator.month_start('2024-03'))[:3] == (2024, 3, 1)
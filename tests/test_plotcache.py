@@ -0,0 +1,115 @@
+"""Tests of user.plotcache: the series file and the tail reads"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import weewx.manager
+import weewx.xtypes
+import weeplot.utilities
+from weeutil.weeutil import TimeSpan
+
+import user.plotcache
+
+START = int(time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1)))
+
+
+@pytest.fixture(scope='module')
+def dbm(tmp_path_factory):
+    path = tmp_path_factory.mktemp('plotcache')
+    config = {
+        'WEEWX_ROOT': str(path),
+        'DataBindings': {'wx_binding': {'database': 'archive_sqlite',
+                                        'manager': 'weewx.manager.DaySummaryManager',
+                                        'table_name': 'archive',
+                                        'schema': 'schemas.wview_extended.schema'}},
+        'Databases': {'archive_sqlite': {'database_name': 'weewx.sdb', 'database_type': 'SQLite'}},
+        'DatabaseTypes': {'SQLite': {'driver': 'weedb.sqlite', 'SQLITE_ROOT': str(path)}}}
+    manager = weewx.manager.open_manager_with_config(config, 'wx_binding', initialize=True)
+    # 16 days of 5 minute records
+    manager.addRecord(record(START + 300 * i) for i in range(1, 12 * 24 * 16 + 1))
+    manager.close()
+    # Opened again, like the report thread does, so last_timestamp is set
+    manager = weewx.manager.open_manager_with_config(config, 'wx_binding')
+    yield manager
+    manager.close()
+
+
+def record(ts):
+    return {'dateTime': ts, 'usUnits': weewx.US, 'interval': 5,
+            'outTemp': None if ts % 7 == 0 else 30.0 + (ts // 300) % 37,
+            'windSpeed': (ts // 300) % 11, 'windDir': (ts // 300) % 360}
+
+
+def make_generator(path, max_age=86400):
+    generator = user.plotcache.CachedImageGenerator.__new__(user.plotcache.CachedImageGenerator)
+    generator.max_age = max_age
+    generator.exclude_types = set()
+    generator.stats = {'tail': 0, 'full': 0, 'direct': 0}
+    generator.thread_id = threading.current_thread().ident
+    generator.original_get_series = weewx.xtypes.get_series
+    generator.cache = user.plotcache.SeriesCache(path)
+    return generator
+
+
+def plot_span(dbm, length):
+    last = dbm.lastGoodStamp()
+    start, stop, _ = weeplot.utilities.scaletime(last - length, last)
+    return TimeSpan(start, stop)
+
+
+def test_file_round_trip(tmp_path):
+    path = str(tmp_path / 'series.bin')
+    cache = user.plotcache.SeriesCache(path)
+    units = ['unix_epoch', 'group_time'] * 2 + ['degree_F', 'group_temperature']
+    cache.series['a'] = user.plotcache.Series([1, 2], [2, 3], [1.5, None], units, 1, 3, time.time())
+    cache.series['b'] = user.plotcache.Series([1], [2], [complex(1, -2)], units, 1, 2, time.time())
+    cache.save(86400)
+
+    loaded = user.plotcache.SeriesCache(path)
+    assert loaded.series['a'].data == [1.5, None]
+    assert loaded.series['a'].units == units
+    assert loaded.series['b'].data == [complex(1, -2)]
+
+
+def test_unused_series_kept_until_max_age(tmp_path):
+    path = str(tmp_path / 'series.bin')
+    cache = user.plotcache.SeriesCache(path)
+    now = time.time()
+    units = ['unix_epoch', 'group_time'] * 3
+    cache.series['year plot, skipped this run'] = user.plotcache.Series([1], [2], [1.0], units, 1, 2, now - 3600)
+    cache.series['too old'] = user.plotcache.Series([1], [2], [1.0], units, 1, 2, now - 90000)
+    cache.save(86400, now)
+
+    assert sorted(user.plotcache.SeriesCache(path).series) == ['year plot, skipped this run']
+
+
+@pytest.mark.parametrize('obs_type, length, aggregate_type, aggregate_interval', [
+    ('outTemp', 97200, None, None),
+    ('outTemp', 7 * 86400, 'avg', 3600),
+    ('outTemp', 14 * 86400, 'max', 86400),
+    ('windvec', 97200, None, None),
+])
+def test_tail_read_equals_full_read(tmp_path, dbm, obs_type, length, aggregate_type, aggregate_interval):
+    path = str(tmp_path / 'series.bin')
+    generator = make_generator(path)
+    options = {'time_length': length}
+    generator.get_series(obs_type, plot_span(dbm, length), dbm, aggregate_type, aggregate_interval, **options)
+    generator.cache.save(generator.max_age)
+
+    for step in (1, 2, 12, 288):
+        last = dbm.lastGoodStamp()
+        dbm.addRecord(record(last + 300 * i) for i in range(1, step + 1))
+        # A new run reads the file again
+        generator.cache = user.plotcache.SeriesCache(path)
+        span = plot_span(dbm, length)
+        got = generator.get_series(obs_type, span, dbm, aggregate_type, aggregate_interval, **options)
+        generator.cache.save(generator.max_age)
+        expected = weewx.xtypes.get_series(obs_type, span, dbm, aggregate_type, aggregate_interval, **options)
+        assert got == expected
+
+    assert generator.stats['full'] == 1
+    assert generator.stats['tail'] == 4
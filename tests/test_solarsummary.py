@@ -0,0 +1,66 @@
+"""Tests of user.solarsummary: the read-only search list and its ValueHelpers"""
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import weewx
+import weewx.defaults
+import weewx.manager
+import weewx.units
+from weeutil.weeutil import TimeSpan
+
+import user.solarsummary
+
+# 2024-06-15 12:00 UTC
+REPORT_TS = 1718452800
+
+
+@pytest.fixture
+def config(config_dict):
+    config_dict['Station'] = {'latitude': '47.0', 'longitude': '15.0'}
+    config_dict['SolarSummary'] = {'backend': 'noaa'}
+    config_dict['RadiationDays'] = {'sunshine_min': '18'}
+    return config_dict
+
+
+@pytest.fixture
+def dbm(config):
+    manager = weewx.manager.open_manager_with_config(config, 'wx_binding', initialize=True)
+    yield manager
+    manager.close()
+
+
+def search_list(config, dbm):
+    generator = type('Generator', (), {})()
+    generator.config_dict = config
+    generator.formatter = weewx.units.Formatter.fromSkinDict(weewx.defaults.defaults)
+    generator.converter = weewx.units.Converter.fromSkinDict(weewx.defaults.defaults)
+    search = user.solarsummary.SolarSummarySearch(generator)
+    timespan = TimeSpan(REPORT_TS - 300, REPORT_TS)
+    return search.get_extension_list(timespan, lambda binding=None: dbm)[0]['solar_summary']
+
+
+def test_search_list_does_not_write(config, dbm):
+    tags = search_list(config, dbm)
+    assert tags.days == []
+    assert tags.today is None
+    assert 'solar_day' not in dbm.connection.tables()
+
+
+def test_tags_are_value_helpers(config, dbm):
+    store = user.solarsummary.store_from_config(config, dbm)
+    assert store.fill(REPORT_TS - 86400 * 20, REPORT_TS + 86400) > 0
+    rows = dbm.getSql("SELECT COUNT(*) FROM solar_day")[0]
+
+    tags = search_list(config, dbm)
+    today = tags.today
+    assert isinstance(today['dayLength'], weewx.units.ValueHelper)
+    assert today['dayLength'].value_t[1] == 'second'
+    assert 15 * 3600 < today['dayLength'].raw < 16 * 3600
+    assert today['sunshineDur'].raw is None
+    assert "Wh/m²" in str(today['clearSkyEnergy'])
+    # 26 to 31 May, 1 to 16 June
+    assert [m['days'].raw for m in tags.months] == [6, 16]
+    # Read only
+    assert dbm.getSql("SELECT COUNT(*) FROM solar_day")[0] == rows
@@ -0,0 +1,110 @@
+"""Tests of user.sunrainduration: the checkpoint over a restart"""
+
+import time
+
+import pytest
+
+pytest.importorskip('weewx')
+
+import weewx
+
+import user.davisconsoleutil
+import user.sunrainduration
+
+
+class Engine(object):
+    def bind(self, event_type, callback):
+        pass
+
+
+class Event(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+@pytest.fixture
+def config(config_dict):
+    config_dict['Station'] = {'latitude': '47.0', 'longitude': '15.0'}
+    config_dict['RadiationDays'] = {'rainDur_loop': '1', 'state_max_age': '900'}
+    return config_dict
+
+
+def loop(service, ts, rain):
+    service.newLoopPacket(Event(packet={'dateTime': ts, 'usUnits': weewx.US, 'rain': rain}))
+
+
+def archive(service, ts, rain):
+    record = {'dateTime': ts, 'usUnits': weewx.US, 'interval': 5, 'rain': rain}
+    service.newArchiveRecord(Event(record=record))
+    return record['rainDur']
+
+
+def restart(service, config, downtime):
+    """Shut down, the checkpoint is downtime seconds old when the service starts again"""
+    service.shutDown()
+    path = user.davisconsoleutil.state_path(config, 'sunrainduration_state.json')
+    state = user.davisconsoleutil.read_json(path)
+    state['saved'] = time.time() - downtime
+    user.davisconsoleutil.write_json(path, state)
+    return user.sunrainduration.SunshineDuration(Engine(), config)
+
+
+def running(config, start):
+    """A service which has seen loop packets and one archive record"""
+    service = user.sunrainduration.SunshineDuration(Engine(), config)
+    loop(service, start - 300, 0.0)
+    archive(service, start - 300, 0.0)
+    loop(service, start, 0.0)
+    archive(service, start, 0.0)
+    return service
+
+
+def test_downtime_not_counted(config):
+    start = 1717236000
+    service = running(config, start)
+    loop(service, start + 60, 0.01)
+    loop(service, start + 120, 0.01)
+    # Down for 600 sec, the checkpoint is restored
+    service = restart(service, config, 600)
+    loop(service, start + 720, 0.01)
+    loop(service, start + 780, 0.01)
+    # The 120 sec before the restart belong to the interval ending at start + 300
+    assert archive(service, start + 800, 0.02) == 60
+
+
+def test_records_before_first_loop_packet_whole_interval(config):
+    start = 1717236000
+    service = running(config, start)
+    loop(service, start + 60, 0.01)
+    service = restart(service, config, 600)
+    # Records of the downtime from the logger, before the first loop packet
+    assert archive(service, start + 300, 0.01) == 300
+    assert archive(service, start + 600, 0.0) == 0
+    assert archive(service, start + 900, 0.02) == 300
+
+
+def test_record_older_than_checkpoint_keeps_counters(config):
+    start = 1717236000
+    service = running(config, start)
+    loop(service, start + 60, 0.01)
+    service = restart(service, config, 60)
+    loop(service, start + 120, 0.01)
+    # A late record of an interval before the checkpoint
+    assert archive(service, start - 600, 0.01) == 300
+    loop(service, start + 180, 0.01)
+    assert archive(service, start + 300, 0.01) == 120
+
+
+def test_old_checkpoint_not_restored(config):
+    start = 1717236000
+    service = running(config, start)
+    loop(service, start + 60, 0.01)
+    service = restart(service, config, 1000)
+    assert all(channel.seconds == 0 and channel.restored_ts == 0 for channel in service.channels)
+
+
+def test_interpolate_without_loop_logged(config, caplog):
+    config['RadiationDays']['duration_mode'] = 'interpolate'
+    user.sunrainduration.SunshineDuration(Engine(), config)
+    # rainDur_loop = 1 in the test config, hailDur_loop defaults to 0
+    assert "interpolate is ignored for hail" in caplog.text